@@ -0,0 +1,47 @@
+import time
+
+from django.db import connection
+
+import metrics_utils
+
+
+class RequestMetricsMiddleware:
+    """Observe each request's duration and database query count, labelled by URL route (not path)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics_utils.METRICS_ENABLED:
+            return self.get_response(request)
+
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.monotonic()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        elapsed = time.monotonic() - started
+
+        # Streaming responses (job events) are timed until their headers, not until they end.
+        match = getattr(request, "resolver_match", None)
+        route = "/" + match.route if match is not None else "unmatched"
+        metrics_utils.observe(
+            "http_request_duration_seconds",
+            elapsed,
+            route=route,
+            method=request.method,
+            status=response.status_code,
+        )
+        metrics_utils.observe(
+            "http_request_db_queries",
+            queries,
+            buckets=metrics_utils.QUERY_COUNT_BUCKETS,
+            route=route,
+            method=request.method,
+        )
+        return response
@@ -57,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -102,6 +103,14 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": SQLITE_PATH,
+        # Web and extraction worker processes write to the same file. WAL lets status reads
+        # proceed while the worker writes; IMMEDIATE takes the write lock up front instead of
+        # failing on an upgrade from a read lock.
+        "OPTIONS": {
+            "timeout": 20,
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+            "transaction_mode": "IMMEDIATE",
+        },
     }
 }
 
@@ -149,13 +158,66 @@ MEDIA_ROOT = BASE_DIR / "media"
 # File-based cache so request cancellation works across processes.
 CACHE_DIR = BASE_DIR / ".cache" / "django"
 os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Content-addressed OCR/LLM results; kept on the volume so redeploys keep it warm.
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR")
+if not EXTRACTION_CACHE_DIR:
+    if os.getenv("FLY_APP_NAME"):
+        EXTRACTION_CACHE_DIR = "/data/extraction_cache"
+    else:
+        EXTRACTION_CACHE_DIR = str(BASE_DIR / ".cache" / "extraction")
+os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
         "LOCATION": str(CACHE_DIR),
-    }
+    },
+    "extraction": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": EXTRACTION_CACHE_DIR,
+        "TIMEOUT": int(os.getenv("EXTRACTION_CACHE_TTL", str(60 * 60 * 24 * 30))),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "5000")),
+            "CULL_FREQUENCY": 4,
+        },
+    },
 }
 
+# Background extraction worker (python manage.py run_extraction_worker).
+# Jobs in flight per worker: OCR waits on the OCR pool, LLM calls on LLM_MAX_CONCURRENCY.
+EXTRACTION_WORKER_CONCURRENCY = int(os.getenv("EXTRACTION_WORKER_CONCURRENCY", "6"))
+EXTRACTION_WORKER_POLL_INTERVAL = float(os.getenv("EXTRACTION_WORKER_POLL_INTERVAL", "1.0"))
+# The worker touches its running jobs this often; one silent for EXTRACTION_JOB_STALE_SECONDS lost its
+# worker and is reclaimed, well before event streams give up on it (EXTRACTION_EVENTS_TIMEOUT).
+EXTRACTION_JOB_HEARTBEAT_SECONDS = float(os.getenv("EXTRACTION_JOB_HEARTBEAT_SECONDS", "30"))
+EXTRACTION_JOB_STALE_SECONDS = int(os.getenv("EXTRACTION_JOB_STALE_SECONDS", "120"))
+EXTRACTION_JOB_MAX_ATTEMPTS = int(os.getenv("EXTRACTION_JOB_MAX_ATTEMPTS", "2"))
+EXTRACTION_JOB_RETENTION_HOURS = int(os.getenv("EXTRACTION_JOB_RETENTION_HOURS", "24"))
+# Server-Sent Events stream for job progress (/process/jobs/<id>/events). The worker pushes
+# changes through notify_utils; the poll interval only covers a missed notification.
+EXTRACTION_EVENTS_POLL_INTERVAL = float(os.getenv("EXTRACTION_EVENTS_POLL_INTERVAL", "5"))
+EXTRACTION_EVENTS_PING_INTERVAL = float(os.getenv("EXTRACTION_EVENTS_PING_INTERVAL", "15"))
+EXTRACTION_EVENTS_TIMEOUT = float(os.getenv("EXTRACTION_EVENTS_TIMEOUT", "600"))
+# Batch uploads (/process/batches): ZIP archives and/or multiple PDFs.
+EXTRACTION_BATCH_MAX_FILES = int(os.getenv("EXTRACTION_BATCH_MAX_FILES", "300"))
+EXTRACTION_BATCH_MAX_FILE_BYTES = int(os.getenv("EXTRACTION_BATCH_MAX_FILE_BYTES", str(25 * 1024 * 1024)))
+EXTRACTION_BATCH_MAX_TOTAL_BYTES = int(os.getenv("EXTRACTION_BATCH_MAX_TOTAL_BYTES", str(500 * 1024 * 1024)))
+EXTRACTION_BATCH_EVENTS_TIMEOUT = float(os.getenv("EXTRACTION_BATCH_EVENTS_TIMEOUT", "3600"))
+
+# Recurring suppliers' invoices are read with layouts learned from approved submissions, skipping the LLM.
+SUPPLIER_TEMPLATES_ENABLED = os.getenv("SUPPLIER_TEMPLATES", "1") == "1"
+# Uploads whose OCR text is a near-duplicate of a past submission reuse its data; only differing fields are re-asked.
+NEAR_DUPLICATES_ENABLED = os.getenv("NEAR_DUPLICATES", "1") == "1"
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+# The LLM writes "*_reasoning" explanations only in this debug mode (or for organizations / requests asking for it).
+LLM_REASONING_ENABLED = os.getenv("LLM_REASONING", os.getenv("LOG_LLM_REASONING", "0")) == "1"
+# Prometheus metrics are served without credentials on this address, which must only be reachable
+# from the private network (Fly scrapes it; it is not in fly.toml's [http_service]). Empty disables it.
+METRICS_BIND = os.getenv("METRICS_BIND", "0.0.0.0:9091")
+# Also serve /metrics on the public port, to scrapers sending "Authorization: Bearer <token>".
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
 if AWS_STORAGE_BUCKET_NAME:
     INSTALLED_APPS.append("storages")
@@ -29,6 +29,7 @@ urlpatterns = [
     path("", include("organizations.urls")),
     path("auth/", include("django.contrib.auth.urls")),
     path("admin/", admin.site.urls),
+    path("metrics", views.metrics, name="metrics"),
 ]
 
 if settings.DEBUG:
@@ -1,6 +1,16 @@
+import hmac
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Min
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.views.decorators.http import require_GET
 
+import metrics_utils
 from config.header import build_index_context
+from invoices.models import InvoiceExtractionJob
 
 
 def landing(request):
@@ -9,3 +19,58 @@ def landing(request):
 
 def index(request):
     return render(request, "index.html", build_index_context(request))
+
+
+def _job_queue_gauges():
+    active = (
+        InvoiceExtractionJob.objects.filter(
+            status__in=[InvoiceExtractionJob.STATUS_QUEUED, InvoiceExtractionJob.STATUS_RUNNING]
+        )
+        .values("status")
+        .annotate(count=Count("id"), oldest=Min("created_at"))
+    )
+    by_status = {row["status"]: row for row in active}
+    gauges = []
+    for status in (InvoiceExtractionJob.STATUS_QUEUED, InvoiceExtractionJob.STATUS_RUNNING):
+        row = by_status.get(status)
+        gauges.append(
+            ("invoice_extraction_jobs", "Extraction jobs by status.", {"status": status}, row["count"] if row else 0)
+        )
+    oldest = by_status.get(InvoiceExtractionJob.STATUS_QUEUED, {}).get("oldest")
+    gauges.append(
+        (
+            "invoice_extraction_oldest_queued_seconds",
+            "Age of the oldest queued extraction job.",
+            {},
+            (timezone.now() - oldest).total_seconds() if oldest else 0,
+        )
+    )
+    return gauges
+
+
+def render_metrics() -> str:
+    """Prometheus metrics of all workers, as last flushed to the shared metrics file."""
+    try:
+        return metrics_utils.render_prometheus(_job_queue_gauges())
+    finally:
+        # Also called from the internal metrics server's threads (see the serve command).
+        connection.close()
+
+
+@require_GET
+def metrics(request):
+    """
+    Metrics on the public port, for scrapers that can send METRICS_TOKEN.
+
+    Without a token this route does not exist; scrape METRICS_BIND on the
+    private network instead.
+    """
+    if not metrics_utils.METRICS_ENABLED or not settings.METRICS_TOKEN:
+        raise Http404
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied, settings.METRICS_TOKEN):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        metrics_utils.render_prometheus(_job_queue_gauges()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,472 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+import httpx
+
+from prompts import extraction_fields
+
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_BASE_URL = "https://api.replicate.com"
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+# Streamed output is sent in chunks of about this many characters, spread over the run time.
+STREAM_CHUNK_CHARS = 24
+# Record mode: how long to wait for the real prediction to finish.
+RECORD_TIMEOUT_SECONDS = 600
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Latency distribution from a spec: "fixed:S", "uniform:LOW,HIGH",
+    "lognormal:MEDIAN,SIGMA" or "exponential:MEAN" (seconds).
+    """
+    kind, _, args = (spec or "fixed:0").partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()]
+    try:
+        if kind == "fixed":
+            return lambda rng: values[0]
+        if kind == "uniform":
+            return lambda rng: rng.uniform(values[0], values[1])
+        if kind == "lognormal":
+            return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+        if kind == "exponential":
+            return lambda rng: rng.expovariate(1.0 / values[0])
+    except IndexError:
+        pass
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+def cassette_key(model: str, input: dict) -> str:
+    """Recordings are matched on the model and the exact input (prompt, max_tokens, ...)."""
+    payload = json.dumps({"model": model, "input": input}, sort_keys=True, ensure_ascii=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Recorded prediction outcomes in a JSON-lines file, one prediction per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.entries.get(key)
+
+    def add(self, entry: dict) -> None:
+        with self._lock:
+            self.entries[entry["key"]] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def canned_output(prompt: str) -> str:
+    """
+    A valid extraction answer with every field empty, or only the fields a field-level prompt asks for.
+
+    "*_reasoning" keys are included (empty) when the prompt asks for them.
+    """
+    fields = [field for field in extraction_fields if field in (prompt or "")] or extraction_fields
+    answer = {key: "" for key in dict.fromkeys(re.findall(r'"(\w+_reasoning)"', prompt or ""))}
+    answer.update({field: {"value": "", "confidence": "low confidence"} for field in fields})
+    return json.dumps(answer)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakePrediction:
+    def __init__(self, model: str, input: dict, outcome: dict, start_latency: float, run_latency: float):
+        self.id = uuid.uuid4().hex[:26]
+        self.model = model
+        self.input = input
+        self.outcome = outcome
+        self.created = time.time()
+        self.started = self.created + start_latency
+        self.completed = self.started + run_latency
+        self.canceled_at: Optional[float] = None
+        self.webhook: Optional[str] = None
+        self.webhook_sent = False
+        self.lock = threading.Lock()
+
+    @property
+    def status(self) -> str:
+        now = time.time()
+        if self.canceled_at is not None and self.canceled_at < self.completed:
+            return "canceled"
+        if now < self.started:
+            return "starting"
+        if now < self.completed:
+            return "processing"
+        return self.outcome["status"]
+
+    def finished_at(self) -> float:
+        return self.canceled_at if self.status == "canceled" else self.completed
+
+    def to_json(self, base_url: str, stream: bool) -> dict:
+        status = self.status
+        urls = {
+            "get": f"{base_url}/v1/predictions/{self.id}",
+            "cancel": f"{base_url}/v1/predictions/{self.id}/cancel",
+        }
+        if stream:
+            urls["stream"] = f"{base_url}/v1/predictions/{self.id}/stream"
+        terminal = status in TERMINAL_STATUSES
+        return {
+            "id": self.id,
+            "model": self.model,
+            "version": "fake",
+            "input": self.input,
+            "output": self.outcome["output"] if status == "succeeded" else None,
+            "logs": "",
+            "error": self.outcome.get("error") if status == "failed" else None,
+            "status": status,
+            "created_at": datetime.fromtimestamp(self.created, timezone.utc).isoformat(),
+            "started_at": datetime.fromtimestamp(self.started, timezone.utc).isoformat() if status != "starting" else None,
+            "completed_at": datetime.fromtimestamp(self.finished_at(), timezone.utc).isoformat() if terminal else None,
+            "urls": urls,
+            "metrics": {"predict_time": round(self.completed - self.started, 3)} if terminal else {},
+        }
+
+
+class FakeReplicate:
+    """
+    In-memory stand-in for the Replicate predictions API.
+
+    mode "canned" answers every prediction with canned_output() (or a fixed
+    output); "replay" answers from a cassette; "record" forwards creations
+    to the real API, waits for the outcome and appends it to the cassette.
+    """
+
+    def __init__(
+        self,
+        mode: str = "canned",
+        cassette: Optional[Cassette] = None,
+        latency: str = "fixed:0.5",
+        start_latency: str = "fixed:0.1",
+        failure_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        http_error_rate: float = 0.0,
+        rate_limit_per_minute: float = 0.0,
+        output: Optional[str] = None,
+        replay_latency: bool = True,
+        webhook_secret: str = "",
+        upstream_url: str = UPSTREAM_BASE_URL,
+        upstream_token: str = "",
+        seed: Optional[int] = None,
+    ):
+        if mode not in ("canned", "replay", "record"):
+            raise ValueError(f"Unknown mode: {mode}")
+        if mode != "canned" and cassette is None:
+            raise ValueError(f"Mode {mode} needs a cassette.")
+        self.mode = mode
+        self.cassette = cassette
+        self.latency = parse_latency(latency)
+        self.start_latency = parse_latency(start_latency)
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.http_error_rate = http_error_rate
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.output = output
+        self.replay_latency = replay_latency
+        self.webhook_secret = webhook_secret
+        self.upstream_url = upstream_url.rstrip("/")
+        self.upstream_token = upstream_token
+        self.rng = random.Random(seed)
+        self.predictions: Dict[str, FakePrediction] = {}
+        self.streams: Dict[str, bool] = {}
+        self.stats = {"created": 0, "throttled": 0, "http_errors": 0, "canceled": 0, "replay_misses": 0}
+        self._lock = threading.Lock()
+        self._window: list = []
+
+    # Injected faults
+
+    def should_throttle(self) -> bool:
+        with self._lock:
+            if self.throttle_rate and self.rng.random() < self.throttle_rate:
+                self.stats["throttled"] += 1
+                return True
+            if self.rate_limit_per_minute:
+                now = time.monotonic()
+                self._window = [at for at in self._window if now - at < 60]
+                if len(self._window) >= self.rate_limit_per_minute:
+                    self.stats["throttled"] += 1
+                    return True
+                self._window.append(now)
+            return False
+
+    def should_fail_request(self) -> bool:
+        with self._lock:
+            if self.http_error_rate and self.rng.random() < self.http_error_rate:
+                self.stats["http_errors"] += 1
+                return True
+            return False
+
+    # Predictions
+
+    def create(self, model: str, body: dict) -> FakePrediction:
+        input = body.get("input") or {}
+        with self._lock:
+            start_latency = max(self.start_latency(self.rng), 0.0)
+            run_latency = max(self.latency(self.rng), 0.0)
+            failed = self.failure_rate and self.rng.random() < self.failure_rate
+
+        outcome = None
+        if self.mode == "replay":
+            recorded = self.cassette.get(cassette_key(model, input))
+            if recorded is None:
+                self.stats["replay_misses"] += 1
+                outcome = {"status": "failed", "output": None, "error": "No recording for this input (replay mode)."}
+            else:
+                outcome = {key: recorded.get(key) for key in ("status", "output", "error")}
+                if self.replay_latency and recorded.get("latency") is not None:
+                    run_latency = recorded["latency"]
+        elif self.mode == "record":
+            outcome, run_latency = self._record(model, input)
+            start_latency = 0.0
+        if outcome is None:
+            output = self.output if self.output is not None else canned_output(input.get("prompt", ""))
+            outcome = {"status": "succeeded", "output": [output], "error": None}
+        if failed:
+            outcome = {"status": "failed", "output": None, "error": "Injected failure."}
+
+        prediction = FakePrediction(model, input, outcome, start_latency, run_latency)
+        prediction.webhook = body.get("webhook")
+        with self._lock:
+            self.predictions[prediction.id] = prediction
+            self.streams[prediction.id] = bool(body.get("stream"))
+            self.stats["created"] += 1
+        if prediction.webhook:
+            threading.Thread(target=self._deliver_webhook, args=(prediction,), daemon=True).start()
+        return prediction
+
+    def _record(self, model: str, input: dict):
+        headers = {"Authorization": f"Bearer {self.upstream_token}", "Prefer": "wait=60"}
+        started = time.monotonic()
+        with httpx.Client(base_url=self.upstream_url, headers=headers, timeout=90) as client:
+            response = client.post(f"/v1/models/{model}/predictions", json={"input": input})
+            response.raise_for_status()
+            data = response.json()
+            while data["status"] not in TERMINAL_STATUSES:
+                if time.monotonic() - started > RECORD_TIMEOUT_SECONDS:
+                    raise TimeoutError(f"Upstream prediction {data['id']} did not finish.")
+                time.sleep(1)
+                data = client.get(f"/v1/predictions/{data['id']}").json()
+        latency = (data.get("metrics") or {}).get("predict_time") or (time.monotonic() - started)
+        entry = {
+            "key": cassette_key(model, input),
+            "model": model,
+            "input": input,
+            "status": data["status"],
+            "output": data.get("output"),
+            "error": data.get("error"),
+            "latency": latency,
+            "recorded_at": _now_iso(),
+        }
+        self.cassette.add(entry)
+        logger.info("Recorded %s prediction for %s (%.1fs)", entry["status"], model, latency)
+        return {key: entry[key] for key in ("status", "output", "error")}, latency
+
+    def get(self, prediction_id: str) -> Optional[FakePrediction]:
+        with self._lock:
+            return self.predictions.get(prediction_id)
+
+    def cancel(self, prediction_id: str) -> Optional[FakePrediction]:
+        prediction = self.get(prediction_id)
+        if prediction is not None:
+            with prediction.lock:
+                if prediction.status not in TERMINAL_STATUSES:
+                    prediction.canceled_at = time.time()
+                    self.stats["canceled"] += 1
+        return prediction
+
+    def wait(self, prediction: FakePrediction, seconds: float) -> None:
+        deadline = time.time() + seconds
+        while prediction.status not in TERMINAL_STATUSES and time.time() < deadline:
+            time.sleep(min(0.05, max(deadline - time.time(), 0)))
+
+    # Webhooks (Standard Webhooks signatures, as Replicate sends them)
+
+    def signed_webhook_headers(self, body: str) -> Dict[str, str]:
+        webhook_id = f"msg_{uuid.uuid4().hex}"
+        timestamp = str(int(time.time()))
+        headers = {"webhook-id": webhook_id, "webhook-timestamp": timestamp, "content-type": "application/json"}
+        if self.webhook_secret:
+            key = base64.b64decode(self.webhook_secret.split("_", 1)[-1])
+            digest = hmac.new(key, f"{webhook_id}.{timestamp}.{body}".encode(), hashlib.sha256).digest()
+            headers["webhook-signature"] = "v1," + base64.b64encode(digest).decode()
+        return headers
+
+    def _deliver_webhook(self, prediction: FakePrediction) -> None:
+        self.wait(prediction, RECORD_TIMEOUT_SECONDS)
+        with prediction.lock:
+            if prediction.webhook_sent:
+                return
+            prediction.webhook_sent = True
+        body = json.dumps(prediction.to_json("", stream=False))
+        try:
+            httpx.post(prediction.webhook, content=body, headers=self.signed_webhook_headers(body), timeout=10)
+        except httpx.HTTPError as exc:
+            logger.warning("Webhook delivery to %s failed: %s", prediction.webhook, exc)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeReplicate/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def fake(self) -> FakeReplicate:
+        return self.server.fake
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]}"
+
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.address_string(), *args)
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, detail: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {"title": self.responses.get(status, ("Error",))[0], "detail": detail, "status": status}, headers)
+
+    def _prediction(self, prediction: FakePrediction, status: int = 200) -> None:
+        self._send_json(status, prediction.to_json(self.base_url, self.fake.streams.get(prediction.id, False)))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+
+        if self.fake.should_fail_request():
+            return self._error(500, "Injected server error.")
+
+        # POST /v1/models/{owner}/{name}/predictions
+        if len(parts) == 5 and parts[:2] == ["v1", "models"] and parts[4] == "predictions":
+            if self.fake.should_throttle():
+                return self._error(429, "Request was throttled. Expected available in 1 second.", {"Retry-After": "1"})
+            try:
+                prediction = self.fake.create(f"{parts[2]}/{parts[3]}", body)
+            except Exception as exc:
+                logger.exception("Fake prediction failed: %s", exc)
+                return self._error(502, f"Upstream error: {exc}")
+            prefer = self.headers.get("Prefer", "")
+            if prefer.startswith("wait"):
+                _, _, seconds = prefer.partition("=")
+                self.fake.wait(prediction, float(seconds or 60))
+            return self._prediction(prediction, 201)
+
+        # POST /v1/predictions/{id}/cancel
+        if len(parts) == 4 and parts[:2] == ["v1", "predictions"] and parts[3] == "cancel":
+            prediction = self.fake.cancel(parts[2])
+            if prediction is None:
+                return self._error(404, "Prediction not found.")
+            return self._prediction(prediction)
+
+        return self._error(404, "Not found.")
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if len(parts) >= 3 and parts[:2] == ["v1", "predictions"]:
+            prediction = self.fake.get(parts[2])
+            if prediction is None:
+                return self._error(404, "Prediction not found.")
+            if len(parts) == 4 and parts[3] == "stream":
+                return self._stream(prediction)
+            if len(parts) == 3:
+                if self.fake.should_fail_request():
+                    return self._error(503, "Injected server error.")
+                return self._prediction(prediction)
+        if parts == ["fake", "stats"]:
+            return self._send_json(200, self.fake.stats)
+        return self._error(404, "Not found.")
+
+    def _stream(self, prediction: FakePrediction) -> None:
+        """Server-sent events: output chunks spread over the run time, then done (or error)."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        output = prediction.outcome.get("output")
+        text = "".join(output) if isinstance(output, list) else str(output or "")
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        event_id = 0
+
+        def send(event: str, data: str) -> None:
+            nonlocal event_id
+            event_id += 1
+            lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+            self.wfile.write(f"id: {event_id}\nevent: {event}\n{lines}\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            while prediction.status == "starting":
+                time.sleep(0.02)
+            if prediction.outcome["status"] == "succeeded":
+                for index, chunk in enumerate(chunks):
+                    due = prediction.started + (prediction.completed - prediction.started) * (index + 1) / len(chunks)
+                    while time.time() < due and prediction.status == "processing":
+                        time.sleep(min(0.02, max(due - time.time(), 0)))
+                    if prediction.status == "canceled":
+                        break
+                    send("output", chunk)
+            else:
+                self.fake.wait(prediction, RECORD_TIMEOUT_SECONDS)
+            status = prediction.status
+            if status == "failed":
+                send("error", json.dumps({"detail": prediction.outcome.get("error")}))
+            send("done", json.dumps({"reason": "canceled"} if status == "canceled" else {}))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class FakeReplicateServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fake: FakeReplicate):
+        super().__init__(address, _Handler)
+        self.fake = fake
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_background(self) -> threading.Thread:
+        """Serve from a daemon thread (for benchmarks running in the same process)."""
+        thread = threading.Thread(target=self.serve_forever, name="fake-replicate", daemon=True)
+        thread.start()
+        return thread
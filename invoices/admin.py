@@ -1,6 +1,12 @@
 from django.contrib import admin
 
-from .models import InvoiceSubmission, InvoiceReviewAssignment
+from .models import (
+    InvoiceSubmission,
+    InvoiceReviewAssignment,
+    InvoiceExtractionBatch,
+    InvoiceExtractionJob,
+    SupplierTemplate,
+)
 
 
 @admin.register(InvoiceSubmission)
@@ -31,3 +37,42 @@ class InvoiceReviewAssignmentAdmin(admin.ModelAdmin):
     )
     list_filter = ("status",)
     search_fields = ("submission__id", "reviewer__email", "assigned_by__email")
+
+
+@admin.register(InvoiceExtractionJob)
+class InvoiceExtractionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "request_id",
+        "requested_by",
+        "status",
+        "error_code",
+        "attempts",
+        "created_at",
+        "finished_at",
+    )
+    list_filter = ("status", "error_code")
+    search_fields = ("id", "request_id", "requested_by__email")
+    raw_id_fields = ("batch",)
+
+
+@admin.register(InvoiceExtractionBatch)
+class InvoiceExtractionBatchAdmin(admin.ModelAdmin):
+    list_display = ("id", "request_id", "requested_by", "file_count", "created_at")
+    search_fields = ("id", "request_id", "requested_by__email")
+
+
+@admin.register(SupplierTemplate)
+class SupplierTemplateAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "organization",
+        "supplier_key",
+        "learned_count",
+        "hit_count",
+        "miss_count",
+        "last_used_at",
+        "updated_at",
+    )
+    search_fields = ("organization__name", "supplier_key")
+    raw_id_fields = ("learned_from",)
@@ -0,0 +1,107 @@
+import multiprocessing
+import random
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from notify_utils import NotificationBus, cancel_key
+from utils import get_cancel_cache_key
+
+
+def _publish_cancels(directory, conn) -> None:
+    # Plays the web process: publishes each cancel it is handed and reports when it did.
+    bus = NotificationBus(directory)
+    while True:
+        key = conn.recv()
+        if key is None:
+            break
+        published_at = time.monotonic()
+        bus.publish(key)
+        conn.send(published_at)
+
+
+class Command(BaseCommand):
+    help = "Measure cancel-to-release latency of a waiting extraction (push vs. cache-flag polling)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=0.75,
+            help="Interval of the cache-flag polling baseline.",
+        )
+        parser.add_argument(
+            "--skip-polling",
+            action="store_true",
+            help="Only measure push cancellation.",
+        )
+
+    def handle(self, *args, **options):
+        iterations = max(options["iterations"], 1)
+        self._report("push", self._measure_push(iterations))
+        if not options["skip_polling"]:
+            self._report(
+                f"poll {options['poll_interval']:.2f}s",
+                self._measure_polling(iterations, options["poll_interval"]),
+            )
+
+    def _measure_push(self, iterations):
+        latencies = []
+        with tempfile.TemporaryDirectory() as directory:
+            bus = NotificationBus(directory)
+            bus.start()
+            ctx = multiprocessing.get_context("spawn")
+            conn, child_conn = ctx.Pipe()
+            publisher = ctx.Process(target=_publish_cancels, args=(directory, child_conn), daemon=True)
+            publisher.start()
+            try:
+                for _ in range(iterations):
+                    key = cancel_key(uuid.uuid4().hex)
+                    subscription = bus.subscribe(key)
+                    conn.send(key)
+                    if not subscription.wait(timeout=5):
+                        raise RuntimeError("Cancel notification was not delivered.")
+                    released_at = time.monotonic()
+                    # CLOCK_MONOTONIC is system-wide, so both processes share the time base
+                    latencies.append(released_at - conn.recv())
+                    bus.unsubscribe(subscription)
+            finally:
+                conn.send(None)
+                publisher.join(timeout=5)
+                bus.stop()
+        return latencies
+
+    def _measure_polling(self, iterations, poll_interval):
+        latencies = []
+        for _ in range(iterations):
+            flag = get_cancel_cache_key(f"benchmark-{uuid.uuid4().hex}")
+            released = {}
+
+            def wait_for_flag():
+                while not cache.get(flag):
+                    time.sleep(poll_interval)
+                released["at"] = time.monotonic()
+
+            waiter = threading.Thread(target=wait_for_flag)
+            waiter.start()
+            time.sleep(random.uniform(0, poll_interval))
+            cancelled_at = time.monotonic()
+            cache.set(flag, True, timeout=60)
+            waiter.join()
+            cache.delete(flag)
+            latencies.append(released["at"] - cancelled_at)
+        return latencies
+
+    def _report(self, label, latencies):
+        ms = sorted(value * 1000 for value in latencies)
+        p95 = ms[min(len(ms) - 1, int(round(len(ms) * 0.95)) - 1)]
+        self.stdout.write(
+            f"{label:>12}: n={len(ms)} p50={statistics.median(ms):.2f}ms "
+            f"p95={p95:.2f}ms max={ms[-1]:.2f}ms"
+        )
@@ -0,0 +1,316 @@
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fake_replicate_utils import Cassette, FakeReplicate, FakeReplicateServer
+from ocr_utils import OCR_MAX_WORKERS, get_ocr_pool
+from preextract_utils import check_field_formats
+from prompts import extraction_fields
+from template_utils import field_value, same_value
+from text_utils import estimate_tokens
+from utils import ExtractionRequest, build_llm_input, finalize_result, routed_llm_extraction, run_ocr
+
+STAGES = ("ocr", "prompt", "llm", "finalize", "total")
+REASONING_MODES = {"off": [False], "on": [True], "both": [False, True]}
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(share):
+        return ordered[min(len(ordered) - 1, max(int(round(len(ordered) * share)) - 1, 0))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 2),
+        "p50": round(statistics.median(ordered), 2),
+        "p95": round(rank(0.95), 2),
+        "p99": round(rank(0.99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a corpus of invoice PDFs through OCR, prompt building, the LLM and finalization "
+        "(VAT scenario), reporting per-stage latency percentiles, peak RSS, token counts and "
+        "field accuracy against ground truth as JSON. --reasoning both compares the lean prompt "
+        "with the one that asks for *_reasoning explanations."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "corpus",
+            help="Directory of invoice PDFs; NAME.json next to NAME.pdf holds its ground truth "
+            "(field -> value, plus an optional \"scenario\").",
+        )
+        parser.add_argument("--limit", type=int, default=0, help="Use at most this many PDFs.")
+        parser.add_argument("--repeat", type=int, default=1, help="Runs per document.")
+        parser.add_argument("--concurrency", type=int, default=1, help="Documents processed in parallel.")
+        parser.add_argument(
+            "--reasoning",
+            choices=sorted(REASONING_MODES),
+            default="off",
+            help="Ask for *_reasoning explanations: off (lean prompt), on, or both (each document in both modes).",
+        )
+        parser.add_argument(
+            "--input-price", type=float, default=0.0, help="USD per million prompt tokens, to report cost."
+        )
+        parser.add_argument(
+            "--output-price", type=float, default=0.0, help="USD per million output tokens, to report cost."
+        )
+        parser.add_argument(
+            "--fake",
+            action="store_true",
+            help="Serve the LLM from an in-process fake Replicate (see the fake_replicate command).",
+        )
+        parser.add_argument("--cassette", help="With --fake: replay LLM answers from this recording.")
+        parser.add_argument("--latency", default="fixed:0", help="With --fake: LLM run time distribution.")
+        parser.add_argument("--seed", type=int, default=0, help="With --fake: random seed.")
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        corpus = Path(options["corpus"])
+        pdfs = sorted(corpus.glob("*.pdf"))
+        if options["limit"]:
+            pdfs = pdfs[:options["limit"]]
+        if not pdfs:
+            raise CommandError(f"No PDFs in {corpus}.")
+
+        server = None
+        if options["fake"]:
+            server = self._start_fake(options)
+        elif not os.getenv("REPLICATE_API_TOKEN"):
+            raise CommandError("Set REPLICATE_API_TOKEN (or REPLICATE_BASE_URL to a fake), or pass --fake.")
+
+        runs = [
+            (pdf, with_reasoning)
+            for pdf in pdfs
+            for with_reasoning in REASONING_MODES[options["reasoning"]]
+            for _ in range(max(options["repeat"], 1))
+        ]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(options["concurrency"], 1)) as executor:
+            measurements = list(executor.map(self._run_document, runs))
+        wall_seconds = time.perf_counter() - started
+
+        report = self._report(corpus, measurements, wall_seconds, options)
+        if server is not None:
+            report["fake_replicate"] = server.fake.stats
+            server.shutdown()
+            server.server_close()
+
+        payload = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            Path(options["output"]).write_text(payload + "\n", encoding="utf-8")
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(payload)
+
+    def _start_fake(self, options):
+        # The replicate client reads these when it makes its first request.
+        fake = FakeReplicate(
+            mode="replay" if options["cassette"] else "canned",
+            cassette=Cassette(options["cassette"]) if options["cassette"] else None,
+            latency=options["latency"],
+            start_latency="fixed:0",
+            replay_latency=False,
+            seed=options["seed"],
+        )
+        server = FakeReplicateServer(("127.0.0.1", 0), fake)
+        server.start_background()
+        os.environ["REPLICATE_BASE_URL"] = server.url
+        os.environ.setdefault("REPLICATE_API_TOKEN", "fake")
+        return server
+
+    def _run_document(self, run) -> dict:
+        pdf, with_reasoning = run
+        measurement = {"document": pdf.name, "reasoning": with_reasoning, "timings": {}}
+        timings = measurement["timings"]
+        started = time.perf_counter()
+        try:
+            pdf_data = pdf.read_bytes()
+            stage_started = time.perf_counter()
+            invoice_text, pages = run_ocr(pdf_data)
+            timings["ocr"] = (time.perf_counter() - stage_started) * 1000
+            measurement["pages"] = len(pages)
+
+            stage_started = time.perf_counter()
+            extraction = ExtractionRequest(invoice_text, with_reasoning)
+            timings["prompt"] = (time.perf_counter() - stage_started) * 1000
+            measurement["prompt_tokens"] = estimate_tokens(build_llm_input(extraction.prompt, extraction.system_prompt))
+            measurement["prefilled_fields"] = len(extraction.prefilled)
+
+            stage_started = time.perf_counter()
+            raw_result = routed_llm_extraction(
+                extraction.text,
+                extraction.prompt,
+                fields=extraction.fields,
+                system_prompt=extraction.system_prompt,
+                json_schema=extraction.json_schema,
+            )
+            timings["llm"] = (time.perf_counter() - stage_started) * 1000
+            # The answers' size, reasoning included; cascade calls are not counted separately.
+            measurement["output_tokens"] = estimate_tokens(json.dumps(raw_result, ensure_ascii=False))
+
+            stage_started = time.perf_counter()
+            check_field_formats(raw_result)
+            raw_result.update(extraction.prefilled)
+            result = finalize_result(raw_result)
+            timings["finalize"] = (time.perf_counter() - stage_started) * 1000
+            timings["total"] = (time.perf_counter() - started) * 1000
+            measurement["result"] = result
+        except Exception as exc:
+            measurement["error"] = f"{type(exc).__name__}: {exc}"
+        return measurement
+
+    def _accuracy(self, corpus: Path, measurements):
+        fields = {field: {"correct": 0, "total": 0} for field in [*extraction_fields, "scenario"]}
+        mismatches = []
+        for measurement in measurements:
+            truth_path = corpus / (Path(measurement["document"]).stem + ".json")
+            if "result" not in measurement or not truth_path.exists():
+                continue
+            truth = json.loads(truth_path.read_text(encoding="utf-8"))
+            truth = truth.get("fields", truth)
+            result = measurement["result"]
+            for field, counts in fields.items():
+                if field not in truth:
+                    continue
+                expected = field_value(truth, field)
+                actual = result.get(field) if field == "scenario" else field_value(result, field)
+                counts["total"] += 1
+                if same_value(field, actual, expected):
+                    counts["correct"] += 1
+                else:
+                    mismatches.append(
+                        {"document": measurement["document"], "field": field, "expected": expected, "actual": actual}
+                    )
+        per_field = {
+            field: {**counts, "accuracy": round(counts["correct"] / counts["total"], 4)}
+            for field, counts in fields.items()
+            if counts["total"]
+        }
+        correct = sum(counts["correct"] for counts in per_field.values())
+        total = sum(counts["total"] for counts in per_field.values())
+        return {
+            "overall": round(correct / total, 4) if total else None,
+            "fields": per_field,
+            "mismatches": mismatches,
+        }
+
+    def _stats(self, corpus: Path, measurements, options) -> dict:
+        completed = [measurement for measurement in measurements if "error" not in measurement]
+        prompt_total = sum(m["prompt_tokens"] for m in completed)
+        output_total = sum(m["output_tokens"] for m in completed)
+        cost = None
+        if options["input_price"] or options["output_price"]:
+            cost = round((prompt_total * options["input_price"] + output_total * options["output_price"]) / 1e6, 4)
+        return {
+            "latency_ms": {
+                stage: _percentiles([m["timings"][stage] for m in completed if stage in m["timings"]])
+                for stage in STAGES
+            },
+            "tokens": {
+                "prompt": _percentiles([m["prompt_tokens"] for m in completed]),
+                "output": _percentiles([m["output_tokens"] for m in completed]),
+                "prompt_total": prompt_total,
+                "output_total": output_total,
+                "cost_usd": cost,
+            },
+            "accuracy": self._accuracy(corpus, measurements),
+        }
+
+    def _reasoning_overhead(self, lean: dict, reasoning: dict) -> dict:
+        """What asking for *_reasoning adds to each document, on average (reasoning minus lean)."""
+
+        def delta(stats_path):
+            values = []
+            for stats in (lean, reasoning):
+                value = stats
+                for key in stats_path:
+                    value = (value or {}).get(key)
+                values.append(value)
+            return round(values[1] - values[0], 4) if None not in values else None
+
+        documents = (lean["tokens"]["output"] or {}).get("count")
+        cost = delta(("tokens", "cost_usd"))
+        return {
+            "llm_ms_mean": delta(("latency_ms", "llm", "mean")),
+            "llm_ms_p95": delta(("latency_ms", "llm", "p95")),
+            "total_ms_mean": delta(("latency_ms", "total", "mean")),
+            "output_tokens_mean": delta(("tokens", "output", "mean")),
+            "prompt_tokens_mean": delta(("tokens", "prompt", "mean")),
+            "cost_usd_per_document": round(cost / documents, 6) if cost is not None and documents else None,
+            "accuracy": delta(("accuracy", "overall")),
+        }
+
+    def _report(self, corpus: Path, measurements, wall_seconds: float, options) -> dict:
+        if OCR_MAX_WORKERS > 0:
+            # Reaps the OCR workers, so their peak RSS shows up in RUSAGE_CHILDREN.
+            get_ocr_pool().shutdown()
+        # ru_maxrss is in KiB on Linux and in bytes on macOS.
+        rss_unit = 1 if sys.platform == "darwin" else 1024
+        completed = [measurement for measurement in measurements if "error" not in measurement]
+        stats = self._stats(corpus, measurements, options)
+
+        report = {
+            "commit": _git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "corpus": str(corpus),
+            "settings": {
+                "repeat": options["repeat"],
+                "concurrency": options["concurrency"],
+                "reasoning": options["reasoning"],
+                "fake": options["fake"],
+                "cassette": options["cassette"],
+                "latency": options["latency"] if options["fake"] else None,
+                "prompt_compaction": os.getenv("PROMPT_COMPACTION", "1"),
+                "pre_extraction": os.getenv("PRE_EXTRACTION", "1"),
+                "llm_cascade": os.getenv("LLM_CASCADE", "1"),
+                "ocr_max_workers": OCR_MAX_WORKERS,
+                "input_price": options["input_price"],
+                "output_price": options["output_price"],
+            },
+            "documents": len(measurements),
+            "errors": [
+                {"document": measurement["document"], "error": measurement["error"]}
+                for measurement in measurements
+                if "error" in measurement
+            ],
+            "wall_seconds": round(wall_seconds, 2),
+            "throughput_per_minute": round(len(completed) / wall_seconds * 60, 2) if wall_seconds else None,
+            "latency_ms": stats["latency_ms"],
+            "tokens": stats["tokens"],
+            "peak_rss_mib": {
+                "process": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 2**20, 1),
+                "ocr_workers": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rss_unit / 2**20, 1),
+            },
+            "accuracy": stats["accuracy"],
+        }
+        if options["reasoning"] == "both":
+            lean = self._stats(corpus, [m for m in measurements if not m["reasoning"]], options)
+            reasoning = self._stats(corpus, [m for m in measurements if m["reasoning"]], options)
+            report["modes"] = {"lean": lean, "reasoning": reasoning}
+            report["reasoning_overhead"] = self._reasoning_overhead(lean, reasoning)
+        return report
@@ -0,0 +1,59 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from minhash_utils import MINHASH_BINS, MinHashIndex, text_signature
+
+
+class Command(BaseCommand):
+    help = "Measure memory and lookup latency of the near-duplicate MinHash index at a given size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=100_000, help="Indexed invoices.")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument(
+            "--recurring",
+            type=int,
+            default=300,
+            help="Near-duplicates of the queried invoice in the index (one supplier's monthly bills).",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = [f"{rng.getrandbits(40):x}" for _ in range(20_000)]
+        invoice = " ".join(rng.choices(vocabulary, k=600))
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = MinHashIndex()
+        index.extend(
+            (key, tuple(rng.getrandbits(32) for _ in range(MINHASH_BINS)))
+            for key in range(options["size"])
+        )
+        for month in range(options["recurring"]):
+            index.add(options["size"] + month, text_signature(f"{invoice} invoice {month} due {month}"))
+        build_seconds = time.perf_counter() - started
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"indexed: {len(index)} build={build_seconds:.1f}s (traced) "
+            f"memory={memory / 2**20:.1f}MiB (peak {peak / 2**20:.1f}MiB)"
+        )
+
+        timings = []
+        found = 0
+        for query in range(max(options["queries"], 1)):
+            text = f"{invoice} invoice {query} due {query + 1}"
+            started = time.perf_counter()
+            matches = index.query(text_signature(text), threshold=0.85)
+            timings.append((time.perf_counter() - started) * 1000)
+            found += bool(matches)
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(round(len(timings) * 0.99)) - 1)]
+        self.stdout.write(
+            f"lookup (signature + query): p50={statistics.median(timings):.2f}ms "
+            f"p99={p99:.2f}ms max={timings[-1]:.2f}ms found={found}/{len(timings)}"
+        )
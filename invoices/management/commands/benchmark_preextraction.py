@@ -0,0 +1,118 @@
+import json
+import os
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.models import InvoiceSubmission
+from preextract_utils import parse_amount, parse_dates, pre_extract
+from prompts import extraction_fields
+from text_utils import estimate_tokens
+from utils import get_invoice_text
+
+
+def _normalize(field, value):
+    text = str(value or "").strip()
+    if field == "invoice_total_amounts":
+        return parse_amount(text) or text
+    if field == "invoice_date":
+        dates = parse_dates(text)
+        return dates[0] if dates else text
+    return re.sub(r"[\s.\-]", "", text).casefold() if field.endswith("vat_id") else text.casefold()
+
+
+class Command(BaseCommand):
+    help = (
+        "Report how often the deterministic pre-extractors resolve each field (so the LLM is not asked), "
+        "and how often they agree with reviewed submissions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dir",
+            help="Directory of invoice PDFs, or of OCR markdown (.md/.txt) files.",
+        )
+        parser.add_argument(
+            "--submissions",
+            type=int,
+            default=0,
+            help="Also run on this many approved submissions, comparing against their reviewed values.",
+        )
+        parser.add_argument("--repeat", type=int, default=20, help="Timing runs per document.")
+
+    def handle(self, *args, **options):
+        documents = list(self._directory_documents(options["dir"])) if options["dir"] else []
+        if options["submissions"]:
+            documents.extend(self._submission_documents(options["submissions"]))
+        if not documents:
+            raise CommandError("No documents: pass --dir and/or --submissions.")
+
+        resolved = {field: 0 for field in extraction_fields}
+        compared = {field: 0 for field in extraction_fields}
+        agreed = {field: 0 for field in extraction_fields}
+        timings = []
+        saved_tokens = []
+        for name, text, reference in documents:
+            started = time.perf_counter()
+            for _ in range(max(options["repeat"], 1)):
+                prefilled = pre_extract(text)
+            timings.append((time.perf_counter() - started) / max(options["repeat"], 1))
+            saved_tokens.append(sum(estimate_tokens(json.dumps({field: payload})) for field, payload in prefilled.items()))
+
+            for field, payload in prefilled.items():
+                resolved[field] += 1
+                expected = (reference or {}).get(field)
+                expected = expected.get("value") if isinstance(expected, dict) else expected
+                if expected in (None, ""):
+                    continue
+                compared[field] += 1
+                if _normalize(field, payload["value"]) == _normalize(field, expected):
+                    agreed[field] += 1
+                else:
+                    self.stdout.write(f"  mismatch {name} {field}: {payload['value']!r} != {expected!r}")
+
+        count = len(documents)
+        self.stdout.write(f"documents: {count}")
+        self.stdout.write(f"{'field':<24} {'skipped':>8} {'agrees':>12}")
+        for field in extraction_fields:
+            if not resolved[field]:
+                continue
+            agreement = f"{agreed[field]}/{compared[field]}" if compared[field] else "-"
+            self.stdout.write(f"{field:<24} {resolved[field] / count:>8.1%} {agreement:>12}")
+        fields_skipped = sum(resolved.values()) / count
+        self.stdout.write(
+            f"LLM fields skipped per document: {fields_skipped:.1f} of {len(extraction_fields)} "
+            f"(~{statistics.mean(saved_tokens):.0f} output tokens)"
+        )
+        micros = sorted(value * 1e6 for value in timings)
+        self.stdout.write(f"pre-extraction time per document: p50={statistics.median(micros):.0f}us max={micros[-1]:.0f}us")
+
+    def _directory_documents(self, directory):
+        if not os.path.isdir(directory):
+            raise CommandError(f"Not a directory: {directory}")
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            lower = name.lower()
+            if lower.endswith(".pdf"):
+                with open(path, "rb") as f:
+                    yield name, get_invoice_text(f.read()), None
+            elif lower.endswith((".md", ".txt")):
+                with open(path, encoding="utf-8") as f:
+                    yield name, f.read(), None
+
+    def _submission_documents(self, limit):
+        submissions = (
+            InvoiceSubmission.objects.filter(status=InvoiceSubmission.STATUS_APPROVED)
+            .exclude(invoice_file="")
+            .order_by("-created_at")[:limit]
+        )
+        for submission in submissions:
+            try:
+                with submission.invoice_file.open("rb") as invoice_file:
+                    text = get_invoice_text(invoice_file.read())
+            except Exception as exc:
+                self.stderr.write(f"Skipping submission {submission.id}: {exc}")
+                continue
+            yield f"submission-{submission.id}", text, submission.invoice_data
@@ -0,0 +1,78 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fake_replicate_utils import UPSTREAM_BASE_URL, Cassette, FakeReplicate, FakeReplicateServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local fake of the Replicate predictions API for offline tests and load runs. "
+        "Point the app at it with REPLICATE_BASE_URL=http://HOST:PORT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--mode",
+            choices=["canned", "replay", "record"],
+            default="canned",
+            help="canned: empty extraction answers (or --output); replay: answers from --cassette; "
+            "record: forward to the real API and append its answers to --cassette.",
+        )
+        parser.add_argument("--cassette", help="JSON-lines file of recorded predictions.")
+        parser.add_argument("--output", help="File whose content is the output of every canned prediction.")
+        parser.add_argument(
+            "--latency",
+            default="lognormal:2,0.5",
+            help="Run time distribution in seconds: fixed:S, uniform:LOW,HIGH, lognormal:MEDIAN,SIGMA or exponential:MEAN.",
+        )
+        parser.add_argument("--start-latency", default="fixed:0.2", help="Queue time distribution (same format).")
+        parser.add_argument(
+            "--recorded-latency",
+            action="store_true",
+            help="Replay: wait as long as the recorded prediction took instead of sampling --latency.",
+        )
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of predictions that fail.")
+        parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of creations answered with 429.")
+        parser.add_argument("--rate-limit", type=float, default=0.0, help="Creations allowed per minute (429 beyond).")
+        parser.add_argument("--http-error-rate", type=float, default=0.0, help="Share of requests answered with 5xx.")
+        parser.add_argument("--seed", type=int, help="Random seed for reproducible latencies and faults.")
+
+    def handle(self, *args, **options):
+        if options["mode"] != "canned" and not options["cassette"]:
+            raise CommandError(f"--mode {options['mode']} needs --cassette.")
+        token = os.getenv("REPLICATE_API_TOKEN", "")
+        if options["mode"] == "record" and not token:
+            raise CommandError("Record mode needs REPLICATE_API_TOKEN for the real API.")
+        output = None
+        if options["output"]:
+            with open(options["output"], encoding="utf-8") as f:
+                output = f.read()
+
+        fake = FakeReplicate(
+            mode=options["mode"],
+            cassette=Cassette(options["cassette"]) if options["cassette"] else None,
+            latency=options["latency"],
+            start_latency=options["start_latency"],
+            failure_rate=options["failure_rate"],
+            throttle_rate=options["throttle_rate"],
+            http_error_rate=options["http_error_rate"],
+            rate_limit_per_minute=options["rate_limit"],
+            output=output,
+            replay_latency=options["recorded_latency"],
+            webhook_secret=os.getenv("REPLICATE_WEBHOOK_SECRET", ""),
+            upstream_url=os.getenv("REPLICATE_UPSTREAM_URL", UPSTREAM_BASE_URL),
+            upstream_token=token,
+            seed=options["seed"],
+        )
+        server = FakeReplicateServer((options["host"], options["port"]), fake)
+        self.stdout.write(f"Fake Replicate ({options['mode']}) on {server.url}; stats at {server.url}/fake/stats")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"stats: {fake.stats}")
@@ -0,0 +1,61 @@
+import json
+from collections import Counter
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting_utils import CountryCode
+from synthetic_invoice_utils import LANGUAGES, SCENARIOS, generate_invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Write synthetic invoice PDFs with NAME.json ground truth next to each, "
+        "as a reproducible corpus for benchmark_extraction and the other benchmarks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output_dir")
+        parser.add_argument("--count", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the first invoice; the rest follow it.")
+        parser.add_argument("--pages", type=int, default=1, help="Minimum pages per invoice.")
+        parser.add_argument("--rows", type=int, help="Line items per invoice (default: a few, or enough for --pages).")
+        parser.add_argument("--language", choices=[*LANGUAGES, "mixed"], default="mixed")
+        parser.add_argument(
+            "--supplier-group",
+            choices=[CountryCode.EE, CountryCode.EU_OTHER, CountryCode.NON_EU],
+            help="Only suppliers from this country group.",
+        )
+        parser.add_argument("--scenario", choices=sorted(SCENARIOS), help="Only this VAT scenario.")
+        parser.add_argument("--scanned", action="store_true", help="Image-only pages, for the OCR path.")
+        parser.add_argument("--repeated-headers", action="store_true", help="Running header and table header on every page.")
+
+    def handle(self, *args, **options):
+        output_dir = Path(options["output_dir"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        scenarios = Counter()
+        for index in range(options["count"]):
+            seed = options["seed"] + index
+            language = options["language"]
+            if language == "mixed":
+                language = LANGUAGES[seed % len(LANGUAGES)]
+            try:
+                pdf_data, truth = generate_invoice(
+                    seed,
+                    pages=options["pages"],
+                    rows=options["rows"],
+                    language=language,
+                    supplier_group=options["supplier_group"],
+                    scenario=options["scenario"],
+                    scanned=options["scanned"],
+                    repeated_headers=options["repeated_headers"],
+                )
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            name = f"invoice_{seed:06d}"
+            (output_dir / f"{name}.pdf").write_bytes(pdf_data)
+            (output_dir / f"{name}.json").write_text(json.dumps(truth, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+            scenarios[truth["fields"]["scenario"]] += 1
+        self.stdout.write(f"generated: {options['count']} invoices in {output_dir}")
+        for scenario, count in sorted(scenarios.items()):
+            self.stdout.write(f"  {scenario}: {count}")
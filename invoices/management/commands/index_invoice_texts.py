@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from invoices.models import InvoiceSubmission
+from minhash_utils import pack_signature, text_signature
+from utils import get_invoice_text
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the near-duplicate (MinHash) signature of submissions that have none, "
+        "running OCR for those whose text is no longer cached."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=0, help="Index at most this many submissions.")
+
+    def handle(self, *args, **options):
+        submissions = (
+            InvoiceSubmission.objects.filter(text_signature__isnull=True)
+            .exclude(invoice_file="")
+            .exclude(invoice_file__isnull=True)
+            .exclude(status=InvoiceSubmission.STATUS_REJECTED)
+            .order_by("-created_at")
+            .only("id", "invoice_file")
+        )
+        if options["limit"]:
+            submissions = submissions[:options["limit"]]
+
+        indexed = skipped = 0
+        for submission in submissions.iterator():
+            try:
+                with submission.invoice_file.open("rb") as invoice_file:
+                    signature = text_signature(get_invoice_text(invoice_file.read()))
+            except Exception as exc:
+                self.stderr.write(f"Skipping submission {submission.id}: {exc}")
+                skipped += 1
+                continue
+            if signature is None:
+                skipped += 1
+                continue
+            InvoiceSubmission.objects.filter(id=submission.id).update(text_signature=pack_signature(signature))
+            indexed += 1
+        self.stdout.write(f"indexed: {indexed} skipped: {skipped}")
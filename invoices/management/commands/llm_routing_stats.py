@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from routing_utils import get_routing_stats, reset_routing_stats
+from utils import EXTRACTION_ROUTE, LLM_CASCADE_ENABLED, LLM_MODEL, LLM_SMALL_MODEL
+
+
+class Command(BaseCommand):
+    help = (
+        "Show per-route LLM latency and escalation-rate counters of the small/large model cascade, "
+        "as recorded in the shared metrics (also exported on /metrics)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print the counters as JSON.")
+        parser.add_argument("--reset", action="store_true", help="Clear the counters after printing them.")
+
+    def handle(self, *args, **options):
+        models = [LLM_SMALL_MODEL, LLM_MODEL]
+        stats = get_routing_stats(models)
+        if options["json"]:
+            self.stdout.write(json.dumps({"route": EXTRACTION_ROUTE, **stats}, indent=2))
+        else:
+            self._report(stats, models)
+        if options["reset"]:
+            reset_routing_stats()
+
+    def _report(self, stats, models):
+        self.stdout.write(f"cascade: {'on' if LLM_CASCADE_ENABLED else 'off'} ({EXTRACTION_ROUTE})")
+        for route, values in stats["routes"].items():
+            self.stdout.write(f"{route:>10}: n={values['count']} avg={self._ms(values['avg_ms'])}")
+        for model in models:
+            values = stats["models"][model]
+            self.stdout.write(f"{model}: calls={values['calls']} avg={self._ms(values['avg_ms'])}")
+        self.stdout.write(f"escalation rate: {self._rate(stats['escalation_rate'])}")
+        self.stdout.write(f"field escalation rate: {self._rate(stats['field_escalation_rate'])}")
+
+    @staticmethod
+    def _ms(value):
+        return "-" if value is None else f"{value}ms"
+
+    @staticmethod
+    def _rate(value):
+        return "-" if value is None else f"{value:.1%}"
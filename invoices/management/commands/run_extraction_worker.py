@@ -0,0 +1,141 @@
+import logging
+import signal
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from invoices.services.job_service import InvoiceExtractionJobService
+from invoices.services.template_service import SupplierTemplateService
+from notify_utils import get_notification_bus
+from ocr_utils import OCR_MAX_WORKERS, get_ocr_pool
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL_SECONDS = 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued invoice extraction jobs (OCR + LLM) outside the web workers, and learn "
+        "supplier templates from approved submissions when the queue is empty."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.EXTRACTION_WORKER_CONCURRENCY,
+            help="Number of jobs processed in parallel.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.EXTRACTION_WORKER_POLL_INTERVAL,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the queue and exit instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        self.stop_event = threading.Event()
+        self.poll_interval = max(options["poll_interval"], 0.1)
+        self.once = options["once"]
+        self.running = {}
+        self.running_lock = threading.Lock()
+        concurrency = max(options["concurrency"], 1)
+
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        if OCR_MAX_WORKERS > 0:
+            get_ocr_pool().start()
+        # Listen from the start so cancels sent during OCR are already known when the LLM step begins
+        get_notification_bus().start()
+
+        self.stdout.write(f"Extraction worker started (concurrency={concurrency}).")
+        threads = [
+            threading.Thread(target=self._work_loop, name=f"extraction-worker-{i}", daemon=True)
+            for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+
+        last_purge = 0.0
+        last_heartbeat = time.monotonic()
+        while any(thread.is_alive() for thread in threads):
+            if time.monotonic() - last_heartbeat >= settings.EXTRACTION_JOB_HEARTBEAT_SECONDS:
+                last_heartbeat = time.monotonic()
+                self._heartbeat()
+            if time.monotonic() - last_purge > PURGE_INTERVAL_SECONDS:
+                last_purge = time.monotonic()
+                try:
+                    InvoiceExtractionJobService.purge_finished_jobs(
+                        timedelta(hours=settings.EXTRACTION_JOB_RETENTION_HOURS)
+                    )
+                except Exception as exc:
+                    logger.exception("Failed to purge extraction jobs: %s", exc)
+                finally:
+                    close_old_connections()
+            for thread in threads:
+                thread.join(timeout=1.0)
+
+        if OCR_MAX_WORKERS > 0:
+            get_ocr_pool().shutdown()
+        get_notification_bus().stop()
+        self.stdout.write("Extraction worker stopped.")
+
+    def _request_stop(self, signum, frame):
+        logger.info("Extraction worker received signal %s, finishing current jobs.", signum)
+        self.stop_event.set()
+
+    def _work_loop(self):
+        while not self.stop_event.is_set():
+            close_old_connections()
+            try:
+                job = InvoiceExtractionJobService.claim_next_job()
+            except Exception as exc:
+                logger.exception("Failed to claim extraction job: %s", exc)
+                job = None
+
+            if job is None:
+                if self._learn_template():
+                    continue
+                if self.once:
+                    return
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            with self.running_lock:
+                self.running[job.id] = job
+            try:
+                InvoiceExtractionJobService.run_job(job)
+            except Exception as exc:
+                logger.exception("Extraction job crashed: id=%s: %s", job.id, exc)
+            finally:
+                with self.running_lock:
+                    self.running.pop(job.id, None)
+        close_old_connections()
+
+    def _heartbeat(self):
+        with self.running_lock:
+            jobs = list(self.running.values())
+        try:
+            InvoiceExtractionJobService.heartbeat(jobs)
+        except Exception as exc:
+            logger.exception("Failed to record extraction job heartbeat: %s", exc)
+        finally:
+            close_old_connections()
+
+    def _learn_template(self) -> bool:
+        try:
+            return SupplierTemplateService.learn_next_pending()
+        except Exception as exc:
+            logger.exception("Failed to learn pending supplier template: %s", exc)
+            return False
@@ -0,0 +1,96 @@
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import metrics_utils
+from config.views import render_metrics
+
+logger = logging.getLogger(__name__)
+
+# A worker that keeps crashing is restarted after 1, 2, 4, ... seconds, at most this long.
+WORKER_MAX_RESTART_DELAY = 60
+# A worker that ran this long before exiting is restarted without delay.
+WORKER_HEALTHY_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Run gunicorn and the extraction worker in one container, restarting the worker if it exits "
+        "and passing SIGTERM on to both. They share the SQLite volume, so they cannot run on separate machines. "
+        "Also serves Prometheus metrics on METRICS_BIND."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default=f"0.0.0.0:{os.getenv('PORT', '8000')}")
+        parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--timeout", type=int, default=300)
+        parser.add_argument(
+            "--stop-timeout",
+            type=float,
+            default=30,
+            help="Seconds to let the worker finish its jobs on shutdown before killing it.",
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        if settings.METRICS_BIND and metrics_utils.METRICS_ENABLED:
+            metrics_utils.start_server(settings.METRICS_BIND, render_metrics)
+
+        web = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", "config.wsgi:application",
+                "--bind", options["bind"],
+                "--workers", str(options["workers"]),
+                "--threads", str(options["threads"]),
+                "--timeout", str(options["timeout"]),
+            ]
+        )
+        worker, worker_started = self._start_worker(), time.monotonic()
+        restart_at, failures = None, 0
+
+        while not self.stopping.is_set():
+            if web.poll() is not None:
+                logger.error("gunicorn exited with %s; stopping.", web.returncode)
+                break
+            if worker.poll() is not None:
+                if restart_at is None:
+                    failures = 0 if time.monotonic() - worker_started > WORKER_HEALTHY_SECONDS else failures + 1
+                    delay = min(2 ** max(failures - 1, 0), WORKER_MAX_RESTART_DELAY) if failures else 0
+                    logger.error("Extraction worker exited with %s; restarting in %ss.", worker.returncode, delay)
+                    restart_at = time.monotonic() + delay
+                elif time.monotonic() >= restart_at:
+                    worker, worker_started, restart_at = self._start_worker(), time.monotonic(), None
+            self.stopping.wait(1.0)
+
+        self._stop(web, worker, options["stop_timeout"])
+        sys.exit(web.returncode or 0)
+
+    def _start_worker(self) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, "manage.py", "run_extraction_worker"])
+
+    def _request_stop(self, signum, frame):
+        logger.info("Received signal %s, stopping gunicorn and the extraction worker.", signum)
+        self.stopping.set()
+
+    def _stop(self, web: subprocess.Popen, worker: subprocess.Popen, timeout: float) -> None:
+        for process in (web, worker):
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for process in (web, worker):
+            try:
+                process.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                logger.warning("Process %s did not stop in time; killing it.", process.pid)
+                process.kill()
+                process.wait()
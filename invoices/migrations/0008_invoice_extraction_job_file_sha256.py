@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0007_invoice_extraction_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceextractionjob',
+            name='file_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
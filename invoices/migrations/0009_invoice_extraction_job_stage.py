@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0008_invoice_extraction_job_file_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceextractionjob',
+            name='partial_result',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='invoiceextractionjob',
+            name='stage',
+            field=models.CharField(choices=[('uploaded', 'Uploaded'), ('ocr_done', 'OCR done'), ('llm_queued', 'LLM queued'), ('llm_running', 'LLM running')], default='uploaded', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='invoiceextractionjob',
+            name='stage_detail',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0010_invoice_extraction_batch'),
+        ('organizations', '0003_remove_organizationinvite_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupplierTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('supplier_key', models.CharField(max_length=255)),
+                ('layout', models.JSONField()),
+                ('learned_count', models.PositiveIntegerField(default=0)),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('miss_count', models.PositiveIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('learned_from', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='supplier_templates', to='invoices.invoicesubmission')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='supplier_templates', to='organizations.organization')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('organization', 'supplier_key'), name='unique_supplier_template')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0011_supplier_template'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoicesubmission',
+            name='text_signature',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0012_invoice_submission_text_signature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceextractionjob',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
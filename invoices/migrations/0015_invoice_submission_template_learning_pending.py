@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0014_invoice_extraction_job_llm_reasoning'),
+        ('organizations', '0004_organization_llm_reasoning'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoicesubmission',
+            name='template_learning_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='invoicesubmission',
+            index=models.Index(condition=models.Q(('template_learning_pending', True)), fields=['template_learning_pending'], name='invoice_sub_tpl_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_file_data(apps, schema_editor):
+    InvoiceExtractionJob = apps.get_model('invoices', 'InvoiceExtractionJob')
+    InvoiceExtractionJobFile = apps.get_model('invoices', 'InvoiceExtractionJobFile')
+    jobs = InvoiceExtractionJob.objects.filter(file_data__isnull=False).values_list('id', 'file_data')
+    InvoiceExtractionJobFile.objects.bulk_create(
+        InvoiceExtractionJobFile(job_id=job_id, data=data) for job_id, data in jobs.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0015_invoice_submission_template_learning_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceExtractionJobFile',
+            fields=[
+                ('job', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='upload', serialize=False, to='invoices.invoiceextractionjob')),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.RunPython(move_file_data, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='invoiceextractionjob',
+            name='file_data',
+        ),
+    ]
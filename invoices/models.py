@@ -1,3 +1,5 @@
+import uuid
+
 from django.conf import settings
 from django.db import models
 
@@ -52,9 +54,22 @@ class InvoiceSubmission(models.Model):
         on_delete=models.SET_NULL,
         related_name="invoice_exports",
     )
+    # MinHash signature of the invoice's OCR text (minhash_utils), for near-duplicate lookups
+    text_signature = models.BinaryField(null=True, blank=True, editable=False)
+    # Set on approval; the extraction worker then learns the supplier template from it
+    template_learning_pending = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["template_learning_pending"],
+                condition=models.Q(template_learning_pending=True),
+                name="invoice_sub_tpl_pending_idx",
+            ),
+        ]
+
     def __str__(self) -> str:
         return f"{self.organization_id}:{self.submitted_by_id}:{self.status}"
 
@@ -66,6 +81,10 @@ class InvoiceSubmission(models.Model):
     def deletable_statuses(cls):
         return {cls.STATUS_PENDING, cls.STATUS_CHANGES_REQUESTED}
 
+    @classmethod
+    def editable_statuses(cls):
+        return {cls.STATUS_PENDING, cls.STATUS_CHANGES_REQUESTED}
+
 
 class InvoiceReviewAssignment(models.Model):
     STATUS_PENDING = "pending"
@@ -132,3 +151,154 @@ class InvoiceSubmissionComment(models.Model):
 
     def __str__(self) -> str:
         return f"InvoiceSubmissionComment(submission={self.submission_id}, author={self.author_id})"
+
+
+class InvoiceExtractionBatch(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    request_id = models.CharField(max_length=64, blank=True, db_index=True)
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="invoice_extraction_batches",
+    )
+    file_count = models.PositiveIntegerField(default=0)
+    skipped_files = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"InvoiceExtractionBatch(id={self.id}, files={self.file_count})"
+
+
+class InvoiceExtractionJob(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+    STATUS_CANCELLED = "cancelled"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+        (STATUS_CANCELLED, "Cancelled"),
+    ]
+
+    STAGE_UPLOADED = "uploaded"
+    STAGE_OCR_DONE = "ocr_done"
+    STAGE_LLM_QUEUED = "llm_queued"
+    STAGE_LLM_RUNNING = "llm_running"
+    STAGE_CHOICES = [
+        (STAGE_UPLOADED, "Uploaded"),
+        (STAGE_OCR_DONE, "OCR done"),
+        (STAGE_LLM_QUEUED, "LLM queued"),
+        (STAGE_LLM_RUNNING, "LLM running"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    request_id = models.CharField(max_length=64, blank=True, db_index=True)
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="invoice_extraction_jobs",
+    )
+    batch = models.ForeignKey(
+        InvoiceExtractionBatch,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="jobs",
+    )
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED
+    )
+    stage = models.CharField(
+        max_length=20, choices=STAGE_CHOICES, default=STAGE_UPLOADED
+    )
+    stage_detail = models.JSONField(default=dict, blank=True)
+    partial_result = models.JSONField(default=dict, blank=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    file_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    # Ask the LLM for "*_reasoning" explanations too (settings.LLM_REASONING_ENABLED, per organization or request).
+    llm_reasoning = models.BooleanField(default=False)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    error_code = models.CharField(max_length=32, blank=True)
+    # Milliseconds per stage of the last run (see timing_utils), returned as Server-Timing.
+    timings = models.JSONField(default=dict, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="invoice_job_status_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"InvoiceExtractionJob(id={self.id}, status={self.status})"
+
+    @classmethod
+    def finished_statuses(cls):
+        return {cls.STATUS_SUCCEEDED, cls.STATUS_FAILED, cls.STATUS_CANCELLED}
+
+
+class InvoiceExtractionJobFile(models.Model):
+    """
+    Uploaded PDF of an unfinished extraction job.
+
+    Kept out of InvoiceExtractionJob, which status polls and progress
+    updates touch all the time, and deleted once the job finishes.
+    """
+
+    job = models.OneToOneField(
+        InvoiceExtractionJob,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="upload",
+    )
+    data = models.BinaryField()
+
+    def __str__(self) -> str:
+        return f"InvoiceExtractionJobFile(job={self.job_id})"
+
+
+class SupplierTemplate(models.Model):
+    """Word layout of a recurring supplier's invoices, learned from approved submissions."""
+
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name="supplier_templates",
+    )
+    # Supplier VAT ID, or "name:<casefolded supplier name>" for suppliers without one
+    supplier_key = models.CharField(max_length=255)
+    layout = models.JSONField()
+    learned_from = models.ForeignKey(
+        InvoiceSubmission,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="supplier_templates",
+    )
+    learned_count = models.PositiveIntegerField(default=0)
+    hit_count = models.PositiveIntegerField(default=0)
+    miss_count = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["organization", "supplier_key"], name="unique_supplier_template"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"SupplierTemplate(organization={self.organization_id}, supplier={self.supplier_key})"
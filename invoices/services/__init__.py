@@ -25,12 +25,22 @@ from .exceptions import (
     ProcessingError,
     OCREmptyError,
     ReplicateThrottledError,
+    ProcessingCancelledError,
+    ExtractionJobNotFoundError,
+    ExtractionBatchNotFoundError,
+    BatchUploadError,
+    InvalidWebhookError,
+    InvalidFieldSelectionError,
 )
 from .submission_service import InvoiceSubmissionService
 from .review_service import InvoiceReviewService
 from .export_service import InvoiceExportService
 from .file_service import InvoiceFileService
 from .processing_service import InvoiceProcessingService
+from .job_service import InvoiceExtractionJobService
+from .batch_service import InvoiceExtractionBatchService
+from .template_service import SupplierTemplateService
+from .similarity_service import InvoiceSimilarityService
 
 __all__ = [
     # Exceptions
@@ -53,10 +63,20 @@ __all__ = [
     "ProcessingError",
     "OCREmptyError",
     "ReplicateThrottledError",
+    "ProcessingCancelledError",
+    "ExtractionJobNotFoundError",
+    "ExtractionBatchNotFoundError",
+    "BatchUploadError",
+    "InvalidWebhookError",
+    "InvalidFieldSelectionError",
     # Services
     "InvoiceSubmissionService",
     "InvoiceReviewService",
     "InvoiceExportService",
     "InvoiceFileService",
     "InvoiceProcessingService",
+    "InvoiceExtractionJobService",
+    "InvoiceExtractionBatchService",
+    "SupplierTemplateService",
+    "InvoiceSimilarityService",
 ]
@@ -0,0 +1,292 @@
+"""
+Invoice extraction batch service.
+
+Expands ZIP archives and multi-file uploads into extraction jobs, which the
+worker runs concurrently, and reports per-file progress for the batch.
+"""
+
+import logging
+import os
+import time
+import zipfile
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import Count
+
+from notify_utils import batch_key, get_notification_bus
+from ..models import InvoiceExtractionBatch, InvoiceExtractionJob
+from .exceptions import BatchUploadError, ExtractionBatchNotFoundError
+from .job_service import InvoiceExtractionJobService
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b"%PDF"
+
+# (file name, declared size, reader returning at most `limit` bytes)
+BatchDocument = Tuple[str, int, Callable[[int], bytes]]
+
+
+class InvoiceExtractionBatchService:
+    """Service for batch (ZIP / multi-file) invoice extraction."""
+
+    @staticmethod
+    def create_batch(
+        files: List[UploadedFile],
+        request_id: Optional[str] = None,
+        user=None,
+        llm_reasoning: Optional[bool] = None,
+    ) -> InvoiceExtractionBatch:
+        """
+        Queue one extraction job per PDF in the uploaded files and ZIP archives.
+
+        Files that are not PDFs, or are over the size limit, are skipped and
+        listed on the batch instead of failing the whole upload.
+
+        Args:
+            files: Uploaded PDFs and/or ZIP archives
+            request_id: Optional client request ID; cancelling it cancels the whole batch
+            user: Optional authenticated user requesting the extraction
+            llm_reasoning: Ask the LLM for "*_reasoning" explanations; None uses
+                the user's organization setting
+
+        Returns:
+            Created InvoiceExtractionBatch instance
+
+        Raises:
+            BatchUploadError: If no PDFs were found or the upload exceeds batch limits
+        """
+        documents, skipped, archives = InvoiceExtractionBatchService._collect_documents(files)
+        try:
+            if not documents:
+                raise BatchUploadError("No PDF files found in the upload.")
+            if len(documents) > settings.EXTRACTION_BATCH_MAX_FILES:
+                raise BatchUploadError(
+                    f"Too many files: {len(documents)} (limit {settings.EXTRACTION_BATCH_MAX_FILES})."
+                )
+            total_bytes = sum(size for _, size, _ in documents)
+            if total_bytes > settings.EXTRACTION_BATCH_MAX_TOTAL_BYTES:
+                raise BatchUploadError("Upload is too large for one batch.")
+            if llm_reasoning is None:
+                # Resolved once rather than per document.
+                llm_reasoning = InvoiceExtractionJobService.llm_reasoning_default(user)
+
+            batch = InvoiceExtractionBatch.objects.create(
+                request_id=(request_id or "")[:64],
+                requested_by=user if user is not None and user.is_authenticated else None,
+            )
+            # One document in memory at a time; each job is committed on its own so the
+            # worker can start while the rest of the batch is still being stored.
+            queued = 0
+            for name, _, read in documents:
+                try:
+                    data = read(settings.EXTRACTION_BATCH_MAX_FILE_BYTES + 1)
+                except (zipfile.BadZipFile, zlib.error, OSError, RuntimeError) as exc:
+                    skipped.append({"file_name": name, "reason": f"Unreadable: {exc}"})
+                    continue
+                reason = InvoiceExtractionBatchService._rejection_reason(data)
+                if reason:
+                    skipped.append({"file_name": name, "reason": reason})
+                    continue
+                InvoiceExtractionJobService.enqueue_bytes(
+                    data,
+                    file_name=name,
+                    request_id=request_id,
+                    user=user,
+                    batch=batch,
+                    llm_reasoning=llm_reasoning,
+                )
+                queued += 1
+        finally:
+            for archive in archives:
+                archive.close()
+
+        if not queued:
+            batch.delete()
+            raise BatchUploadError("No PDF files found in the upload.")
+
+        batch.file_count = queued
+        batch.skipped_files = skipped
+        batch.save(update_fields=["file_count", "skipped_files"])
+        logger.info(
+            "Queued extraction batch: id=%s files=%s skipped=%s",
+            batch.id,
+            queued,
+            len(skipped),
+        )
+        return batch
+
+    @staticmethod
+    def _collect_documents(files: List[UploadedFile]):
+        documents: List[BatchDocument] = []
+        skipped: List[Dict[str, str]] = []
+        archives: List[zipfile.ZipFile] = []
+        for upload in files:
+            name = upload.name or ""
+            if name.lower().endswith(".zip") or zipfile.is_zipfile(upload):
+                upload.seek(0)
+                try:
+                    archive = zipfile.ZipFile(upload)
+                except zipfile.BadZipFile:
+                    skipped.append({"file_name": name, "reason": "Not a valid ZIP archive."})
+                    continue
+                archives.append(archive)
+                for info in archive.infolist():
+                    entry = info.filename
+                    base = os.path.basename(entry)
+                    if info.is_dir() or entry.startswith("__MACOSX/") or base.startswith("."):
+                        continue
+                    if not base.lower().endswith(".pdf"):
+                        skipped.append({"file_name": entry, "reason": "Not a PDF."})
+                        continue
+                    documents.append(
+                        (entry, info.file_size, InvoiceExtractionBatchService._zip_reader(archive, info))
+                    )
+                continue
+
+            upload.seek(0)
+            documents.append((name, upload.size or 0, upload.read))
+        return documents, skipped, archives
+
+    @staticmethod
+    def _zip_reader(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> Callable[[int], bytes]:
+        def read(limit: int) -> bytes:
+            # Bounded read: the declared size in the archive is not trusted.
+            with archive.open(info) as entry:
+                return entry.read(limit)
+
+        return read
+
+    @staticmethod
+    def _rejection_reason(data: bytes) -> Optional[str]:
+        if len(data) > settings.EXTRACTION_BATCH_MAX_FILE_BYTES:
+            return "File is too large."
+        if not data.startswith(PDF_MAGIC):
+            return "Not a PDF."
+        return None
+
+    @staticmethod
+    def get_batch(batch_id) -> InvoiceExtractionBatch:
+        """
+        Fetch an extraction batch by ID.
+
+        Raises:
+            ExtractionBatchNotFoundError: If batch doesn't exist
+        """
+        batch = InvoiceExtractionBatch.objects.filter(id=batch_id).first()
+        if not batch:
+            raise ExtractionBatchNotFoundError("Extraction batch not found.")
+        return batch
+
+    @staticmethod
+    def get_progress(batch: InvoiceExtractionBatch) -> Dict:
+        """
+        Count the batch's jobs by status.
+
+        Returns:
+            Dictionary with overall status, per-status counts and completed count
+        """
+        counts = {status: 0 for status, _ in InvoiceExtractionJob.STATUS_CHOICES}
+        for status, count in batch.jobs.values_list("status").annotate(count=Count("id")):
+            counts[status] = count
+        completed = sum(counts[status] for status in InvoiceExtractionJob.finished_statuses())
+
+        if completed >= batch.file_count:
+            status = "finished"
+        elif counts[InvoiceExtractionJob.STATUS_QUEUED] == batch.file_count:
+            status = "queued"
+        else:
+            status = "running"
+        return {
+            "status": status,
+            "file_count": batch.file_count,
+            "completed": completed,
+            "counts": counts,
+        }
+
+    @staticmethod
+    def serialize_batch(batch: InvoiceExtractionBatch, include_files: bool = True) -> Dict:
+        """
+        Build the batch status payload returned to clients.
+
+        Args:
+            batch: InvoiceExtractionBatch to serialize
+            include_files: Whether to include every file's job payload
+
+        Returns:
+            Dictionary with batch id, progress, skipped files and per-file results
+        """
+        payload = {
+            "batch_id": str(batch.id),
+            "created_at": batch.created_at.isoformat() if batch.created_at else None,
+            "skipped": batch.skipped_files,
+            **InvoiceExtractionBatchService.get_progress(batch),
+        }
+        if include_files:
+            jobs = batch.jobs.order_by("created_at")
+            payload["files"] = [InvoiceExtractionJobService.serialize_job(job) for job in jobs]
+        return payload
+
+    @staticmethod
+    def iter_events(batch_id) -> Iterator[Tuple[str, Any]]:
+        """
+        Follow a batch until every file is finished, yielding (event, data) pairs.
+
+        Events are "file" with each finished job's payload (in completion
+        order), "progress" whenever counts change, "ping" while nothing
+        changes, and a final "done" ("timeout" if it does not finish in time).
+        Woken by the worker's notifications, like InvoiceExtractionJobService.iter_events().
+        """
+        batch = InvoiceExtractionBatchService.get_batch(batch_id)
+        deadline = time.monotonic() + settings.EXTRACTION_BATCH_EVENTS_TIMEOUT
+        next_ping = time.monotonic() + settings.EXTRACTION_EVENTS_PING_INTERVAL
+        sent_jobs = set()
+        last_progress = None
+
+        bus = get_notification_bus()
+        subscription = bus.subscribe(batch_key(batch.id))
+        try:
+            while True:
+                subscription.reset(batch_key(batch.id))
+                finished_jobs = (
+                    batch.jobs.filter(status__in=InvoiceExtractionJob.finished_statuses())
+                    .exclude(id__in=sent_jobs)
+                    .order_by("finished_at")
+                )
+                changed = False
+                for job in finished_jobs:
+                    sent_jobs.add(job.id)
+                    changed = True
+                    yield "file", InvoiceExtractionJobService.serialize_job(job)
+
+                progress = InvoiceExtractionBatchService.get_progress(batch)
+                if progress != last_progress:
+                    last_progress = progress
+                    changed = True
+                    yield "progress", progress
+
+                if progress["status"] == "finished":
+                    yield "done", InvoiceExtractionBatchService.serialize_batch(batch, include_files=False)
+                    return
+                if time.monotonic() >= deadline:
+                    yield "timeout", progress
+                    return
+                if changed:
+                    next_ping = time.monotonic() + settings.EXTRACTION_EVENTS_PING_INTERVAL
+                elif time.monotonic() >= next_ping:
+                    next_ping = time.monotonic() + settings.EXTRACTION_EVENTS_PING_INTERVAL
+                    yield "ping", None
+                subscription.wait(
+                    max(
+                        min(
+                            settings.EXTRACTION_EVENTS_POLL_INTERVAL,
+                            next_ping - time.monotonic(),
+                            deadline - time.monotonic(),
+                        ),
+                        0,
+                    )
+                )
+        finally:
+            bus.unsubscribe(subscription)
@@ -99,3 +99,33 @@ class OCREmptyError(ProcessingError):
 class ReplicateThrottledError(ProcessingError):
     """Raised when Replicate API is throttled."""
     pass
+
+
+class ProcessingCancelledError(ProcessingError):
+    """Raised when invoice processing is cancelled by the user."""
+    pass
+
+
+class ExtractionJobNotFoundError(InvoiceServiceError):
+    """Raised when an extraction job doesn't exist."""
+    pass
+
+
+class ExtractionBatchNotFoundError(InvoiceServiceError):
+    """Raised when an extraction batch doesn't exist."""
+    pass
+
+
+class BatchUploadError(InvoiceServiceError):
+    """Raised when a batch upload is empty, unreadable or over its limits."""
+    pass
+
+
+class InvalidFieldSelectionError(InvoiceServiceError):
+    """Raised when re-extraction is requested for no fields or unknown fields."""
+    pass
+
+
+class InvalidWebhookError(InvoiceServiceError):
+    """Raised when a Replicate webhook is unsigned, forged or malformed."""
+    pass
@@ -5,11 +5,13 @@ Handles exporting approved invoices to Google Sheets.
 """
 
 import logging
+import time
 from typing import Tuple
 
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+import metrics_utils
 from accounts.services import get_user_credentials, set_user_spreadsheet_id
 from google_sheets_utils import append_invoice_to_user_sheet, create_user_spreadsheet
 from organizations.models import OrganizationMembership
@@ -74,6 +76,7 @@ class InvoiceExportService:
         if not credentials:
             raise GoogleCredentialsError("Google account not connected.")
 
+        started = time.monotonic()
         try:
             # Create spreadsheet if needed
             if not spreadsheet_id:
@@ -94,10 +97,12 @@ class InvoiceExportService:
                 user.id,
                 spreadsheet_id,
             )
+            metrics_utils.observe("google_sheets_export_seconds", time.monotonic() - started, outcome="ok")
 
             return spreadsheet_id, submission.exported_at.isoformat()
 
         except Exception as exc:
+            metrics_utils.observe("google_sheets_export_seconds", time.monotonic() - started, outcome="error")
             logger.exception(
                 "Failed to export invoice to Google Sheets (submission=%s user=%s): %s",
                 submission.id,
@@ -6,12 +6,15 @@ Provides S3 signed URL generation and file URL handling.
 
 import logging
 import os
+import time
 from typing import Optional
 
 import boto3
 from botocore.config import Config
 from django.conf import settings
 
+import metrics_utils
+
 logger = logging.getLogger(__name__)
 
 
@@ -63,6 +66,7 @@ class InvoiceFileService:
 
         # Generate signed S3 URL
         key = file_field.name
+        started = time.monotonic()
         try:
             region = getattr(settings, "AWS_S3_REGION_NAME", None)
             endpoint_url = None
@@ -90,9 +94,11 @@ class InvoiceFileService:
                 ExpiresIn=expires,
             )
 
+            metrics_utils.observe("s3_url_signing_seconds", time.monotonic() - started, outcome="ok")
             logger.info("Signed URL generated for key=%s (expires=%s)", key, expires)
             return signed_url
 
         except Exception as exc:
+            metrics_utils.observe("s3_url_signing_seconds", time.monotonic() - started, outcome="error")
             logger.exception("Failed to sign invoice file url (%s): %s", key, exc)
             return url
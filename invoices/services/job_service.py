@@ -0,0 +1,547 @@
+"""
+Invoice extraction job service.
+
+Queues uploaded PDFs as persisted extraction jobs and runs them from a
+separate worker process, so web workers are not held for the whole
+OCR/AI run.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.utils import timezone
+
+import metrics_utils
+from notify_utils import batch_key, get_notification_bus, job_key
+from organizations.services import get_active_membership
+from timing_utils import collect_timings
+from utils import finalize_field
+from ..models import InvoiceExtractionBatch, InvoiceExtractionJob, InvoiceExtractionJobFile
+from .exceptions import (
+    ExtractionJobNotFoundError,
+    OCREmptyError,
+    ProcessingCancelledError,
+    ProcessingError,
+    ReplicateThrottledError,
+)
+from .processing_service import InvoiceProcessingService
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceExtractionJobService:
+    """Service for queued invoice extraction jobs."""
+
+    @staticmethod
+    def enqueue(
+        invoice_file: UploadedFile,
+        request_id: Optional[str] = None,
+        user=None,
+        llm_reasoning: Optional[bool] = None,
+    ) -> InvoiceExtractionJob:
+        """
+        Persist an uploaded PDF as a queued extraction job.
+
+        If the same PDF was extracted before, the job is created already
+        succeeded with the cached result.
+
+        Args:
+            invoice_file: Uploaded invoice PDF file
+            request_id: Optional client request ID for cancellation tracking
+            user: Optional authenticated user requesting the extraction
+            llm_reasoning: Ask the LLM for "*_reasoning" explanations; None uses
+                the user's organization setting (see llm_reasoning_default())
+
+        Returns:
+            Created InvoiceExtractionJob instance
+        """
+        return InvoiceExtractionJobService.enqueue_bytes(
+            b"".join(invoice_file.chunks()),
+            file_name=invoice_file.name,
+            request_id=request_id,
+            user=user,
+            llm_reasoning=llm_reasoning,
+        )
+
+    @staticmethod
+    def enqueue_bytes(
+        data: bytes,
+        file_name: str = "",
+        request_id: Optional[str] = None,
+        user=None,
+        batch: Optional[InvoiceExtractionBatch] = None,
+        llm_reasoning: Optional[bool] = None,
+    ) -> InvoiceExtractionJob:
+        """
+        Persist PDF bytes as a queued extraction job (see enqueue()).
+
+        Args:
+            data: Invoice PDF bytes
+            file_name: Original file name
+            request_id: Optional client request ID for cancellation tracking
+            user: Optional authenticated user requesting the extraction
+            batch: Optional batch the job belongs to
+            llm_reasoning: Ask the LLM for "*_reasoning" explanations (see enqueue())
+
+        Returns:
+            Created InvoiceExtractionJob instance
+        """
+        if llm_reasoning is None:
+            llm_reasoning = InvoiceExtractionJobService.llm_reasoning_default(user)
+        file_hash = hashlib.sha256(data).hexdigest()
+        job_fields = {
+            "request_id": (request_id or "")[:64],
+            "requested_by": user if user is not None and user.is_authenticated else None,
+            "batch": batch,
+            "file_name": (file_name or "")[:255],
+            "file_sha256": file_hash,
+            "llm_reasoning": llm_reasoning,
+        }
+
+        # Repeat uploads of the same bytes are answered from the extraction cache
+        cached_result = InvoiceProcessingService.get_cached_result(file_hash, llm_reasoning)
+        if cached_result is not None:
+            now = timezone.now()
+            job = InvoiceExtractionJob.objects.create(
+                status=InvoiceExtractionJob.STATUS_SUCCEEDED,
+                result=cached_result,
+                started_at=now,
+                finished_at=now,
+                **job_fields,
+            )
+            logger.info("Extraction job served from cache: id=%s hash=%s", job.id, file_hash)
+            return job
+
+        with transaction.atomic():
+            job = InvoiceExtractionJob.objects.create(**job_fields)
+            InvoiceExtractionJobFile.objects.create(job=job, data=data)
+        logger.info(
+            "Queued extraction job: id=%s request_id=%s size=%s",
+            job.id,
+            request_id,
+            len(data),
+        )
+        return job
+
+    @staticmethod
+    def llm_reasoning_default(user=None) -> bool:
+        """Whether extractions for this user ask for reasoning unless the request says otherwise."""
+        if settings.LLM_REASONING_ENABLED:
+            return True
+        if user is None or not user.is_authenticated:
+            return False
+        membership = get_active_membership(user)
+        return bool(membership and membership.organization.llm_reasoning)
+
+    @staticmethod
+    def get_job(job_id) -> InvoiceExtractionJob:
+        """
+        Fetch an extraction job by ID.
+
+        Raises:
+            ExtractionJobNotFoundError: If job doesn't exist
+        """
+        job = InvoiceExtractionJob.objects.filter(id=job_id).first()
+        if not job:
+            raise ExtractionJobNotFoundError("Extraction job not found.")
+        return job
+
+    @staticmethod
+    def cancel_queued(request_id: str) -> int:
+        """
+        Cancel jobs for a request ID that no worker has picked up yet.
+
+        Returns:
+            Number of jobs cancelled
+        """
+        return InvoiceExtractionJobService._finish_jobs(
+            InvoiceExtractionJob.objects.filter(
+                request_id=request_id,
+                status=InvoiceExtractionJob.STATUS_QUEUED,
+            ),
+            status=InvoiceExtractionJob.STATUS_CANCELLED,
+            error="Request cancelled.",
+            error_code="CANCELLED",
+        )
+
+    @staticmethod
+    def cancel_running(request_id: str) -> int:
+        """
+        Mark jobs for a request ID that a worker is running as cancelled.
+
+        The worker stops once it sees the cancel notification; marking the
+        row now keeps a result that arrives in the meantime from replacing it.
+
+        Returns:
+            Number of jobs cancelled
+        """
+        return InvoiceExtractionJobService._finish_jobs(
+            InvoiceExtractionJob.objects.filter(
+                request_id=request_id,
+                status=InvoiceExtractionJob.STATUS_RUNNING,
+            ),
+            status=InvoiceExtractionJob.STATUS_CANCELLED,
+            error="Request cancelled.",
+            error_code="CANCELLED",
+            partial_result={},
+        )
+
+    @staticmethod
+    def _finish_jobs(jobs, **fields) -> int:
+        """
+        Give the selected jobs a final outcome, drop their uploads and wake their event streams.
+
+        Returns:
+            Number of jobs finished
+        """
+        targets = list(jobs.values_list("id", "batch_id"))
+        if not targets:
+            return 0
+        job_ids = [job_id for job_id, _ in targets]
+        now = timezone.now()
+        finished = jobs.filter(id__in=job_ids).update(finished_at=now, updated_at=now, **fields)
+        InvoiceExtractionJobService._discard_uploads(job_ids)
+        for job_id, batch_id in targets:
+            InvoiceExtractionJobService._notify(job_id, batch_id)
+        return finished
+
+    @staticmethod
+    def _discard_uploads(job_ids) -> None:
+        """Delete the uploaded PDFs of these jobs that have finished; only unfinished jobs need them."""
+        InvoiceExtractionJobFile.objects.filter(
+            job_id__in=job_ids,
+            job__status__in=InvoiceExtractionJob.finished_statuses(),
+        ).delete()
+
+    @staticmethod
+    def _notify(job_id, batch_id=None) -> None:
+        """Tell event streams following the job (and its batch) to re-read it."""
+        bus = get_notification_bus()
+        bus.publish(job_key(job_id))
+        if batch_id:
+            bus.publish(batch_key(batch_id))
+
+    @staticmethod
+    def claim_next_job() -> Optional[InvoiceExtractionJob]:
+        """
+        Atomically claim the oldest runnable job for this worker.
+
+        Running jobs whose worker died (no heartbeat for EXTRACTION_JOB_STALE_SECONDS)
+        are reclaimed until EXTRACTION_JOB_MAX_ATTEMPTS is reached.
+
+        Returns:
+            Claimed InvoiceExtractionJob, or None if the queue is empty
+        """
+        now = timezone.now()
+        stale_before = now - timedelta(seconds=settings.EXTRACTION_JOB_STALE_SECONDS)
+        runnable = Q(status=InvoiceExtractionJob.STATUS_QUEUED) | Q(
+            status=InvoiceExtractionJob.STATUS_RUNNING,
+            updated_at__lt=stale_before,
+        )
+
+        InvoiceExtractionJobService._fail_exhausted_jobs(stale_before)
+
+        # Single uploads (someone is watching) go ahead of bulk batch files.
+        candidates = (
+            InvoiceExtractionJob.objects.filter(runnable)
+            .annotate(in_batch=ExpressionWrapper(Q(batch__isnull=False), output_field=BooleanField()))
+            .order_by("in_batch", "created_at")
+            .values_list("id", "status", "attempts")[:5]
+        )
+        for job_id, status, attempts in candidates:
+            # Conditional update so only one worker wins the claim.
+            claimed = InvoiceExtractionJob.objects.filter(
+                id=job_id, status=status, attempts=attempts
+            ).update(
+                status=InvoiceExtractionJob.STATUS_RUNNING,
+                attempts=attempts + 1,
+                started_at=now,
+                updated_at=now,
+            )
+            if claimed:
+                job = InvoiceExtractionJob.objects.get(id=job_id)
+                InvoiceExtractionJobService._notify(job.id, job.batch_id)
+                return job
+        return None
+
+    @staticmethod
+    def _fail_exhausted_jobs(stale_before) -> None:
+        exhausted = InvoiceExtractionJobService._finish_jobs(
+            InvoiceExtractionJob.objects.filter(
+                status=InvoiceExtractionJob.STATUS_RUNNING,
+                updated_at__lt=stale_before,
+                attempts__gte=settings.EXTRACTION_JOB_MAX_ATTEMPTS,
+            ),
+            status=InvoiceExtractionJob.STATUS_FAILED,
+            error="Extraction worker stopped responding.",
+            error_code="WORKER_LOST",
+        )
+        if exhausted:
+            logger.warning("Marked %s stale extraction jobs as failed.", exhausted)
+
+    @staticmethod
+    def run_job(job: InvoiceExtractionJob) -> InvoiceExtractionJob:
+        """
+        Run a claimed job through the processing pipeline and store the outcome.
+
+        Args:
+            job: InvoiceExtractionJob in RUNNING state
+
+        Returns:
+            Updated InvoiceExtractionJob instance
+        """
+        logger.info("Running extraction job: id=%s attempt=%s", job.id, job.attempts)
+
+        result = None
+        error = ""
+        error_code = ""
+        status = InvoiceExtractionJob.STATUS_SUCCEEDED
+
+        with collect_timings() as timings:
+            try:
+                membership = get_active_membership(job.requested_by) if job.requested_by_id else None
+                data = InvoiceExtractionJobFile.objects.filter(job_id=job.id).values_list("data", flat=True).first()
+                result = InvoiceProcessingService.process_invoice_bytes(
+                    bytes(data or b""),
+                    request_id=job.request_id or None,
+                    on_progress=InvoiceExtractionJobService._progress_recorder(job),
+                    organization=membership.organization if membership else None,
+                    with_reasoning=job.llm_reasoning,
+                )
+
+            except OCREmptyError as exc:
+                status, error, error_code = InvoiceExtractionJob.STATUS_FAILED, str(exc), "OCR_EMPTY"
+            except ReplicateThrottledError as exc:
+                status, error, error_code = InvoiceExtractionJob.STATUS_FAILED, str(exc), "RATE_LIMITED"
+            except ProcessingCancelledError as exc:
+                status, error, error_code = InvoiceExtractionJob.STATUS_CANCELLED, str(exc), "CANCELLED"
+            except ProcessingError as exc:
+                status, error, error_code = InvoiceExtractionJob.STATUS_FAILED, str(exc), "PROCESSING_FAILED"
+            except Exception as exc:
+                logger.exception("Extraction job failed: id=%s: %s", job.id, exc)
+                status, error, error_code = (
+                    InvoiceExtractionJob.STATUS_FAILED,
+                    str(exc) or "Internal error",
+                    "INTERNAL",
+                )
+
+        job_timings = InvoiceExtractionJobService._job_timings(job, timings)
+        finished_at = timezone.now()
+        # Only while this claim still holds: a cancel, or a worker that reclaimed the job as
+        # stale, must not be overwritten by this run.
+        written = InvoiceExtractionJobService._own_claim(job).update(
+            status=status,
+            result=result,
+            error=error,
+            error_code=error_code,
+            partial_result={},
+            finished_at=finished_at,
+            timings=job_timings,
+            updated_at=finished_at,
+        )
+        InvoiceExtractionJobService._discard_uploads([job.id])
+        InvoiceExtractionJobService._notify(job.id, job.batch_id)
+        if not written:
+            job.refresh_from_db()
+            logger.warning(
+                "Extraction job changed while running, discarding this run: id=%s attempt=%s status=%s",
+                job.id,
+                job.attempts,
+                job.status,
+            )
+            return job
+
+        job.status = status
+        job.result = result
+        job.error = error
+        job.error_code = error_code
+        job.partial_result = {}
+        job.finished_at = finished_at
+        job.timings = job_timings
+
+        logger.info(
+            "Extraction job finished: id=%s status=%s code=%s",
+            job.id,
+            job.status,
+            job.error_code or None,
+        )
+        # One machine-readable line per job, for finding where slow extractions spend their time.
+        logger.info(
+            "Extraction timings: %s",
+            json.dumps(
+                {
+                    "job_id": str(job.id),
+                    "request_id": job.request_id or None,
+                    "status": job.status,
+                    "attempt": job.attempts,
+                    "spans_ms": job.timings,
+                    "calls": timings.counts,
+                }
+            ),
+        )
+        metrics_utils.inc("invoice_extraction_jobs_total", status=job.status, code=job.error_code or "none")
+        for stage, ms in job.timings.items():
+            metrics_utils.observe("invoice_extraction_stage_seconds", ms / 1000, stage=stage)
+        return job
+
+    @staticmethod
+    def heartbeat(jobs: Iterable[InvoiceExtractionJob]) -> None:
+        """Mark jobs this worker is running as alive, so claim_next_job() does not reclaim them."""
+        now = timezone.now()
+        for job in jobs:
+            InvoiceExtractionJobService._own_claim(job).update(updated_at=now)
+
+    @staticmethod
+    def _own_claim(job: InvoiceExtractionJob):
+        """The job's row, as long as it is still running under the claim this worker made."""
+        return InvoiceExtractionJob.objects.filter(
+            id=job.id,
+            status=InvoiceExtractionJob.STATUS_RUNNING,
+            attempts=job.attempts,
+            started_at=job.started_at,
+        )
+
+    @staticmethod
+    def _job_timings(job: InvoiceExtractionJob, timings) -> Dict[str, float]:
+        """Stage durations of a run, preceded by its wait in the job queue and followed by its total."""
+        durations = {}
+        if job.started_at and job.created_at:
+            durations["job_queue"] = round((job.started_at - job.created_at).total_seconds() * 1000, 1)
+        durations.update(timings.as_dict())
+        durations["total"] = timings.elapsed_ms()
+        return durations
+
+    @staticmethod
+    def _progress_recorder(job: InvoiceExtractionJob) -> Callable[..., None]:
+        """Build a pipeline progress callback that persists stages and streamed fields on the job row."""
+        partial_result = {}
+        stages = dict(InvoiceExtractionJob.STAGE_CHOICES)
+
+        def record(event: str, **data) -> None:
+            jobs = InvoiceExtractionJobService._own_claim(job)
+            if event == "field":
+                payload = finalize_field(data["key"], data["value"])
+                if payload is None:
+                    return
+                partial_result[data["key"]] = payload
+                if jobs.update(partial_result=partial_result, updated_at=timezone.now()):
+                    InvoiceExtractionJobService._notify(job.id)
+            elif event in stages:
+                if jobs.update(stage=event, stage_detail=data, updated_at=timezone.now()):
+                    InvoiceExtractionJobService._notify(job.id)
+
+        return record
+
+    @staticmethod
+    def iter_events(
+        job_id,
+        poll_interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Follow a job until it finishes, yielding (event, data) pairs.
+
+        Events are "stage" on every stage change, "field" for each newly
+        extracted field, "ping" while nothing changes, and a final "done"
+        with the serialized job ("timeout" if it does not finish in time).
+
+        The worker announces every change on the notification bus, so the
+        row is re-read when it changes; poll_interval is only a fallback.
+        """
+        poll_interval = poll_interval or settings.EXTRACTION_EVENTS_POLL_INTERVAL
+        deadline = time.monotonic() + (timeout or settings.EXTRACTION_EVENTS_TIMEOUT)
+        next_ping = time.monotonic() + settings.EXTRACTION_EVENTS_PING_INTERVAL
+        stage = None
+        sent_fields = set()
+
+        bus = get_notification_bus()
+        subscription = bus.subscribe(job_key(job_id))
+        try:
+            while True:
+                # Before reading, so a change made after the read still wakes the wait below.
+                subscription.reset(job_key(job_id))
+                job = InvoiceExtractionJobService.get_job(job_id)
+                changed = False
+                if job.stage != stage:
+                    stage = job.stage
+                    changed = True
+                    yield "stage", {"stage": job.stage, "status": job.status, **(job.stage_detail or {})}
+                for key, payload in (job.partial_result or {}).items():
+                    if key not in sent_fields:
+                        sent_fields.add(key)
+                        changed = True
+                        yield "field", {"key": key, "field": payload}
+
+                if job.status in InvoiceExtractionJob.finished_statuses():
+                    yield "done", InvoiceExtractionJobService.serialize_job(job)
+                    return
+                if time.monotonic() >= deadline:
+                    yield "timeout", InvoiceExtractionJobService.serialize_job(job)
+                    return
+                if changed:
+                    next_ping = time.monotonic() + settings.EXTRACTION_EVENTS_PING_INTERVAL
+                elif time.monotonic() >= next_ping:
+                    next_ping = time.monotonic() + settings.EXTRACTION_EVENTS_PING_INTERVAL
+                    yield "ping", None
+                subscription.wait(
+                    max(min(poll_interval, next_ping - time.monotonic(), deadline - time.monotonic()), 0)
+                )
+        finally:
+            bus.unsubscribe(subscription)
+
+    @staticmethod
+    def purge_finished_jobs(older_than: timedelta) -> int:
+        """
+        Delete finished jobs older than the given age.
+
+        Returns:
+            Number of jobs deleted
+        """
+        deleted, _ = InvoiceExtractionJob.objects.filter(
+            status__in=InvoiceExtractionJob.finished_statuses(),
+            finished_at__lt=timezone.now() - older_than,
+        ).delete()
+        InvoiceExtractionBatch.objects.filter(
+            created_at__lt=timezone.now() - older_than,
+            jobs__isnull=True,
+        ).delete()
+        if deleted:
+            logger.info("Purged %s finished extraction jobs.", deleted)
+        return deleted
+
+    @staticmethod
+    def serialize_job(job: InvoiceExtractionJob) -> Dict:
+        """
+        Build the status payload returned to clients.
+
+        Args:
+            job: InvoiceExtractionJob to serialize
+
+        Returns:
+            Dictionary with job id, status and result or error details
+        """
+        payload = {
+            "job_id": str(job.id),
+            "file_name": job.file_name,
+            "status": job.status,
+            "stage": job.stage,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+        if job.status == InvoiceExtractionJob.STATUS_SUCCEEDED:
+            payload["result"] = job.result
+        elif job.status == InvoiceExtractionJob.STATUS_RUNNING:
+            payload["stage_detail"] = job.stage_detail
+            payload["partial_result"] = job.partial_result
+        elif job.status in InvoiceExtractionJob.finished_statuses():
+            payload["error"] = job.error
+            payload["code"] = job.error_code
+        return payload
@@ -4,20 +4,58 @@ Invoice processing service.
 Wraps OCR/AI processing pipeline with better error handling.
 """
 
+import json
 import logging
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Mapping, Optional
 
+import replicate
+from replicate.webhook import WebhookSigningSecret, WebhookValidationError
+
+from django.conf import settings
+
+from accounting_utils import determine_vat_scenarios
+from ocr_utils import OCRWorkerError
+from prompts import extraction_fields
+from timing_utils import span
 from utils import (
     pipeline,
+    reextract_fields,
+    get_cached_pipeline_result,
+    mark_prediction_completed,
+    PREDICTION_TERMINAL_STATUSES,
+    REPLICATE_WEBHOOK_SECRET,
     ReplicateCancelled,
     ReplicateFailed,
+    ReplicateThrottled,
 )
+from ..models import InvoiceSubmission
 from .exceptions import (
+    InvalidFieldSelectionError,
+    InvalidStatusTransitionError,
+    MissingInvoiceDataError,
     ProcessingError,
     OCREmptyError,
     ReplicateThrottledError,
+    ProcessingCancelledError,
+    InvalidWebhookError,
 )
+from .similarity_service import InvoiceSimilarityService
+from .template_service import SupplierTemplateService
+
+# Extracted fields determine_vat_scenarios() reads; re-extracting one of them recomputes the scenario.
+SCENARIO_FIELDS = {
+    "buyer_country_group",
+    "supplier_country_group",
+    "supply_type",
+    "service_category",
+    "vat_rates",
+    "supplier_vat_id",
+}
+
+# Reject webhook deliveries signed more than this many seconds ago (replays).
+WEBHOOK_TOLERANCE_SECONDS = 5 * 60
 
 logger = logging.getLogger(__name__)
 
@@ -31,35 +69,119 @@ class InvoiceProcessingService:
         request_id: Optional[str] = None,
     ) -> Dict:
         """
-        Process invoice PDF through OCR/AI pipeline.
+        Process invoice PDF file through OCR/AI pipeline.
 
-        Wraps utils.pipeline() with better error handling and normalized output.
+        Reads the file and delegates to process_invoice_bytes().
 
         Args:
             file_path: Path to invoice PDF file
             request_id: Optional request ID for cancellation tracking
 
+        Returns:
+            Dictionary of parsed invoice data with normalized structure
+        """
+        return InvoiceProcessingService.process_invoice_bytes(
+            Path(file_path).read_bytes(),
+            request_id=request_id,
+        )
+
+    @staticmethod
+    def process_invoice_bytes(
+        pdf_data: bytes,
+        request_id: Optional[str] = None,
+        on_progress: Optional[Callable[..., None]] = None,
+        organization=None,
+        with_reasoning: bool = False,
+    ) -> Dict:
+        """
+        Process in-memory invoice PDF through OCR/AI pipeline.
+
+        Wraps utils.pipeline() with better error handling and normalized output.
+        The PDF is never written to disk. When an organization is given and has
+        a template for the invoice's supplier, the invoice is read with it and
+        the pipeline only runs if the template does not fit. Otherwise a
+        near-duplicate of one of its past submissions is reused, re-asking
+        only the fields that differ.
+
+        Args:
+            pdf_data: Invoice PDF bytes
+            request_id: Optional request ID for cancellation tracking
+            on_progress: Optional callback for stage events and streamed fields
+            organization: Optional organization whose supplier templates may be used
+            with_reasoning: Also ask the LLM for its "*_reasoning" explanations (debugging)
+
         Returns:
             Dictionary of parsed invoice data with normalized structure
 
         Raises:
             OCREmptyError: If no text detected in PDF
             ReplicateThrottledError: If Replicate API is rate limited
+            ProcessingCancelledError: If the request was cancelled
             ProcessingError: For other processing errors
         """
-        logger.info("Processing invoice file: path=%s request_id=%s", file_path, request_id)
+        logger.info("Processing invoice: size=%s request_id=%s", len(pdf_data), request_id)
+
+        raw_result = None
+        if organization is not None and settings.SUPPLIER_TEMPLATES_ENABLED:
+            try:
+                with span("template"):
+                    raw_result = SupplierTemplateService.extract(pdf_data, organization)
+            except Exception as exc:
+                logger.warning("Supplier template lookup failed: request_id=%s: %s", request_id, exc)
 
+        if raw_result is None:
+            with InvoiceProcessingService._pipeline_errors(request_id):
+                if organization is not None and settings.NEAR_DUPLICATES_ENABLED:
+                    with span("near_duplicate"):
+                        raw_result = InvoiceSimilarityService.extract(
+                            pdf_data,
+                            organization,
+                            request_id=request_id,
+                            on_progress=on_progress,
+                        )
+                if raw_result is None:
+                    # Call OCR/AI pipeline
+                    raw_result = pipeline(
+                        pdf_data,
+                        request_id=request_id,
+                        on_progress=on_progress,
+                        with_reasoning=with_reasoning,
+                    )
+
+        # Normalize result format
+        try:
+            result_dict = InvoiceProcessingService._normalize_result(raw_result)
+            logger.info("Invoice processed successfully: fields=%s", len(result_dict))
+            return result_dict
+
+        except Exception as exc:
+            logger.exception("Failed to normalize processing result: %s", exc)
+            raise ProcessingError(f"Failed to parse processing result: {exc}")
+
+    @staticmethod
+    @contextmanager
+    def _pipeline_errors(request_id: Optional[str]):
+        """Translate OCR/AI pipeline failures into service exceptions."""
         try:
-            # Call OCR/AI pipeline
-            raw_result = pipeline(file_path, request_id=request_id)
+            yield
 
         except ReplicateCancelled:
-            raise ProcessingError("Request cancelled.")
+            raise ProcessingCancelledError("Request cancelled.")
+
+        except ReplicateThrottled as exc:
+            logger.warning("Replicate throttled past the retry deadline: request_id=%s: %s", request_id, exc)
+            raise ReplicateThrottledError(
+                "Request was throttled. Please try again in a moment."
+            )
 
         except ReplicateFailed as exc:
             error_message = str(exc) or "Replicate failed."
             raise ProcessingError(error_message)
 
+        except OCRWorkerError as exc:
+            logger.warning("OCR failed: request_id=%s: %s", request_id, exc)
+            raise ProcessingError("Could not read the PDF. The file may be damaged.")
+
         except Exception as exc:
             # Check for rate limiting
             message = str(exc)
@@ -71,21 +193,144 @@ class InvoiceProcessingService:
             # Check for OCR empty
             if message == "OCR_EMPTY":
                 raise OCREmptyError(
-                    "No text detected in the PDF. If this is a scanned image, OCR may not be supported yet."
+                    "No text detected in the PDF. If this is a scanned image, try a sharper scan."
                 )
 
             # Re-raise other exceptions
             raise
 
-        # Normalize result format
-        try:
-            result_dict = InvoiceProcessingService._normalize_result(raw_result)
-            logger.info("Invoice processed successfully: fields=%s", len(result_dict))
-            return result_dict
+    @staticmethod
+    def reextract_submission_fields(
+        submission: InvoiceSubmission,
+        fields: List[str],
+        request_id: Optional[str] = None,
+    ) -> Dict:
+        """
+        Re-ask the model for the named fields of a submission and merge the answers into its invoice_data.
+
+        Only those fields are sent, with their part of the prompt and of the
+        cached OCR text, instead of re-running the whole pipeline.
+
+        Args:
+            submission: InvoiceSubmission whose fields are disputed
+            fields: Names of the fields to extract again
+            request_id: Optional request ID for cancellation tracking
+
+        Returns:
+            Dictionary with the updated invoice_data and the re-extracted fields
+
+        Raises:
+            InvalidFieldSelectionError: If no fields or unknown fields are given
+            InvalidStatusTransitionError: If the submission can no longer be edited
+            MissingInvoiceDataError: If the submission has no invoice PDF
+            ProcessingError: If extraction fails
+        """
+        unknown = [field for field in fields if field not in extraction_fields]
+        if not fields or unknown:
+            raise InvalidFieldSelectionError(
+                f"Unknown fields: {', '.join(unknown)}." if unknown else "Select at least one field."
+            )
+        if submission.exported_at or submission.status not in InvoiceSubmission.editable_statuses():
+            raise InvalidStatusTransitionError("Only submissions under review can be re-extracted.")
+        if not submission.invoice_file:
+            raise MissingInvoiceDataError("Submission has no invoice PDF.")
+
+        fields = list(dict.fromkeys(fields))
+        invoice_data = dict(submission.invoice_data or {})
+        with submission.invoice_file.open("rb") as invoice_file:
+            pdf_data = invoice_file.read()
+
+        logger.info(
+            "Re-extracting submission fields: submission=%s fields=%s",
+            submission.id,
+            ",".join(fields),
+        )
+        with InvoiceProcessingService._pipeline_errors(request_id):
+            try:
+                answers = reextract_fields(pdf_data, fields, known=invoice_data, request_id=request_id)
+            except ValueError as exc:
+                logger.warning("Unreadable re-extraction answer: submission=%s: %s", submission.id, exc)
+                raise ProcessingError("The model returned an unreadable answer. Please try again.")
+
+        for field, payload in answers.items():
+            previous = invoice_data.get(field)
+            bbox = previous.get("bbox") if isinstance(previous, dict) else None
+            invoice_data[field] = {"value": payload["value"], "bbox": bbox, "confidence": payload.get("confidence")}
+        if SCENARIO_FIELDS.intersection(answers):
+            previous = invoice_data.get("scenario")
+            scenario = dict(previous) if isinstance(previous, dict) else {"bbox": None}
+            scenario["value"] = determine_vat_scenarios(invoice_data)
+            invoice_data["scenario"] = scenario
+
+        submission.invoice_data = invoice_data
+        submission.save(update_fields=["invoice_data", "updated_at"])
+        return {
+            "invoice_data": invoice_data,
+            "fields": {field: invoice_data[field] for field in answers},
+            "unanswered": [field for field in fields if field not in answers],
+        }
+
+    @staticmethod
+    def get_cached_result(file_hash: str, with_reasoning: bool = False) -> Optional[Dict]:
+        """
+        Look up a previous extraction of the same PDF bytes.
+
+        Args:
+            file_hash: SHA-256 hex digest of the uploaded PDF
+            with_reasoning: Look for an extraction made with "*_reasoning" explanations
 
+        Returns:
+            Normalized result dictionary, or None on cache miss
+        """
+        try:
+            raw_result = get_cached_pipeline_result(file_hash, with_reasoning)
         except Exception as exc:
-            logger.exception("Failed to normalize processing result: %s", exc)
-            raise ProcessingError(f"Failed to parse processing result: {exc}")
+            logger.warning("Extraction cache lookup failed: hash=%s: %s", file_hash, exc)
+            return None
+        if raw_result is None:
+            return None
+        logger.info("Extraction cache hit: hash=%s", file_hash)
+        return InvoiceProcessingService._normalize_result(raw_result)
+
+    @staticmethod
+    def handle_replicate_webhook(headers: Mapping[str, str], body: str) -> Optional[str]:
+        """
+        Verify a Replicate webhook delivery and wake the worker waiting on it.
+
+        Args:
+            headers: Request headers (webhook-id, webhook-timestamp, webhook-signature)
+            body: Raw request body
+
+        Returns:
+            Prediction ID that completed, or None for non-terminal updates
+
+        Raises:
+            InvalidWebhookError: If the secret is not configured, or the signature or payload is invalid
+        """
+        if not REPLICATE_WEBHOOK_SECRET:
+            raise InvalidWebhookError("Replicate webhooks are not configured.")
+        try:
+            replicate.webhooks.validate(
+                headers=dict(headers),
+                body=body,
+                secret=WebhookSigningSecret(key=REPLICATE_WEBHOOK_SECRET),
+                tolerance=WEBHOOK_TOLERANCE_SECONDS,
+            )
+        except (WebhookValidationError, ValueError) as exc:
+            raise InvalidWebhookError(str(exc) or "Invalid webhook.")
+
+        try:
+            payload = json.loads(body)
+            prediction_id = payload["id"]
+            status = payload.get("status")
+        except (ValueError, KeyError, TypeError):
+            raise InvalidWebhookError("Malformed webhook payload.")
+
+        if status not in PREDICTION_TERMINAL_STATUSES:
+            return None
+        mark_prediction_completed(prediction_id)
+        logger.info("Replicate webhook: prediction=%s status=%s", prediction_id, status)
+        return prediction_id
 
     @staticmethod
     def _normalize_result(raw_result) -> Dict:
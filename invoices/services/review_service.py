@@ -8,6 +8,7 @@ and reviewer management.
 import logging
 from typing import Dict, Tuple
 
+from django.conf import settings
 from django.db import transaction
 from django.contrib.auth import get_user_model
 
@@ -94,6 +95,10 @@ class InvoiceReviewService:
             reviewer.id,
             submission.status,
         )
+        if submission.status == InvoiceSubmission.STATUS_APPROVED and settings.SUPPLIER_TEMPLATES_ENABLED:
+            # Reviewed values teach the supplier's layout to later extractions. Learning needs
+            # the PDF and OCR, so it is left to the extraction worker rather than this request.
+            InvoiceSubmission.objects.filter(id=submission.id).update(template_learning_pending=True)
 
         # Build and return review payload
         review_payload = InvoiceReviewService._build_review_payload(submission, reviewer)
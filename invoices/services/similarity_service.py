@@ -0,0 +1,272 @@
+"""
+Invoice similarity service.
+
+Keeps a per-organization MinHash/LSH index over the OCR text of past
+submissions. A new upload that is a near-duplicate of one (a recurring
+bill) starts from that submission's data, and only the fields whose text
+differs are extracted again.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import Q
+from django.utils import timezone
+
+from minhash_utils import MinHashIndex, pack_signature, text_signature, unpack_signature
+from preextract_utils import check_field_formats, parse_amount, parse_dates, pre_extract
+from prompts import extraction_fields
+from utils import (
+    EXTRACTION_CACHE_ALIAS,
+    PRE_EXTRACTION_ENABLED,
+    emit_progress,
+    finalize_result,
+    get_invoice_text,
+    get_ocr_cache_key,
+    reextract_fields,
+)
+from ..models import InvoiceSubmission
+
+logger = logging.getLogger(__name__)
+
+# Fields copied verbatim from the document: kept when the value is still in the new text, else re-asked.
+LITERAL_FIELDS = [
+    "invoice_date",
+    "invoice_number",
+    "invoice_total_amounts",
+    "invoice_currency",
+    "vat_rates",
+    "supplier_name",
+    "supplier_address",
+    "supplier_vat_id",
+    "supplier_email",
+    "buyer_name",
+    "buyer_address",
+    "buyer_vat_id",
+    "buyer_email",
+]
+# Fields inferred from a party's details, re-asked together with them.
+DEPENDENT_FIELDS = {
+    "supplier_": ["supplier_country", "supplier_country_group"],
+    "buyer_": ["buyer_country", "buyer_country_group"],
+}
+# A recurring bill repeats last period's total or date elsewhere (as the previous balance, a
+# period start), so these are only kept when the labelled value pre-extracted from the new text matches.
+LABELLED_FIELDS = ("invoice_total_amounts", "invoice_date")
+KEPT_CONFIDENCE = "strong confidence"
+INFERRED_CONFIDENCE = "medium confidence"
+# Matches tried before giving up, in case the best ones were deleted or rejected since they were indexed.
+MAX_MATCHES = 5
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _compact(text: str) -> str:
+    return re.sub(r"[\s.\-]", "", text).upper()
+
+
+def _same_labelled_value(field: str, value, labelled: Dict) -> bool:
+    raw = labelled.get(field)
+    if raw is None:
+        return False
+    if field == "invoice_total_amounts":
+        amount = parse_amount(" ".join(str(value).split()))
+        return amount is not None and amount == parse_amount(str(raw["value"]))
+    dates = parse_dates(str(value))
+    return bool(dates) and set(dates) == set(parse_dates(str(raw["value"])))
+
+
+def _value_in_text(field: str, value, text: str, tokens: set) -> bool:
+    value = " ".join(str(value).split())
+    if field.endswith("_vat_id"):
+        return _compact(value) in _compact(text)
+    if field in ("invoice_number", "supplier_email", "buyer_email"):
+        return re.search(r"(?<!\w)" + re.escape(value) + r"(?!\w)", text, re.IGNORECASE) is not None
+    return set(_TOKEN_PATTERN.findall(value.casefold())) <= tokens
+
+
+def changed_fields(invoice_data: Dict, invoice_text: str) -> List[str]:
+    """
+    Fields of a matched submission whose value is no longer in the new invoice's text.
+
+    The total and date count as changed unless the new invoice's labelled
+    total or date (see preextract_utils.pre_extract) equals the old value.
+    """
+    tokens = set(_TOKEN_PATTERN.findall(invoice_text.casefold()))
+    labelled = pre_extract(invoice_text)
+    changed = []
+    for field in LITERAL_FIELDS:
+        raw = invoice_data.get(field)
+        value = raw.get("value") if isinstance(raw, dict) else raw
+        if value in (None, "", [], {}):
+            if field in LABELLED_FIELDS:
+                changed.append(field)
+            continue
+        if field in LABELLED_FIELDS:
+            if not _same_labelled_value(field, value, labelled):
+                changed.append(field)
+        elif not _value_in_text(field, value, invoice_text, tokens):
+            changed.append(field)
+    for prefix, dependents in DEPENDENT_FIELDS.items():
+        if any(field.startswith(prefix) for field in changed):
+            changed.extend(dependents)
+    return changed
+
+
+class _OrganizationIndex:
+    """An organization's MinHash index, topped up from the database before each lookup."""
+
+    def __init__(self, organization_id: int):
+        self.organization_id = organization_id
+        self.index = MinHashIndex()
+        self.last_id = 0
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self) -> MinHashIndex:
+        with self.lock:
+            submissions = InvoiceSubmission.objects.filter(
+                organization_id=self.organization_id,
+                text_signature__isnull=False,
+            ).exclude(status=InvoiceSubmission.STATUS_REJECTED)
+            if self.refreshed_at is not None:
+                # New submissions, and resubmissions with a new file
+                submissions = submissions.filter(Q(id__gt=self.last_id) | Q(updated_at__gte=self.refreshed_at))
+            started_at = timezone.now()
+            rows = list(submissions.values_list("id", "text_signature"))
+            self.index.extend((pk, unpack_signature(signature)) for pk, signature in rows)
+            if rows:
+                self.last_id = max(self.last_id, max(pk for pk, _ in rows))
+            self.refreshed_at = started_at
+            return self.index
+
+
+_indexes: Dict[int, _OrganizationIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+class InvoiceSimilarityService:
+    """Service for near-duplicate invoice reuse."""
+
+    @staticmethod
+    def signature_for_upload(invoice_file: UploadedFile) -> Optional[bytes]:
+        """
+        Signature of an uploaded PDF's OCR text, if the text is in the extraction cache.
+
+        Submissions are created from an upload that was just extracted, so
+        the text is normally cached; no OCR is run here.
+
+        Returns:
+            Packed signature, or None if the text is not cached
+        """
+        file_hash = hashlib.sha256()
+        for chunk in invoice_file.chunks():
+            file_hash.update(chunk)
+        invoice_file.seek(0)
+        invoice_text = caches[EXTRACTION_CACHE_ALIAS].get(get_ocr_cache_key(file_hash.hexdigest()))
+        signature = text_signature(invoice_text) if invoice_text else None
+        return pack_signature(signature) if signature else None
+
+    @staticmethod
+    def get_index(organization_id: int) -> MinHashIndex:
+        """The organization's index in this process, loaded on first use and updated on each call."""
+        with _indexes_lock:
+            entry = _indexes.get(organization_id)
+            if entry is None:
+                entry = _indexes[organization_id] = _OrganizationIndex(organization_id)
+        return entry.refresh()
+
+    @staticmethod
+    def find_near_duplicate(organization, invoice_text: str) -> Optional[Tuple[InvoiceSubmission, float]]:
+        """
+        Most similar past submission of the organization, at or above NEAR_DUPLICATE_THRESHOLD.
+
+        Returns:
+            (submission, estimated Jaccard similarity), or None
+        """
+        signature = text_signature(invoice_text)
+        if signature is None:
+            return None
+        index = InvoiceSimilarityService.get_index(organization.id)
+        matches = index.query(signature, settings.NEAR_DUPLICATE_THRESHOLD)
+        for submission_id, score in matches[:MAX_MATCHES]:
+            submission = (
+                InvoiceSubmission.objects.filter(id=submission_id, organization=organization)
+                .exclude(status=InvoiceSubmission.STATUS_REJECTED)
+                .first()
+            )
+            if submission is not None and submission.invoice_data:
+                return submission, score
+        return None
+
+    @staticmethod
+    def extract(
+        pdf_data: bytes,
+        organization,
+        request_id: Optional[str] = None,
+        on_progress=None,
+    ) -> Optional[Dict]:
+        """
+        Extract an invoice from its near-duplicate, re-asking only the fields that differ.
+
+        Differing fields are taken from the deterministic pre-extraction
+        where it resolves them, and asked of the LLM otherwise.
+
+        Args:
+            pdf_data: Invoice PDF bytes
+            organization: Organization whose submissions may be reused
+            request_id: Optional request ID for cancellation tracking
+            on_progress: Optional callback for stage events and fields
+
+        Returns:
+            Finalized result dictionary (as utils.pipeline() returns), or
+            None when there is no near-duplicate or its answer is unusable
+        """
+        invoice_text = get_invoice_text(pdf_data, on_progress)
+        try:
+            match = InvoiceSimilarityService.find_near_duplicate(organization, invoice_text)
+        except Exception as exc:
+            logger.warning("Near-duplicate lookup failed: request_id=%s: %s", request_id, exc)
+            return None
+        if match is None:
+            return None
+        submission, score = match
+
+        invoice_data = submission.invoice_data
+        changed = changed_fields(invoice_data, invoice_text)
+        result = {}
+        for field in extraction_fields:
+            raw = invoice_data.get(field)
+            value = raw.get("value") if isinstance(raw, dict) else raw
+            if field in changed or value in (None, "", [], {}):
+                continue
+            confidence = KEPT_CONFIDENCE if field in LITERAL_FIELDS else INFERRED_CONFIDENCE
+            result[field] = {"value": value, "confidence": confidence}
+
+        prefilled = pre_extract(invoice_text) if PRE_EXTRACTION_ENABLED else {}
+        answers = {field: prefilled[field] for field in changed if field in prefilled}
+        remaining = [field for field in changed if field not in answers]
+        logger.info(
+            "Near-duplicate of submission %s (similarity %.2f): re-asking %s",
+            submission.id,
+            score,
+            ",".join(remaining) or "nothing",
+        )
+        for field, payload in {**result, **answers}.items():
+            emit_progress(on_progress, "field", key=field, value=payload)
+        if remaining:
+            try:
+                answers.update(reextract_fields(pdf_data, remaining, known=invoice_data, request_id=request_id))
+            except ValueError as exc:
+                logger.warning("Unreadable near-duplicate answer: request_id=%s: %s", request_id, exc)
+                return None
+
+        result.update(answers)
+        check_field_formats(result)
+        return finalize_result(result)
@@ -20,6 +20,7 @@ from .exceptions import (
     InvalidReviewerError,
     FileUploadError,
 )
+from .similarity_service import InvoiceSimilarityService
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -87,6 +88,7 @@ class InvoiceSubmissionService:
                     submitted_by=user,
                     invoice_data=invoice_data,
                     invoice_file=invoice_file,
+                    text_signature=InvoiceSimilarityService.signature_for_upload(invoice_file),
                 )
 
                 # Create review assignments
@@ -158,6 +160,7 @@ class InvoiceSubmissionService:
                 getattr(invoice_file, "size", None),
             )
             submission.invoice_file = invoice_file
+            submission.text_signature = InvoiceSimilarityService.signature_for_upload(invoice_file)
 
         # Update submission data and reset status
         submission.invoice_data = invoice_data
@@ -177,7 +180,7 @@ class InvoiceSubmissionService:
                 "updated_at",
             ]
             if invoice_file:
-                update_fields.append("invoice_file")
+                update_fields.extend(["invoice_file", "text_signature"])
 
             submission.save(update_fields=update_fields)
 
@@ -0,0 +1,172 @@
+"""
+Supplier template service.
+
+Learns the word layout of a recurring supplier's invoices from approved
+submissions, and reads later invoices from that supplier with it instead
+of the OCR/AI pipeline.
+"""
+
+import logging
+from typing import Dict, Optional
+
+from django.db.models import F
+from django.utils import timezone
+
+from ocr_utils import pdf_words
+from template_utils import (
+    LAYOUT_MAX_PAGES,
+    NAME_KEY_PREFIX,
+    TemplateMismatch,
+    apply_template,
+    field_value,
+    layout_text,
+    layout_vat_ids,
+    learn_template,
+    same_value,
+    supplier_key,
+)
+from utils import finalize_result
+from ..models import InvoiceSubmission, SupplierTemplate
+
+logger = logging.getLogger(__name__)
+
+
+class SupplierTemplateService:
+    """Service for supplier layout templates."""
+
+    @staticmethod
+    def learn_from_submission(submission: InvoiceSubmission) -> Optional[SupplierTemplate]:
+        """
+        Learn (or re-learn) the supplier template of an approved submission.
+
+        The latest approved layout replaces the previous one, so a supplier
+        that changes its invoice design is picked up on the next approval.
+
+        Args:
+            submission: Approved InvoiceSubmission with an invoice PDF
+
+        Returns:
+            Saved SupplierTemplate, or None if no template could be learned
+        """
+        key = supplier_key(submission.invoice_data)
+        if not key or not submission.invoice_file:
+            return None
+        with submission.invoice_file.open("rb") as invoice_file:
+            pdf_data = invoice_file.read()
+
+        layout = learn_template(pdf_words(pdf_data, LAYOUT_MAX_PAGES), submission.invoice_data)
+        if layout is None:
+            logger.info("No supplier template learned: submission=%s supplier=%s", submission.id, key)
+            return None
+
+        template, created = SupplierTemplate.objects.update_or_create(
+            organization_id=submission.organization_id,
+            supplier_key=key[:255],
+            defaults={"layout": layout, "learned_from": submission, "learned_count": F("learned_count") + 1},
+            create_defaults={"layout": layout, "learned_from": submission, "learned_count": 1},
+        )
+        logger.info(
+            "Supplier template %s: id=%s supplier=%s fields=%s",
+            "learned" if created else "updated",
+            template.id,
+            key,
+            ",".join(layout["fields"]),
+        )
+        return template
+
+    @staticmethod
+    def learn_next_pending() -> bool:
+        """
+        Learn the template of one submission approved since (see template_learning_pending).
+
+        Called by the extraction worker, so approving never downloads or OCRs the PDF.
+
+        Returns:
+            True if a pending submission was handled, False if there was none
+        """
+        pending = (
+            InvoiceSubmission.objects.filter(template_learning_pending=True)
+            .order_by("updated_at")
+            .values_list("id", flat=True)[:5]
+        )
+        for submission_id in pending:
+            # Conditional update so only one worker thread takes the submission.
+            claimed = InvoiceSubmission.objects.filter(
+                id=submission_id, template_learning_pending=True
+            ).update(template_learning_pending=False)
+            if claimed:
+                SupplierTemplateService.learn_safely(InvoiceSubmission.objects.get(id=submission_id))
+                return True
+        return False
+
+    @staticmethod
+    def learn_safely(submission: InvoiceSubmission) -> None:
+        """learn_from_submission() for approval hooks: a failure is logged, never raised."""
+        try:
+            SupplierTemplateService.learn_from_submission(submission)
+        except Exception as exc:
+            logger.exception("Failed to learn supplier template: submission=%s: %s", submission.id, exc)
+
+    @staticmethod
+    def extract(pdf_data: bytes, organization) -> Optional[Dict]:
+        """
+        Read an invoice with the organization's template for its supplier.
+
+        The supplier is recognized by a VAT ID on the page, else by its name.
+        Every read value must pass the template's consistency checks (see
+        template_utils.apply_template()); otherwise the caller falls back to
+        the pipeline.
+
+        Args:
+            pdf_data: Invoice PDF bytes
+            organization: Organization whose templates may be used
+
+        Returns:
+            Finalized result dictionary (as utils.pipeline() returns), or None
+        """
+        layout = pdf_words(pdf_data, LAYOUT_MAX_PAGES)
+        text = layout_text(layout)
+        if not text.strip():
+            return None
+
+        templates = list(
+            SupplierTemplate.objects.filter(organization=organization, supplier_key__in=layout_vat_ids(text))
+        )
+        if not templates:
+            folded = " ".join(text.split()).casefold()
+            named = SupplierTemplate.objects.filter(
+                organization=organization, supplier_key__startswith=NAME_KEY_PREFIX
+            ).values_list("id", "supplier_key")
+            matching = [pk for pk, key in named if key[len(NAME_KEY_PREFIX):] in folded]
+            templates = list(SupplierTemplate.objects.filter(id__in=matching))
+
+        for template in templates:
+            try:
+                raw_result = apply_template(template.layout, layout)
+                SupplierTemplateService._check_supplier(template.supplier_key, raw_result)
+            except TemplateMismatch as exc:
+                SupplierTemplate.objects.filter(id=template.id).update(miss_count=F("miss_count") + 1)
+                logger.info("Supplier template mismatch: id=%s supplier=%s: %s", template.id, template.supplier_key, exc)
+                continue
+
+            SupplierTemplate.objects.filter(id=template.id).update(
+                hit_count=F("hit_count") + 1,
+                last_used_at=timezone.now(),
+            )
+            logger.info("Invoice read with supplier template: id=%s supplier=%s", template.id, template.supplier_key)
+            result = finalize_result(raw_result)
+            for field, payload in raw_result.items():
+                if "bbox" in payload and field in result:
+                    result[field]["bbox"] = payload["bbox"]
+            return result
+        return None
+
+    @staticmethod
+    def _check_supplier(key: str, raw_result: Dict) -> None:
+        if key.startswith(NAME_KEY_PREFIX):
+            field, expected = "supplier_name", key[len(NAME_KEY_PREFIX):]
+        else:
+            field, expected = "supplier_vat_id", key
+        value = field_value(raw_result, field)
+        if not same_value(field, value, expected):
+            raise TemplateMismatch(f"{field}: {value!r} is not the template's supplier")
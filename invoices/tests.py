@@ -1,3 +1,30 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from json_utils import IncrementalJSONParser, parse_json_object
+
+
+MISSING_COMMA_ANSWER = (
+    '{"supplier_name": {"value": "Acme OÜ", "confidence": "strong confidence"}\n'
+    '"supplier_address": {"value": "Narva mnt 5, Tallinn", "confidence": "strong confidence"},\n'
+    '"invoice_number": {"value": "A-17", "confidence": "strong confidence"}}'
+)
+
+
+class ParseJSONObjectTests(SimpleTestCase):
+    def test_missing_comma_keeps_each_value_under_its_own_key(self):
+        result = parse_json_object(MISSING_COMMA_ANSWER)
+
+        self.assertEqual(result["supplier_name"]["value"], "Acme OÜ")
+        self.assertEqual(result["supplier_address"]["value"], "Narva mnt 5, Tallinn")
+        self.assertEqual(result["invoice_number"]["value"], "A-17")
+
+
+class IncrementalJSONParserTests(SimpleTestCase):
+    def test_streamed_fields_match_the_final_parse_when_a_comma_is_missing(self):
+        parser = IncrementalJSONParser()
+        streamed = []
+        for start in range(0, len(MISSING_COMMA_ANSWER), 7):
+            streamed.extend(parser.feed(MISSING_COMMA_ANSWER[start:start + 7]))
+
+        self.assertEqual(dict(streamed), parse_json_object(MISSING_COMMA_ANSWER))
+        self.assertEqual([key for key, _ in streamed], ["supplier_name", "supplier_address", "invoice_number"])
@@ -6,7 +6,13 @@ from . import views
 urlpatterns = [
     path("invoices", views.invoices_page, name="invoices_page"),
     path("process", views.ProcessInvoiceView.as_view(), name="process"),
+    path("process/jobs/<uuid:job_id>", views.ExtractionJobStatusView.as_view(), name="process_job"),
+    path("process/jobs/<uuid:job_id>/events", views.process_job_events, name="process_job_events"),
+    path("process/batches", views.ProcessBatchView.as_view(), name="process_batches"),
+    path("process/batches/<uuid:batch_id>", views.ExtractionBatchStatusView.as_view(), name="process_batch"),
+    path("process/batches/<uuid:batch_id>/events", views.process_batch_events, name="process_batch_events"),
     path("process/cancel", views.CancelProcessInvoiceView.as_view(), name="process_cancel"),
+    path("process/replicate-webhook", views.replicate_webhook, name="process_replicate_webhook"),
     path("export", views.ExportInvoiceView.as_view(), name="export"),
     path("invoices/submissions", views.InvoiceSubmissionListCreateView.as_view(), name="invoice_submissions"),
     path("invoices/submissions/table", views.InvoiceSubmissionTableView.as_view(), name="invoice_submissions_table"),
@@ -16,6 +22,11 @@ urlpatterns = [
         views.InvoiceSubmissionDetailView.as_view(),
         name="invoice_submission_detail",
     ),
+    path(
+        "invoices/submissions/<int:submission_id>/reextract",
+        views.InvoiceSubmissionReextractView.as_view(),
+        name="invoice_submission_reextract",
+    ),
     path("invoices/submissions/approve", views.InvoiceSubmissionApproveView.as_view(), name="invoice_submission_approve"),
     path("invoices/submissions/reject", views.InvoiceSubmissionRejectView.as_view(), name="invoice_submission_reject"),
     path("invoices/submissions/request-edit", views.InvoiceSubmissionRequestEditView.as_view(), name="invoice_submission_request_edit"),
@@ -1,12 +1,11 @@
 import json
 import logging
-import os
-import shutil
-import tempfile
 import traceback
-from pathlib import Path
 
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse
 from django.db.models import OuterRef, Subquery
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.parsers import FormParser, MultiPartParser, JSONParser
@@ -19,18 +18,25 @@ import replicate
 from config.header import build_header_context
 from organizations.models import OrganizationMembership
 from organizations.services import get_active_membership
+from timing_utils import collect_timings, server_timing_header, span
 from utils import (
     get_prediction_cache_key,
-    get_cancel_cache_key,
-    CANCEL_CACHE_TTL,
+    request_cancel,
 )
 from django.core.cache import cache
 
-from .models import InvoiceSubmission, InvoiceSubmissionComment, InvoiceReviewAssignment
+from .models import (
+    InvoiceSubmission,
+    InvoiceSubmissionComment,
+    InvoiceReviewAssignment,
+    InvoiceExtractionJob,
+)
 from .services.submission_service import InvoiceSubmissionService
 from .services.review_service import InvoiceReviewService
 from .services.export_service import InvoiceExportService
 from .services.file_service import InvoiceFileService
+from .services.job_service import InvoiceExtractionJobService
+from .services.batch_service import InvoiceExtractionBatchService
 from .services.processing_service import InvoiceProcessingService
 from .services.exceptions import (
     SelfAssignmentError,
@@ -43,8 +49,14 @@ from .services.exceptions import (
     SubmissionAlreadyExportedError,
     SubmissionNotApprovedError,
     MissingInvoiceDataError,
+    ExtractionJobNotFoundError,
+    ExtractionBatchNotFoundError,
+    BatchUploadError,
+    InvalidWebhookError,
+    InvalidFieldSelectionError,
+    InvalidStatusTransitionError,
     ProcessingError,
-    OCREmptyError,
+    ProcessingCancelledError,
     ReplicateThrottledError,
 )
 
@@ -76,11 +88,25 @@ def _parse_reviewer_ids(value):
     return list({rid for rid in reviewer_ids if rid})
 
 
+def _parse_reasoning(value):
+    """The optional "reasoning" form field: True/False when given, None to use the organization's setting."""
+    if value is None or str(value).strip() == "":
+        return None
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
 def _build_review_payload(submission, viewer):
     """Legacy wrapper for InvoiceReviewService._build_review_payload()."""
     payload = InvoiceReviewService._build_review_payload(submission, viewer)
     return payload["reviewers"], payload["review_summary"], payload["reviewer_status"]
 
+def _with_server_timing(response, durations):
+    """Attach stage durations (milliseconds) to a response as a Server-Timing header."""
+    if durations:
+        response["Server-Timing"] = server_timing_header(durations)
+    return response
+
+
 def build_invoice_file_url(file_field, request=None) -> str | None:
     """Legacy wrapper for InvoiceFileService.get_signed_file_url()."""
     return InvoiceFileService.get_signed_file_url(file_field, request)
@@ -106,52 +132,156 @@ class ProcessInvoiceView(APIView):
 
         request_id = request.data.get("request_id")
 
-        # Save file to temp directory
-        temp_dir = tempfile.mkdtemp()
-        temp_path = os.path.join(temp_dir, file.name)
+        # Queue for the extraction worker instead of holding this web worker
+        try:
+            with collect_timings() as timings, span("enqueue"):
+                job = InvoiceExtractionJobService.enqueue(
+                    invoice_file=file,
+                    request_id=request_id,
+                    user=request.user,
+                    llm_reasoning=_parse_reasoning(request.data.get("reasoning")),
+                )
+        except Exception as exc:
+            traceback.print_exc()
+            payload = {"error": str(exc) or "Internal error"}
+            if settings.DEBUG:
+                payload["traceback"] = traceback.format_exc()
+            return Response(payload, status=500)
+
+        payload = InvoiceExtractionJobService.serialize_job(job)
+        payload["status_url"] = reverse("process_job", args=[job.id])
+        payload["events_url"] = reverse("process_job_events", args=[job.id])
+        durations = {**(job.timings or {}), **timings.as_dict()}
+        if job.status in InvoiceExtractionJob.finished_statuses():
+            return _with_server_timing(Response(payload), durations)
+        return _with_server_timing(Response(payload, status=202), durations)
+
+
+def _is_requester(request, requested_by_id) -> bool:
+    """Anonymous uploads can be followed by anyone with the ID; a signed-in user's only by that user."""
+    return requested_by_id is None or request.user.id == requested_by_id
+
+
+class ExtractionJobStatusView(APIView):
+    authentication_classes = [CsrfExemptSessionAuthentication]
+    permission_classes = [AllowAny]
+
+    def get(self, request, job_id):
+        try:
+            job = InvoiceExtractionJobService.get_job(job_id)
+        except ExtractionJobNotFoundError as e:
+            return Response({"error": str(e)}, status=404)
+        if not _is_requester(request, job.requested_by_id):
+            return Response({"error": "Access denied."}, status=403)
+
+        return _with_server_timing(Response(InvoiceExtractionJobService.serialize_job(job)), job.timings)
+
+
+def _format_sse(event: str, data) -> str:
+    if data is None:
+        # Comment line: keeps proxies from closing an idle stream
+        return f": {event}\n\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _stream_events(events):
+    try:
+        for event, data in events:
+            yield _format_sse(event, data)
+    except (ExtractionJobNotFoundError, ExtractionBatchNotFoundError) as e:
+        yield _format_sse("error", {"error": str(e)})
+
+
+def _event_stream_response(events) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(_stream_events(events), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def process_job_events(request, job_id):
+    """Server-Sent Events stream of stage changes and extracted fields for one job."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+    try:
+        job = InvoiceExtractionJobService.get_job(job_id)
+    except ExtractionJobNotFoundError as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    if not _is_requester(request, job.requested_by_id):
+        return JsonResponse({"error": "Access denied."}, status=403)
+
+    return _event_stream_response(InvoiceExtractionJobService.iter_events(job_id))
+
+
+class ProcessBatchView(APIView):
+    authentication_classes = [CsrfExemptSessionAuthentication]
+    permission_classes = [AllowAny]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        files = request.FILES.getlist("files") + request.FILES.getlist("file")
+        if not files:
+            return Response({"error": "No files uploaded."}, status=400)
 
         try:
-            # Write uploaded file to temp location
-            with open(temp_path, "wb") as f:
-                for chunk in file.chunks():
-                    f.write(chunk)
-
-            # Process using service
-            result = InvoiceProcessingService.process_invoice_file(
-                file_path=Path(temp_path),
-                request_id=request_id,
+            batch = InvoiceExtractionBatchService.create_batch(
+                files,
+                request_id=request.data.get("request_id"),
+                user=request.user,
+                llm_reasoning=_parse_reasoning(request.data.get("reasoning")),
             )
+        except BatchUploadError as e:
+            return Response({"error": str(e)}, status=400)
 
-            return Response(result)
+        payload = InvoiceExtractionBatchService.serialize_batch(batch, include_files=False)
+        payload["status_url"] = reverse("process_batch", args=[batch.id])
+        payload["events_url"] = reverse("process_batch_events", args=[batch.id])
+        return Response(payload, status=202)
 
-        except OCREmptyError as e:
-            return Response({
-                "error": str(e),
-                "code": "OCR_EMPTY",
-            }, status=422)
 
-        except ReplicateThrottledError as e:
-            return Response({
-                "error": str(e),
-                "code": "RATE_LIMITED",
-            }, status=429)
+class ExtractionBatchStatusView(APIView):
+    authentication_classes = [CsrfExemptSessionAuthentication]
+    permission_classes = [AllowAny]
 
-        except ProcessingError as e:
-            # Check if it's a cancellation
-            if "cancelled" in str(e).lower():
-                return Response({"error": str(e)}, status=409)
-            return Response({"error": str(e)}, status=502)
+    def get(self, request, batch_id):
+        try:
+            batch = InvoiceExtractionBatchService.get_batch(batch_id)
+        except ExtractionBatchNotFoundError as e:
+            return Response({"error": str(e)}, status=404)
+        if not _is_requester(request, batch.requested_by_id):
+            return Response({"error": "Access denied."}, status=403)
 
-        except Exception as exc:
-            traceback.print_exc()
-            payload = {"error": str(exc) or "Internal error"}
-            if settings.DEBUG:
-                payload["traceback"] = traceback.format_exc()
-            return Response(payload, status=500)
+        return Response(InvoiceExtractionBatchService.serialize_batch(batch))
 
-        finally:
-            # Clean up temp directory
-            shutil.rmtree(temp_dir)
+
+def process_batch_events(request, batch_id):
+    """Server-Sent Events stream of per-file results and progress for one batch."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+    try:
+        batch = InvoiceExtractionBatchService.get_batch(batch_id)
+    except ExtractionBatchNotFoundError as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    if not _is_requester(request, batch.requested_by_id):
+        return JsonResponse({"error": "Access denied."}, status=403)
+
+    return _event_stream_response(InvoiceExtractionBatchService.iter_events(batch_id))
+
+
+@csrf_exempt
+def replicate_webhook(request):
+    """Completion webhook from Replicate; wakes the extraction worker waiting on the prediction."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+    try:
+        prediction_id = InvoiceProcessingService.handle_replicate_webhook(
+            request.headers,
+            request.body.decode("utf-8"),
+        )
+    except InvalidWebhookError as e:
+        logger.warning("Rejected Replicate webhook: %s", e)
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"ok": True, "prediction_id": prediction_id})
 
 
 class CancelProcessInvoiceView(APIView):
@@ -164,11 +294,21 @@ class CancelProcessInvoiceView(APIView):
         if not request_id:
             return Response({"error": "Missing request_id."}, status=400)
 
+        # Jobs still waiting in the queue never reach Replicate; running ones
+        # (a batch can have both) are marked cancelled and pushed to the
+        # extraction worker, which cancels the prediction and frees itself
+        cancelled_jobs = InvoiceExtractionJobService.cancel_queued(request_id)
+        cancelled_jobs += InvoiceExtractionJobService.cancel_running(request_id)
+        request_cancel(request_id)
+
+        # The push reaches every listening process, whether or not one of them runs
+        # this request, so a prediction still recorded for it is cancelled here too
+        # (cancelling it twice is harmless)
         cache_key = get_prediction_cache_key(request_id)
-        cancel_key = get_cancel_cache_key(request_id)
-        cache.set(cancel_key, True, timeout=CANCEL_CACHE_TTL)
         prediction_id = cache.get(cache_key)
         if not prediction_id:
+            if cancelled_jobs:
+                return Response({"ok": True, "status": "canceled"})
             return Response({"ok": True, "status": "cancel_requested"}, status=202)
 
         try:
@@ -178,7 +318,6 @@ class CancelProcessInvoiceView(APIView):
             return Response({"error": "Failed to cancel prediction."}, status=500)
         finally:
             cache.delete(cache_key)
-            cache.delete(cancel_key)
 
         return Response({"ok": True, "status": prediction.status})
 
@@ -439,6 +578,59 @@ class InvoiceSubmissionDetailView(APIView):
         )
 
 
+class InvoiceSubmissionReextractView(APIView):
+    authentication_classes = [CsrfExemptSessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, submission_id):
+        if not request.user.is_authenticated:
+            return Response({"error": "Authentication required."}, status=401)
+
+        membership = get_active_membership(request.user)
+        if not membership:
+            return Response({"error": "No active organization."}, status=400)
+        submission = InvoiceSubmission.objects.filter(
+            id=submission_id,
+            organization=membership.organization,
+        ).first()
+        if not submission:
+            return Response({"error": "Submission not found."}, status=404)
+        if (
+            membership.role != OrganizationMembership.ROLE_ADMIN
+            and submission.submitted_by_id != request.user.id
+        ):
+            return Response({"error": "Access denied."}, status=403)
+
+        # Fields to re-extract, e.g. {"fields": ["supplier_vat_id"]}
+        fields = request.data.get("fields")
+        if hasattr(request.data, "getlist"):
+            fields = request.data.getlist("fields") or fields
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(",") if field.strip()]
+        if not isinstance(fields, list):
+            return Response({"error": "Fields are required."}, status=400)
+
+        try:
+            result = InvoiceProcessingService.reextract_submission_fields(
+                submission=submission,
+                fields=fields,
+                request_id=request.data.get("request_id"),
+            )
+            return Response({"ok": True, **result})
+
+        except (InvalidFieldSelectionError, InvalidStatusTransitionError, MissingInvoiceDataError) as e:
+            return Response({"error": str(e)}, status=400)
+        except ReplicateThrottledError as e:
+            return Response({"error": str(e)}, status=429)
+        except ProcessingCancelledError as e:
+            return Response({"error": str(e)}, status=409)
+        except ProcessingError as e:
+            return Response({"error": str(e)}, status=502)
+        except Exception as exc:
+            logger.exception("Unexpected error in re-extract view: %s", exc)
+            return Response({"error": "Internal error"}, status=500)
+
+
 class InvoiceSubmissionApproveView(APIView):
     authentication_classes = [CsrfExemptSessionAuthentication]
     permission_classes = [IsAuthenticated]
@@ -0,0 +1,228 @@
+import json
+import logging
+import re
+from typing import Any, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+_CODE_FENCE = re.compile(r"```[\w-]*[ \t]*\n?(.*?)(?:```|\Z)", re.DOTALL)
+_WORD = re.compile(r"[^\W\d]\w*")
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class IncrementalJSONParser:
+    """
+    Parse a streamed JSON object and report each top-level member as soon as its value is complete.
+
+    Feed raw chunks as they arrive; feed() returns the (key, value) pairs completed by that chunk.
+    Nested values are reported whole, once their closing bracket arrives. Text
+    around the object (e.g. a code fence) and "//" comments are skipped, and
+    values with other common defects are parsed with repair_json(). A key
+    that follows a value without a comma starts a new member; a member
+    that cannot be told apart from its neighbour is dropped rather than
+    given the wrong key.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._comment = False
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.buffer += chunk or ""
+        members = []
+        buffer = self.buffer
+        while self._pos < len(buffer) and not self.done:
+            char = buffer[self._pos]
+            pos = self._pos
+            self._pos += 1
+
+            if self._comment:
+                self._comment = char != "\n"
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key_start is not None:
+                        self._key = json.loads(buffer[self._key_start:pos + 1])
+                        self._key_start = None
+                continue
+
+            if char == "/" and self._depth:
+                if pos + 1 == len(buffer):
+                    # Wait for the next chunk to tell a comment from a stray slash.
+                    self._pos = pos
+                    break
+                if buffer[pos + 1] == "/":
+                    self._comment = True
+                    self._pos = pos + 2
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is not None and buffer[self._value_start:pos].strip():
+                    # A string after a complete value: the next key, with the comma missing.
+                    member = self._close_member(pos)
+                    if member:
+                        members.append(member)
+                if self._depth == 1 and self._value_start is None:
+                    self._key_start = pos
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 1:
+                    member = self._close_member(pos)
+                    if member:
+                        members.append(member)
+                    self.done = True
+                self._depth -= 1
+            elif self._depth == 1:
+                if char == ":":
+                    if self._value_start is not None:
+                        # A second colon for one key: whose value follows is unknown.
+                        self._key = None
+                    self._value_start = pos + 1
+                elif char == ",":
+                    member = self._close_member(pos)
+                    if member:
+                        members.append(member)
+        return members
+
+    def _close_member(self, end: int) -> Optional[Tuple[str, Any]]:
+        key, start = self._key, self._value_start
+        self._key = None
+        self._value_start = None
+        if key is None or start is None:
+            return None
+        value = self.buffer[start:end]
+        try:
+            return key, json.loads(value)
+        except ValueError:
+            pass
+        try:
+            return key, json.loads(repair_json(value))
+        except ValueError:
+            return None
+
+
+def strip_code_fence(text: str) -> str:
+    """The contents of the first ``` code fence holding JSON, or the text unchanged."""
+    match = _CODE_FENCE.search(text)
+    if match and "{" in match.group(1):
+        return match.group(1)
+    return text
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index]
+
+
+def repair_json(text: str) -> str:
+    """
+    Fix the defects LLMs commonly put in JSON.
+
+    Removes "//" and "/* */" comments and trailing commas, turns Python's
+    True/False/None into JSON literals, escapes raw newlines inside strings
+    and drops anything after the closing bracket of the top-level value.
+
+    Raises:
+        ValueError: If the text cannot be processed
+    """
+    try:
+        return _repair_json(text)
+    except Exception as exc:
+        raise ValueError(f"Cannot repair JSON: {exc}") from exc
+
+
+def _repair_json(text: str) -> str:
+    out: List[str] = []
+    depth = 0
+    in_string = escape = False
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            out.append(char)
+            pos += 1
+            continue
+
+        if text.startswith("//", pos):
+            end = text.find("\n", pos)
+            pos = len(text) if end < 0 else end
+            continue
+        if text.startswith("/*", pos):
+            end = text.find("*/", pos + 2)
+            pos = len(text) if end < 0 else end + 2
+            continue
+        word = _WORD.match(text, pos) if char.isalpha() or char == "_" else None
+        if word:
+            out.append(_PYTHON_LITERALS.get(word.group(), word.group()))
+            pos = word.end()
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            depth -= 1
+        out.append(char)
+        pos += 1
+        if depth == 0 and char in "}]":
+            break
+    return "".join(out)
+
+
+def parse_json_object(text: str) -> dict:
+    """
+    Parse the JSON object in an LLM answer, tolerating the defects models commonly produce.
+
+    Tries the object as is (ignoring prose and code fences around it), then
+    repaired (see repair_json), then keeps the top-level members that are
+    complete, for output cut off mid-object.
+
+    Raises:
+        ValueError: If no JSON object can be recovered
+    """
+    text = strip_code_fence(text)
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("LLM output holds no JSON object.")
+    text = text[start:]
+    try:
+        result = json.JSONDecoder().raw_decode(text)[0]
+    except ValueError:
+        try:
+            result = json.loads(repair_json(text))
+        except ValueError:
+            result = dict(IncrementalJSONParser().feed(text))
+            if not result:
+                raise ValueError("LLM output holds no parseable JSON object.")
+            logger.warning("Recovered %s complete members from malformed LLM JSON.", len(result))
+    if not isinstance(result, dict):
+        raise ValueError("LLM output is not a JSON object.")
+    return result
@@ -0,0 +1,283 @@
+import atexit
+import http.server
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+METRICS_DB = os.getenv(
+    "METRICS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "metrics.sqlite3"),
+)
+# Each process adds its recorded values to the shared file this often.
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Seconds; covers sub-millisecond spans up to long LLM runs.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# name -> (type, help). Histograms are stored as their _bucket/_sum/_count series.
+METRICS = {
+    "invoice_extraction_stage_seconds": ("histogram", "Duration of extraction stages (see timing_utils spans)."),
+    "invoice_extraction_jobs_total": ("counter", "Finished extraction jobs by status and error code."),
+    "replicate_predictions_total": ("counter", "Finished Replicate predictions by model and status."),
+    "replicate_throttled_total": ("counter", "Replicate prediction creations throttled, by where the limit hit."),
+    "invoice_extraction_cancel_requests_total": ("counter", "Extraction cancellation requests."),
+    "google_sheets_export_seconds": ("histogram", "Duration of Google Sheets exports by outcome."),
+    "s3_url_signing_seconds": ("histogram", "Duration of signing S3 invoice URLs by outcome."),
+    "http_request_duration_seconds": ("histogram", "HTTP request duration by route, method and status."),
+    "http_request_db_queries": ("histogram", "Database queries per HTTP request by route and method."),
+    "llm_route_seconds": ("histogram", "End-to-end LLM latency of an extraction by cascade route."),
+    "llm_model_seconds": ("histogram", "Latency of single LLM calls by model."),
+    "llm_cascade_fields_total": ("counter", "Fields asked of the small model in cascaded extractions."),
+    "llm_cascade_fields_escalated_total": ("counter", "Fields of cascaded extractions re-asked from the large model."),
+}
+
+
+_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _labels_text(labels: Dict[str, object]) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return ",".join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of this process, added to a SQLite file shared by all workers.
+
+    Recording only updates a dict under a lock. A daemon thread writes the
+    accumulated deltas every METRICS_FLUSH_INTERVAL seconds (and at exit),
+    so the request path never waits on SQLite, and a scrape reads the file
+    without touching any worker.
+    """
+
+    def __init__(self, path: str, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._initialized = False
+
+    def inc(self, name: str, amount: float = 1.0, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        self._add([((name, _labels_text(labels)), amount)])
+
+    def observe(self, name: str, value: float, buckets: Iterable[float] = LATENCY_BUCKETS, **labels) -> None:
+        """Record one histogram observation (cumulative buckets, as Prometheus expects)."""
+        if not METRICS_ENABLED or value is None:
+            return
+        # Every bucket gets a row (even at 0): Prometheus expects the full set.
+        deltas = [
+            ((f"{name}_bucket", _labels_text({**labels, "le": bound})), 1 if value <= bound else 0)
+            for bound in buckets
+        ]
+        deltas.append(((f"{name}_bucket", _labels_text({**labels, "le": "+Inf"})), 1))
+        deltas.append(((f"{name}_sum", _labels_text(labels)), value))
+        deltas.append(((f"{name}_count", _labels_text(labels)), 1))
+        self._add(deltas)
+
+    def _add(self, deltas) -> None:
+        with self._lock:
+            for key, amount in deltas:
+                self._pending[key] = self._pending.get(key, 0) + amount
+            # Started per process: gunicorn forks workers after the app may have recorded something.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                "name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, "
+                "PRIMARY KEY (name, labels))"
+            )
+            self._initialized = True
+        return conn
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, value) for (name, labels), value in pending.items()],
+                )
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except sqlite3.Error as exc:
+            # Keep the values for the next flush rather than losing them.
+            logger.warning("Failed to flush metrics: %s", exc)
+            with self._lock:
+                for key, amount in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + amount
+
+    def read(self, names: Optional[Iterable[str]] = None) -> List[Tuple[str, str, float]]:
+        """Flushed (name, labels, value) rows, of all series or only of the given names."""
+        query, params = "SELECT name, labels, value FROM metrics", []
+        if names is not None:
+            params = list(names)
+            query += f" WHERE name IN ({', '.join('?' for _ in params)})"
+        try:
+            conn = self._connect()
+            try:
+                return conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as exc:
+            logger.warning("Failed to read metrics: %s", exc)
+            return []
+
+    def delete(self, names: Iterable[str]) -> None:
+        params = list(names)
+        with self._lock:
+            self._pending = {key: value for key, value in self._pending.items() if key[0] not in params}
+        conn = self._connect()
+        try:
+            conn.execute(f"DELETE FROM metrics WHERE name IN ({', '.join('?' for _ in params)})", params)
+        finally:
+            conn.close()
+
+
+registry = MetricsRegistry(METRICS_DB, METRICS_FLUSH_INTERVAL)
+atexit.register(registry.flush)
+
+
+def inc(name: str, amount: float = 1.0, **labels) -> None:
+    registry.inc(name, amount, **labels)
+
+
+def observe(name: str, value: float, buckets: Iterable[float] = LATENCY_BUCKETS, **labels) -> None:
+    registry.observe(name, value, buckets, **labels)
+
+
+def _series_names(name: str) -> List[str]:
+    if METRICS.get(name, ("",))[0] == "histogram":
+        return [f"{name}_bucket", f"{name}_sum", f"{name}_count"]
+    return [name]
+
+
+def totals(name: str, by: str) -> Dict[str, float]:
+    """
+    Flushed value of a counter, or of a histogram's _sum/_count series, per value of one label.
+
+    Other processes' values arrive with their next flush (METRICS_FLUSH_INTERVAL).
+    """
+    values: Dict[str, float] = {}
+    for _, labels, value in registry.read([name]):
+        key = dict(_LABEL_PATTERN.findall(labels)).get(by, "")
+        values[key] = values.get(key, 0) + value
+    return values
+
+
+def reset(*names: str) -> None:
+    """Drop the recorded values of these metrics (with every series of a histogram)."""
+    registry.delete([series for name in names for series in _series_names(name)])
+
+
+_LE_PATTERN = re.compile(r'le="([^"]+)"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render_prometheus(gauges: Optional[List[Tuple[str, str, Dict[str, object], float]]] = None) -> str:
+    """
+    Prometheus text exposition of every process's flushed metrics.
+
+    Args:
+        gauges: Values computed at scrape time, as (name, help, labels, value)
+    """
+    def order(row):
+        name, labels, _ = row
+        bound = _LE_PATTERN.search(labels)
+        return name, _LE_PATTERN.sub("", labels), float(bound.group(1)) if bound else 0.0
+
+    families: Dict[str, List[str]] = {}
+    for name, labels, value in sorted(registry.read(), key=order):
+        family = name
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[: -len(suffix)] in METRICS:
+                family = name[: -len(suffix)]
+        series = f"{name}{{{labels}}}" if labels else name
+        families.setdefault(family, []).append(f"{series} {_format_value(value)}")
+
+    lines = []
+    for family, samples in families.items():
+        kind, help_text = METRICS.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        lines.extend(samples)
+    for name, help_text, labels, value in gauges or []:
+        if f"# TYPE {name} gauge" not in lines:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+        labels_text = _labels_text(labels)
+        lines.append(f"{name}{{{labels_text}}} {_format_value(value)}" if labels_text else f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def start_server(bind: str, render: Callable[[], str]) -> http.server.ThreadingHTTPServer:
+    """
+    Serve render() as /metrics on its own "host:port", in a daemon thread.
+
+    Meant for a port only the private network reaches, since it asks for no credentials.
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            try:
+                body = render().encode("utf-8")
+            except Exception as exc:
+                logger.exception("Failed to render metrics: %s", exc)
+                self.send_error(500)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    host, _, port = bind.rpartition(":")
+    server = http.server.ThreadingHTTPServer((host, int(port)), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,176 @@
+import operator
+import re
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Signature size: 64 one-permutation MinHash bins, split into 16 LSH bands of 4.
+MINHASH_BINS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_BINS // LSH_BANDS
+SHINGLE_WORDS = 3
+SIGNATURE_FORMAT = f"<{MINHASH_BINS}I"
+# Band entries added since the last merge are kept in a dict; merging re-sorts the band arrays.
+PENDING_MERGE_LIMIT = 4096
+# Recurring bills can fill one bucket; only the most recently indexed candidates are compared.
+MAX_CANDIDATES = 256
+
+_BIN_BITS = MINHASH_BINS.bit_length() - 1
+_MIX = 0x9E3779B1
+_DENSIFY_OFFSET = 0x7FEB352D
+_WORD_PATTERN = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+
+
+def shingles(text: str) -> set:
+    """Word 3-grams of the text, case-folded and with every number replaced by "0"."""
+    words = _WORD_PATTERN.findall(_DIGITS.sub("0", (text or "").casefold()))
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words).encode()} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]).encode() for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def text_signature(text: str) -> Optional[Tuple[int, ...]]:
+    """
+    One-permutation MinHash signature of the text's shingles, or None for an empty text.
+
+    Each shingle is hashed once; the top bits pick its bin and each bin keeps
+    its smallest hash. Empty bins borrow from the next filled bin so that
+    signatures of short texts stay comparable.
+    """
+    bins: List[Optional[int]] = [None] * MINHASH_BINS
+    for shingle in shingles(text):
+        value = (zlib.crc32(shingle) * _MIX) & 0xFFFFFFFF
+        index = value >> (32 - _BIN_BITS)
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    filled = [index for index, value in enumerate(bins) if value is not None]
+    if not filled:
+        return None
+    for index in range(MINHASH_BINS):
+        if bins[index] is not None:
+            continue
+        distance = 1
+        while bins[(index + distance) % MINHASH_BINS] is None:
+            distance += 1
+        borrowed = bins[(index + distance) % MINHASH_BINS]
+        bins[index] = (borrowed + distance * _DENSIFY_OFFSET) & 0xFFFFFFFF
+    return tuple(bins)
+
+
+def pack_signature(signature: Sequence[int]) -> bytes:
+    return struct.pack(SIGNATURE_FORMAT, *signature)
+
+
+def unpack_signature(data: bytes) -> Tuple[int, ...]:
+    return struct.unpack(SIGNATURE_FORMAT, bytes(data))
+
+
+def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the two texts' shingles."""
+    return sum(map(operator.eq, first, second)) / MINHASH_BINS
+
+
+def _band_hashes(signature: Sequence[int]) -> List[int]:
+    packed = pack_signature(signature)
+    size = LSH_ROWS * 4
+    return [zlib.crc32(packed[band * size:(band + 1) * size]) for band in range(LSH_BANDS)]
+
+
+class MinHashIndex:
+    """
+    LSH index over MinHash signatures, compact enough for 100k documents per process.
+
+    Signatures live in one flat array("I") (256 bytes each); every band is a
+    sorted array("Q") of (band hash << 32 | slot) entries searched with
+    bisect, so no per-document Python objects are kept besides the key map.
+    """
+
+    def __init__(self):
+        self.keys = array("q")
+        self.signatures = array("I")
+        self.slots: Dict[int, int] = {}
+        self._bands = [array("Q") for _ in range(LSH_BANDS)]
+        self._pending: List[Dict[int, List[int]]] = [{} for _ in range(LSH_BANDS)]
+        self._pending_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: int, signature: Sequence[int]) -> None:
+        """Index a document; adding a key again replaces its signature."""
+        with self._lock:
+            self._add(key, signature)
+            if self._pending_count >= PENDING_MERGE_LIMIT:
+                self._merge()
+
+    def extend(self, items: Iterable[Tuple[int, Sequence[int]]]) -> None:
+        """Index many documents, merging the bands once at the end."""
+        with self._lock:
+            added: List[List[int]] = [[] for _ in range(LSH_BANDS)]
+            for key, signature in items:
+                slot = self._store(key, signature)
+                for band, band_hash in enumerate(_band_hashes(signature)):
+                    added[band].append((band_hash << 32) | slot)
+            self._merge(added)
+
+    def _add(self, key: int, signature: Sequence[int]) -> None:
+        slot = self._store(key, signature)
+        for band, band_hash in enumerate(_band_hashes(signature)):
+            self._pending[band].setdefault(band_hash, []).append(slot)
+        self._pending_count += 1
+
+    def _store(self, key: int, signature: Sequence[int]) -> int:
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.keys)
+            self.keys.append(key)
+            self.signatures.extend(signature)
+            self.slots[key] = slot
+        else:
+            # Entries of the old signature stay in the bands; the comparison in query() drops them.
+            self.signatures[slot * MINHASH_BINS:(slot + 1) * MINHASH_BINS] = array("I", signature)
+        return slot
+
+    def _merge(self, added: Optional[List[List[int]]] = None) -> None:
+        for band in range(LSH_BANDS):
+            if not self._pending[band] and not (added and added[band]):
+                continue
+            entries = self._bands[band].tolist()
+            entries.extend(
+                (band_hash << 32) | slot
+                for band_hash, slots in self._pending[band].items()
+                for slot in slots
+            )
+            if added:
+                entries.extend(added[band])
+            entries.sort()
+            self._bands[band] = array("Q", entries)
+            self._pending[band] = {}
+        self._pending_count = 0
+
+    def query(self, signature: Sequence[int], threshold: float) -> List[Tuple[int, float]]:
+        """Keys of indexed documents at least `threshold` similar, most similar (then most recent) first."""
+        candidates = set()
+        with self._lock:
+            for band, band_hash in enumerate(_band_hashes(signature)):
+                entries = self._bands[band]
+                position = bisect_left(entries, band_hash << 32)
+                while position < len(entries) and entries[position] >> 32 == band_hash:
+                    candidates.add(entries[position] & 0xFFFFFFFF)
+                    position += 1
+                candidates.update(self._pending[band].get(band_hash, ()))
+
+            matches = []
+            for slot in sorted(candidates, reverse=True)[:MAX_CANDIDATES]:
+                stored = self.signatures[slot * MINHASH_BINS:(slot + 1) * MINHASH_BINS]
+                score = similarity(stored, signature)
+                if score >= threshold:
+                    matches.append((self.keys[slot], score))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
@@ -0,0 +1,198 @@
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+# Every listening process binds one datagram socket here; publishers broadcast to all of them.
+NOTIFY_SOCKET_DIR = os.getenv(
+    "NOTIFY_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "invoice_ai_notify")
+)
+# Published keys are remembered this long, so a late subscriber still sees a cancel.
+NOTIFY_KEY_TTL = 60 * 60
+NOTIFY_MAX_MESSAGE = 1024
+
+logger = logging.getLogger(__name__)
+
+
+def cancel_key(request_id: str) -> str:
+    return f"cancel:{request_id}"
+
+
+def completion_key(prediction_id: str) -> str:
+    return f"completed:{prediction_id}"
+
+
+def job_key(job_id) -> str:
+    return f"job:{job_id}"
+
+
+def batch_key(batch_id) -> str:
+    return f"batch:{batch_id}"
+
+
+class Subscription:
+    def __init__(self, keys: List[str], callback: Optional[Callable[[str], None]] = None):
+        self.keys = keys
+        self.callback = callback
+        self.event = threading.Event()
+        self.fired = set()
+        self._lock = threading.Lock()
+
+    def fire(self, key: str) -> None:
+        with self._lock:
+            self.fired.add(key)
+            self.event.set()
+        if self.callback is not None:
+            try:
+                self.callback(key)
+            except Exception as exc:
+                logger.warning("Notification callback for %s failed: %s", key, exc)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.event.wait(timeout)
+
+    def reset(self, *keys: str) -> None:
+        """Forget the given fired keys; the event stays set while other keys remain fired."""
+        with self._lock:
+            self.fired.difference_update(keys)
+            if not self.fired:
+                self.event.clear()
+
+
+class NotificationBus:
+    """
+    Push notifications between processes on one host over Unix datagram sockets.
+
+    Used to interrupt waits on cancellation and webhook completion without
+    polling a shared cache.
+    """
+
+    def __init__(self, directory: str = NOTIFY_SOCKET_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self._lock = threading.Lock()
+        self._subscriptions: Dict[str, List[Subscription]] = {}
+        self._published: Dict[str, float] = {}
+        self._socket: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._socket is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.path)
+            self._socket = sock
+            self._thread = threading.Thread(target=self._listen, name="notify-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            sock, self._socket = self._socket, None
+        if sock is None:
+            return
+        sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _listen(self) -> None:
+        sock = self._socket
+        while True:
+            try:
+                data = sock.recv(NOTIFY_MAX_MESSAGE)
+            except OSError:
+                break
+            self._deliver(data.decode("utf-8", "replace"))
+
+    def _deliver(self, key: str) -> int:
+        now = time.monotonic()
+        with self._lock:
+            self._published[key] = now
+            self._prune(now)
+            subscriptions = list(self._subscriptions.get(key, ()))
+        for subscription in subscriptions:
+            subscription.fire(key)
+        return len(subscriptions)
+
+    def _prune(self, now: float) -> None:
+        expired = [key for key, at in self._published.items() if now - at > NOTIFY_KEY_TTL]
+        for key in expired:
+            del self._published[key]
+
+    def is_published(self, key: str) -> bool:
+        with self._lock:
+            return key in self._published
+
+    def subscribe(self, *keys: str, callback: Optional[Callable[[str], None]] = None) -> Subscription:
+        """Subscribe to keys; the subscription fires at once for keys already published."""
+        self.start()
+        subscription = Subscription(list(keys), callback)
+        with self._lock:
+            for key in keys:
+                self._subscriptions.setdefault(key, []).append(subscription)
+            already = [key for key in keys if key in self._published]
+        for key in already:
+            subscription.fire(key)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for key in subscription.keys:
+                subscribers = self._subscriptions.get(key, [])
+                if subscription in subscribers:
+                    subscribers.remove(subscription)
+                if not subscribers:
+                    self._subscriptions.pop(key, None)
+
+    def publish(self, key: str) -> int:
+        """
+        Deliver key to this process and every listening process.
+
+        Returns the number of other processes reached.
+        """
+        self._deliver(key)
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+
+        delivered = 0
+        data = key.encode("utf-8")[:NOTIFY_MAX_MESSAGE]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            for name in names:
+                path = os.path.join(self.directory, name)
+                if path == self.path or not name.endswith(".sock"):
+                    continue
+                try:
+                    sock.sendto(data, path)
+                    delivered += 1
+                except ConnectionRefusedError:
+                    # Listener exited without cleaning up.
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                except (FileNotFoundError, OSError) as exc:
+                    logger.warning("Could not notify %s: %s", path, exc)
+        return delivered
+
+
+_bus: Optional[NotificationBus] = None
+_bus_lock = threading.Lock()
+
+
+def get_notification_bus() -> NotificationBus:
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = NotificationBus()
+        return _bus
@@ -0,0 +1,375 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import fitz
+import pymupdf4llm
+
+from text_utils import (
+    AMOUNT_PATTERN,
+    BOILERPLATE_KEYWORDS,
+    INVOICE_KEYWORDS,
+    PAGE_BREAK,
+    VAT_ID_PATTERN,
+    estimate_tokens,
+)
+
+
+# Number of OCR worker processes; 0 runs OCR inside the calling process.
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", str(min(os.cpu_count() or 1, 2))))
+# Documents with fewer pages are converted by a single worker; sharding only pays off for longer ones.
+OCR_PARALLEL_MIN_PAGES = int(os.getenv("OCR_PARALLEL_MIN_PAGES", "2"))
+OCR_JOB_TIMEOUT = float(os.getenv("OCR_JOB_TIMEOUT", "120"))
+# Recycle workers periodically to cap MuPDF memory growth.
+OCR_WORKER_MAX_JOBS = int(os.getenv("OCR_WORKER_MAX_JOBS", "50"))
+
+# Scanned pages (no usable text layer) are rasterized and read with Tesseract.
+OCR_IMAGE_ENABLED = os.getenv("OCR_IMAGE_ENABLED", "1") == "1"
+OCR_IMAGE_LANGUAGES = os.getenv("OCR_IMAGE_LANGUAGES", "eng+est")
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "25"))
+OCR_IMAGE_MIN_DPI = 150
+OCR_IMAGE_MAX_DPI = 300
+OCR_IMAGE_DEFAULT_DPI = 200
+
+# Long documents are trimmed to the pages most likely to hold header, parties and totals.
+OCR_TOKEN_BUDGET = int(os.getenv("OCR_TOKEN_BUDGET", "12000"))
+OCR_PAGE_SCAN_LIMIT = int(os.getenv("OCR_PAGE_SCAN_LIMIT", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+class OCRWorkerError(RuntimeError):
+    pass
+
+
+class OCRTimeoutError(OCRWorkerError):
+    pass
+
+
+def open_pdf(data: bytes):
+    return fitz.open(stream=data, filetype="pdf")
+
+
+def score_page_text(text: str) -> float:
+    """Cheap relevance score: invoice keyword, amount and VAT ID hits per 100 tokens, minus boilerplate."""
+    hits = (
+        len(INVOICE_KEYWORDS.findall(text)) * 2.0
+        + len(AMOUNT_PATTERN.findall(text)) * 1.0
+        + len(VAT_ID_PATTERN.findall(text)) * 3.0
+        - len(BOILERPLATE_KEYWORDS.findall(text)) * 4.0
+    )
+    tokens = max(estimate_tokens(text), 1)
+    return hits * 100.0 / tokens
+
+
+def select_pages(doc, max_pages: int, token_budget: int = OCR_TOKEN_BUDGET) -> List[int]:
+    """Pick the most relevant pages within max_pages and token_budget, in document order."""
+    page_count = doc.page_count
+    if page_count <= 0:
+        return []
+
+    candidates = list(range(page_count))
+    if page_count > OCR_PAGE_SCAN_LIMIT:
+        half = OCR_PAGE_SCAN_LIMIT // 2
+        candidates = candidates[:half] + candidates[-half:]
+
+    texts = {pno: doc[pno].get_text("text") for pno in candidates}
+    tokens = {pno: max(estimate_tokens(text), 1) for pno, text in texts.items()}
+    if page_count <= max_pages and sum(tokens.values()) <= token_budget:
+        return candidates
+
+    # Header and parties sit on the first page, totals usually on the last.
+    pinned = [0, page_count - 1][:max_pages]
+    ranked = sorted(
+        (pno for pno in candidates if pno not in pinned),
+        key=lambda pno: score_page_text(texts[pno]),
+        reverse=True,
+    )
+    selected = list(dict.fromkeys(pinned))
+    used_tokens = sum(tokens[pno] for pno in selected)
+    for pno in ranked:
+        if len(selected) >= max_pages:
+            break
+        if used_tokens + tokens[pno] > token_budget or score_page_text(texts[pno]) < 0:
+            continue
+        selected.append(pno)
+        used_tokens += tokens[pno]
+    return sorted(selected)
+
+
+def page_needs_ocr(page) -> bool:
+    """A page needs image OCR when it has raster content but (almost) no text layer."""
+    if len(page.get_text("text").strip()) >= OCR_MIN_TEXT_CHARS:
+        return False
+    return bool(page.get_images())
+
+
+def _ocr_dpi(page) -> int:
+    # Match the resolution of the embedded scan instead of upsampling blindly.
+    dpis = []
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        if bbox.width > 0 and info.get("width"):
+            dpis.append(info["width"] * 72 / bbox.width)
+    dpi = max(dpis) if dpis else OCR_IMAGE_DEFAULT_DPI
+    return int(min(max(dpi, OCR_IMAGE_MIN_DPI), OCR_IMAGE_MAX_DPI))
+
+
+def _ocr_page_text(page) -> str:
+    try:
+        textpage = page.get_textpage_ocr(
+            language=OCR_IMAGE_LANGUAGES,
+            dpi=_ocr_dpi(page),
+            full=True,
+        )
+    except RuntimeError as exc:
+        # Tesseract missing or misconfigured: behave as before and return no text.
+        logger.warning("Image OCR unavailable for page %s: %s", page.number, exc)
+        return ""
+    text = page.get_text("text", textpage=textpage).strip()
+    return f"{text}\n\n" if text else ""
+
+
+def _text_pages_markdown(doc, pages: List[int]) -> str:
+    chunks = pymupdf4llm.to_markdown(doc, pages=pages, page_chunks=True)
+    return "".join(chunk["text"] + PAGE_BREAK for chunk in chunks)
+
+
+def _convert_pages(doc, pages: List[int]) -> str:
+    """
+    Markdown for pages in order, each ended by PAGE_BREAK; consecutive text
+    pages are converted in one pymupdf4llm call.
+    """
+    if not OCR_IMAGE_ENABLED:
+        return _text_pages_markdown(doc, pages)
+
+    parts = []
+    text_run = []
+    for pno in pages:
+        page = doc[pno]
+        if not page_needs_ocr(page):
+            text_run.append(pno)
+            continue
+        if text_run:
+            parts.append(_text_pages_markdown(doc, text_run))
+            text_run = []
+        parts.append(_ocr_page_text(page) + PAGE_BREAK)
+    if text_run:
+        parts.append(_text_pages_markdown(doc, text_run))
+    return "".join(parts)
+
+
+def _document_markdown(data: bytes, max_pages: int, min_shard_pages: int) -> Tuple[List[int], Optional[str]]:
+    """
+    Open the PDF once, select relevant pages and convert them, unless there are enough to shard.
+
+    Returns (selected_pages, markdown); markdown is None when the caller should shard.
+    """
+    with open_pdf(data) as doc:
+        pages = select_pages(doc, max_pages)
+        if not pages:
+            return pages, ""
+        if len(pages) >= min_shard_pages:
+            return pages, None
+        return pages, _convert_pages(doc, pages)
+
+
+def _shard_markdown(data: bytes, pages: List[int]) -> str:
+    with open_pdf(data) as doc:
+        return _convert_pages(doc, pages)
+
+
+def _page_words(data: bytes, max_pages: int) -> dict:
+    """Word boxes of the first max_pages - 1 pages and the last page, for layout templates."""
+    with open_pdf(data) as doc:
+        page_count = doc.page_count
+        numbers = sorted(set(range(min(max_pages - 1, page_count))) | {page_count - 1}) if page_count else []
+        pages = []
+        for pno in numbers:
+            page = doc[pno]
+            pages.append({
+                "number": pno,
+                "width": page.rect.width,
+                "height": page.rect.height,
+                # (x0, y0, x1, y1, text, block, line), in reading order
+                "words": [list(word[:7]) for word in page.get_text("words", sort=True)],
+            })
+        return {"page_count": page_count, "pages": pages}
+
+
+OCR_TASKS = {
+    "document_markdown": _document_markdown,
+    "shard_markdown": _shard_markdown,
+    "page_words": _page_words,
+}
+
+
+def _warm_up() -> None:
+    # Pay the import and first-use cost before the first real document arrives.
+    with fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), "warm up")
+        pymupdf4llm.to_markdown(doc)
+
+
+def _ocr_worker_main(conn) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _warm_up()
+    conn.send(("ready", None))
+    while True:
+        try:
+            task, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            conn.send(("ok", OCR_TASKS[task](*args)))
+        except Exception as exc:
+            conn.send(("error", f"{type(exc).__name__}: {exc}"))
+
+
+class _OCRWorker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_ocr_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.jobs_done = 0
+
+    def _receive(self, timeout: float):
+        if not self.conn.poll(timeout):
+            raise OCRTimeoutError(f"OCR worker did not respond within {timeout:.0f}s.")
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.process.join(timeout=1)
+            raise OCRWorkerError(
+                f"OCR worker crashed (exit code {self.process.exitcode})."
+            )
+
+    def call(self, task: str, args: tuple, timeout: float):
+        if not self.ready:
+            self._receive(timeout)
+            self.ready = True
+        self.conn.send((task, args))
+        status, payload = self._receive(timeout)
+        self.jobs_done += 1
+        return status, payload
+
+    def stop(self) -> None:
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=1)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join(timeout=1)
+        self.conn.close()
+
+
+class OCRWorkerPool:
+    """Long-lived OCR processes fed over pipes, isolating MuPDF crashes from the caller."""
+
+    def __init__(self, size: int, job_timeout: float, max_jobs_per_worker: int):
+        self.size = size
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        # spawn: callers are multi-threaded, so forking is unsafe.
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(_OCRWorker(self._ctx))
+            self._started = True
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._started = False
+            while True:
+                try:
+                    self._idle.get_nowait().stop()
+                except queue.Empty:
+                    break
+
+    def call(self, task: str, *args, timeout: Optional[float] = None):
+        self.start()
+        worker = self._idle.get()
+        healthy = False
+        try:
+            status, payload = worker.call(task, args, timeout or self.job_timeout)
+            healthy = True
+        finally:
+            if not healthy or worker.jobs_done >= self.max_jobs_per_worker:
+                worker.stop()
+                worker = _OCRWorker(self._ctx)
+            self._idle.put(worker)
+        if status == "error":
+            raise OCRWorkerError(payload)
+        return payload
+
+
+_ocr_pool: Optional[OCRWorkerPool] = None
+_ocr_pool_lock = threading.Lock()
+
+
+def get_ocr_pool() -> OCRWorkerPool:
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = OCRWorkerPool(
+                size=max(OCR_MAX_WORKERS, 1),
+                job_timeout=OCR_JOB_TIMEOUT,
+                max_jobs_per_worker=OCR_WORKER_MAX_JOBS,
+            )
+        return _ocr_pool
+
+
+def _run_task(task: str, *args):
+    if OCR_MAX_WORKERS <= 0:
+        return OCR_TASKS[task](*args)
+    return get_ocr_pool().call(task, *args)
+
+
+def shard_pages(pages: List[int], shard_count: int) -> List[List[int]]:
+    """Split pages into contiguous, evenly sized shards, preserving order."""
+    shard_count = max(1, min(shard_count, len(pages)))
+    size, extra = divmod(len(pages), shard_count)
+    shards = []
+    start = 0
+    for i in range(shard_count):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(pages[start:end])
+        start = end
+    return shards
+
+
+def pdf_to_markdown(data: bytes, max_pages: int) -> Tuple[str, List[int]]:
+    """
+    Convert up to max_pages relevant pages of an in-memory PDF, sharding across the OCR pool when worthwhile.
+
+    Returns (markdown, selected_pages).
+    """
+    min_shard_pages = max(OCR_PARALLEL_MIN_PAGES, 2) if OCR_MAX_WORKERS > 1 else sys.maxsize
+    pages, md_text = _run_task("document_markdown", data, max_pages, min_shard_pages)
+    if md_text is not None:
+        return md_text, pages
+
+    shards = shard_pages(pages, OCR_MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=len(shards)) as dispatcher:
+        parts = dispatcher.map(lambda shard: _run_task("shard_markdown", data, shard), shards)
+        return "".join(parts), pages
+
+
+def pdf_words(data: bytes, max_pages: int = 3) -> dict:
+    """Word layout of an in-memory PDF (see _page_words()), read in the OCR pool."""
+    return _run_task("page_words", data, max(max_pages, 1))
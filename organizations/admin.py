@@ -5,7 +5,8 @@ from .models import Organization, OrganizationInvite, OrganizationMembership
 
 @admin.register(Organization)
 class OrganizationAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "created_at", "created_by")
+    list_display = ("id", "name", "created_at", "created_by", "llm_reasoning")
+    list_filter = ("llm_reasoning",)
     search_fields = ("name",)
 
 
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0003_remove_organizationinvite_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='llm_reasoning',
+            field=models.BooleanField(default=False, help_text='Have the LLM explain its answers (slower; for debugging extractions).'),
+        ),
+    ]
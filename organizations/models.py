@@ -15,6 +15,10 @@ class Organization(models.Model):
         on_delete=models.SET_NULL,
         related_name="organizations_created",
     )
+    llm_reasoning = models.BooleanField(
+        default=False,
+        help_text="Have the LLM explain its answers (slower; for debugging extractions).",
+    )
 
     def __str__(self) -> str:
         return self.name
@@ -0,0 +1,332 @@
+import re
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set
+
+from text_utils import AMOUNT_PATTERN, BUYER_LABELS, SUPPLIER_LABELS, party_lines
+
+
+# Deterministic values are only reported when the text leaves no doubt about them.
+PRE_EXTRACTED_CONFIDENCE = "strong confidence"
+
+VAT_ID_FORMATS = {
+    "AT": r"U\d{8}",
+    "BE": r"[01]\d{9}",
+    "BG": r"\d{9,10}",
+    "CY": r"\d{8}[A-Z]",
+    "CZ": r"\d{8,10}",
+    "DE": r"\d{9}",
+    "DK": r"\d{8}",
+    "EE": r"\d{9}",
+    "EL": r"\d{9}",
+    "ES": r"[A-Z0-9]\d{7}[A-Z0-9]",
+    "FI": r"\d{8}",
+    "FR": r"[A-HJ-NP-Z0-9]{2}\d{9}",
+    "GB": r"\d{9}(?:\d{3})?",
+    "HR": r"\d{11}",
+    "HU": r"\d{8}",
+    "IE": r"\d{7}[A-W][A-I]?|\d[A-Z+*]\d{5}[A-W]",
+    "IT": r"\d{11}",
+    "LT": r"\d{9}(?:\d{3})?",
+    "LU": r"\d{8}",
+    "LV": r"\d{11}",
+    "MT": r"\d{8}",
+    "NL": r"\d{9}B\d{2}",
+    "PL": r"\d{10}",
+    "PT": r"\d{9}",
+    "RO": r"\d{2,10}",
+    "SE": r"\d{12}",
+    "SI": r"\d{8}",
+    "SK": r"\d{10}",
+    "XI": r"\d{9}(?:\d{3})?",
+}
+VAT_ID_VALIDATORS = {country: re.compile(country + f"(?:{body})") for country, body in VAT_ID_FORMATS.items()}
+VAT_ID_CANDIDATE_PATTERN = re.compile(
+    r"\b(" + "|".join(VAT_ID_FORMATS) + r")[ \-]?([0-9A-Z+*]{2,12})\b"
+)
+
+INVOICE_NUMBER_PATTERN = re.compile(
+    r"\b(?:invoice|arve|inv|bill)\.?\s*(?:(?:no|nr|number|num)\b\.?|#)\s*[:#]?\s*"
+    r"([A-Z0-9][A-Z0-9\-/._]*\d[A-Z0-9\-/._]*)",
+    re.IGNORECASE,
+)
+INVOICE_DATE_LABELS = re.compile(
+    r"\b(invoice date|date of issue|issue date|issued(?: on)?|arve kuupäev|kuupäev|date)\b",
+    re.IGNORECASE,
+)
+OTHER_DATE_LABELS = re.compile(
+    r"\b(due|maksetähtaeg|tähtaeg|delivery|period|order|supply|tarne|periood|valid)\b",
+    re.IGNORECASE,
+)
+
+TOTAL_LABELS = re.compile(
+    r"\b(total|amount due|balance due|to pay|kokku|tasuda|tasumisele|summa)\b", re.IGNORECASE
+)
+# Totals that include VAT; when present they decide between differing totals.
+GROSS_TOTAL_LABELS = re.compile(
+    r"\b(amount due|balance due|total due|to pay|grand total|incl\.?(?:uding)? vat|tasuda|tasumisele|"
+    r"kokku tasuda|koos km|km-ga)\b",
+    re.IGNORECASE,
+)
+NET_TOTAL_LABELS = re.compile(
+    r"(sub-?total|\bexcl|without vat|\bnet\b|before tax|ilma km|km-ta|käibemaksuta|vahesumma|"
+    r"(?:vat|tax|km|käibemaks) total|total (?:vat|tax)|käibemaks kokku|km kokku)",
+    re.IGNORECASE,
+)
+
+VAT_RATE_LABELS = re.compile(r"\b(vat|km|käibemaks|tax|mva|moms|mwst|tva|iva)\b", re.IGNORECASE)
+PERCENT_PATTERN = re.compile(r"(?<![\d.,])(\d{1,2}(?:[.,]\d{1,2})?)\s?%")
+DISCOUNT_LABELS = re.compile(r"\b(discount|allahindlus|soodustus|rebate)\b", re.IGNORECASE)
+
+CURRENCY_CODES = ("EUR", "USD", "GBP", "SEK", "NOK", "DKK", "PLN", "CHF", "CZK", "HUF", "CAD", "AUD", "JPY")
+CURRENCY_CODE_PATTERN = re.compile(r"\b(" + "|".join(CURRENCY_CODES) + r")\b")
+CURRENCY_SYMBOLS = {"€": "EUR", "£": "GBP"}
+
+MONTHS = {
+    "jan": 1, "january": 1, "jaanuar": 1,
+    "feb": 2, "february": 2, "veebruar": 2,
+    "mar": 3, "march": 3, "märts": 3,
+    "apr": 4, "april": 4, "aprill": 4,
+    "may": 5, "mai": 5,
+    "jun": 6, "june": 6, "juuni": 6,
+    "jul": 7, "july": 7, "juuli": 7,
+    "aug": 8, "august": 8,
+    "sep": 9, "sept": 9, "september": 9,
+    "oct": 10, "october": 10, "okt": 10, "oktoober": 10,
+    "nov": 11, "november": 11,
+    "dec": 12, "december": 12, "dets": 12, "detsember": 12,
+}
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+ISO_DATE_PATTERN = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+NUMERIC_DATE_PATTERN = re.compile(r"\b(\d{1,2})([./-])(\d{1,2})\2(\d{4})\b")
+DAY_MONTH_DATE_PATTERN = re.compile(rf"\b(\d{{1,2}})\.?\s+({_MONTH_NAMES})\.?,?\s+(\d{{4}})\b", re.IGNORECASE)
+MONTH_DAY_DATE_PATTERN = re.compile(
+    rf"\b({_MONTH_NAMES})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})\b", re.IGNORECASE
+)
+
+
+def is_valid_vat_id(value: str) -> bool:
+    compact = re.sub(r"[\s.\-]", "", value or "").upper()
+    validator = VAT_ID_VALIDATORS.get(compact[:2])
+    return bool(validator and validator.fullmatch(compact))
+
+
+def parse_amount(text: str) -> Optional[str]:
+    """Normalize "1 234,56" / "1,234.56" / "1.234,56" to "1234.56"."""
+    compact = re.sub(r"[\s ']", "", text or "")
+    match = re.fullmatch(r"-?\d+(?:[.,]\d{3})*(?:[.,]\d{1,2})?", compact)
+    if not match:
+        return None
+    decimal_sep = None
+    if len(compact) > 3 and compact[-3] in ".,":
+        decimal_sep = compact[-3]
+    elif len(compact) > 2 and compact[-2] in ".,":
+        decimal_sep = compact[-2]
+    if decimal_sep:
+        whole, fraction = compact[:compact.rfind(decimal_sep)], compact[compact.rfind(decimal_sep) + 1:]
+    else:
+        whole, fraction = compact, ""
+    whole = whole.replace(".", "").replace(",", "")
+    return f"{whole}.{fraction.ljust(2, '0')}" if fraction else f"{whole}.00"
+
+
+def _make_date(year: int, month: int, day: int) -> Optional[str]:
+    try:
+        return date(year, month, day).strftime("%d.%m.%Y")
+    except ValueError:
+        return None
+
+
+def _is_ambiguous(first: str, separator: str, second: str) -> bool:
+    """A slash or dash date that reads as both dd/mm and mm/dd (03/04/2024)."""
+    return separator != "." and int(first) <= 12 and int(second) <= 12 and first != second
+
+
+def _has_ambiguous_date(text: str) -> bool:
+    return any(
+        _is_ambiguous(first, separator, second)
+        for first, separator, second, _ in NUMERIC_DATE_PATTERN.findall(text)
+    )
+
+
+def parse_dates(text: str) -> List[str]:
+    """Unambiguous dates in text as dd.mm.yyyy; slash dates that could be either order are skipped."""
+    found = []
+    for year, month, day in ISO_DATE_PATTERN.findall(text):
+        found.append(_make_date(int(year), int(month), int(day)))
+    for first, separator, second, year in NUMERIC_DATE_PATTERN.findall(text):
+        if _is_ambiguous(first, separator, second):
+            continue
+        first, second = int(first), int(second)
+        if separator == "." or first > 12:
+            found.append(_make_date(int(year), second, first))
+        elif second > 12:
+            found.append(_make_date(int(year), first, second))
+    for day, month, year in DAY_MONTH_DATE_PATTERN.findall(text):
+        found.append(_make_date(int(year), MONTHS[month.lower()], int(day)))
+    for month, day, year in MONTH_DAY_DATE_PATTERN.findall(text):
+        found.append(_make_date(int(year), MONTHS[month.lower()], int(day)))
+    return [value for value in found if value]
+
+
+def _single(values: Iterable[str]) -> Optional[str]:
+    distinct = set(values)
+    return distinct.pop() if len(distinct) == 1 else None
+
+
+def _vat_ids(lines: List[str]) -> Dict[str, str]:
+    ids_by_line = {}
+    for index, line in enumerate(lines):
+        ids = [country + body for country, body in VAT_ID_CANDIDATE_PATTERN.findall(line) if is_valid_vat_id(country + body)]
+        if ids:
+            ids_by_line[index] = ids
+    if not ids_by_line:
+        return {}
+
+    buyer_lines = party_lines(lines, BUYER_LABELS, SUPPLIER_LABELS)
+    supplier_lines = party_lines(lines, SUPPLIER_LABELS, BUYER_LABELS)
+    buyer_ids = {vat_id for index in buyer_lines - supplier_lines for vat_id in ids_by_line.get(index, ())}
+    supplier_ids = {vat_id for index in supplier_lines - buyer_lines for vat_id in ids_by_line.get(index, ())}
+
+    result = {}
+    # Only an ID in a block labelled as the supplier's: an unlabelled one may well be the buyer's
+    # (a non-EU supplier shows only the customer's VAT ID), so that is left to the LLM.
+    supplier_id = _single(supplier_ids - buyer_ids)
+    if supplier_id:
+        result["supplier_vat_id"] = supplier_id
+    buyer_id = _single(buyer_ids - supplier_ids)
+    if buyer_id and buyer_id != supplier_id:
+        result["buyer_vat_id"] = buyer_id
+    return result
+
+
+def _invoice_number(text: str) -> Optional[str]:
+    numbers = []
+    for match in INVOICE_NUMBER_PATTERN.finditer(text):
+        value = match.group(1).rstrip("._-/")
+        if parse_dates(value):
+            continue
+        numbers.append(value)
+    return _single(numbers)
+
+
+def _invoice_date(lines: List[str]) -> Optional[str]:
+    """
+    The issue date, when the invoice states it unambiguously; otherwise None, leaving it to the LLM.
+
+    A pre-extracted field is never asked of the LLM, so ambiguous dates
+    (03/04/2024) and next-line values that belong to another date label
+    (due, delivery, ...) are not guessed at.
+    """
+    labelled = []
+    for index, line in enumerate(lines):
+        label = INVOICE_DATE_LABELS.search(line)
+        if not label or OTHER_DATE_LABELS.search(line):
+            continue
+        candidate = line[label.end():]
+        if not parse_dates(candidate) and not _has_ambiguous_date(candidate):
+            # The value may be on the line below the label, unless that line is labelled itself.
+            following = lines[index + 1] if index + 1 < len(lines) else ""
+            if OTHER_DATE_LABELS.search(following) or INVOICE_DATE_LABELS.search(following):
+                continue
+            candidate = following
+        if _has_ambiguous_date(candidate):
+            return None
+        labelled.extend(parse_dates(candidate)[:1])
+    if labelled:
+        return _single(labelled)
+    # Invoices showing a single date, and no other kind of date, are dated that day.
+    text = "\n".join(lines)
+    if OTHER_DATE_LABELS.search(text) or _has_ambiguous_date(text):
+        return None
+    return _single(parse_dates(text))
+
+
+def _total_amount(lines: List[str]) -> Optional[str]:
+    totals, gross = [], []
+    for index, line in enumerate(lines):
+        if not TOTAL_LABELS.search(line) or NET_TOTAL_LABELS.search(line):
+            continue
+        amounts = AMOUNT_PATTERN.findall(line)
+        if not amounts and index + 1 < len(lines):
+            amounts = AMOUNT_PATTERN.findall(lines[index + 1])[:1]
+        if not amounts:
+            continue
+        amount = parse_amount(amounts[-1])
+        if amount is None:
+            continue
+        totals.append(amount)
+        if GROSS_TOTAL_LABELS.search(line):
+            gross.append(amount)
+    return _single(gross) if gross else _single(totals)
+
+
+def _currency(text: str) -> Optional[str]:
+    currencies = set(CURRENCY_CODE_PATTERN.findall(text))
+    currencies.update(code for symbol, code in CURRENCY_SYMBOLS.items() if symbol in text)
+    return _single(currencies)
+
+
+def _vat_rates(lines: List[str]) -> Optional[str]:
+    rates = set()
+    for line in lines:
+        if not VAT_RATE_LABELS.search(line) or DISCOUNT_LABELS.search(line):
+            continue
+        for rate in PERCENT_PATTERN.findall(line):
+            value = float(rate.replace(",", "."))
+            rates.add(int(value) if value.is_integer() else value)
+    if not rates:
+        return None
+    return ", ".join(str(rate) for rate in sorted(rates))
+
+
+def pre_extract(invoice_text: str) -> Dict[str, dict]:
+    """
+    Resolve strictly formatted fields from OCR markdown without the LLM.
+
+    Covers VAT IDs (per-country format, assigned to supplier or buyer by the
+    party block they appear in), the invoice number and date, the total
+    including VAT, the currency and the VAT rates. A field is returned only
+    when exactly one candidate is left; anything ambiguous is left to the LLM.
+
+    Returns {field: {"value", "confidence"}} for the resolved fields.
+    """
+    text = invoice_text or ""
+    lines = text.splitlines()
+    values = dict(_vat_ids(lines))
+    candidates = {
+        "invoice_number": _invoice_number(text),
+        "invoice_date": _invoice_date(lines),
+        "invoice_total_amounts": _total_amount(lines),
+        "invoice_currency": _currency(text),
+        "vat_rates": _vat_rates(lines),
+    }
+    values.update({field: value for field, value in candidates.items() if value})
+    return {field: {"value": value, "confidence": PRE_EXTRACTED_CONFIDENCE} for field, value in values.items()}
+
+
+FORMAT_CHECKS = {
+    "supplier_vat_id": is_valid_vat_id,
+    "buyer_vat_id": is_valid_vat_id,
+    "invoice_total_amounts": lambda value: parse_amount(str(value)) is not None,
+    "invoice_date": lambda value: bool(parse_dates(str(value))),
+    "invoice_currency": lambda value: bool(re.fullmatch(r"[A-Z]{3}", str(value).strip())),
+}
+
+
+def check_field_formats(result: dict) -> List[str]:
+    """
+    Downgrade LLM fields whose non-empty value fails its format check to "low confidence".
+
+    Returns the names of the downgraded fields.
+    """
+    downgraded = []
+    for field, check in FORMAT_CHECKS.items():
+        raw = result.get(field)
+        if not isinstance(raw, dict):
+            continue
+        value = raw.get("value")
+        if value in (None, "") or check(value):
+            continue
+        result[field] = {**raw, "confidence": "low confidence"}
+        downgraded.append(field)
+    return downgraded
@@ -70,7 +70,7 @@ Example format:
 """
 
 
-system_prompt_parse_w_reasoning = """
+prompt_rules_output = """
 You're an assistant whose job is to look at text extracted from an invoice and answer questions about that invoice.
 Your response must ALWAYS be valid JSON with specific keys. 
 If some field is missing, just leave it empty.
@@ -80,7 +80,9 @@ For each field, return an object with "value" and "confidence".
 Confidence must be one of: "definitely wrong", "low confidence", "medium confidence", "strong confidence".
 If the field is missing or empty, set "value" to "" and "confidence" to "low confidence".
 Use "definitely wrong" only if the text explicitly contradicts the field value.
+"""
 
+prompt_rules_buyer = """
 When determining the buyer, use the section explicitly labeled as the billing, 
 invoice-to, or commercial address.
 This may appear under labels such as “Billing Address”, “Invoice To”, “Sold To”, or their language equivalents.
@@ -90,24 +92,36 @@ Individual placing the order and the company on behalf of which they're placing
 Pay attention to repeating addresses, you need to be able to match them.
 
 If invoice mentions both a company and an individual, the company is the buyer and the individual is only the account holder.
+"""
 
+prompt_rules_supplier = """
 When determining the supplier, always select the entity that appears in the main seller/vendor/supplier section of the invoice.
 If multiple related entities appear (such as a parent company and a local branch), choose the entity that is 
 associated with the VAT number used on the invoice or the one explicitly labelled as the seller. 
 Footer legal text or corporate registration details should only supplement the chosen supplier, not replace it.
+"""
 
+prompt_rules_country_group = """
 When determining the country group, consider the following split: EE, EU_OTHER, NON_EU.
+"""
 
+prompt_rules_supply_type = """
 When determining which type of services was provided, consider the following split: GOODS, SERVICES. "SERVICES" means everything that is not a supply of physical movable goods. If uncertain, choose SERVICES.
-For numeric fields like invoice_total_amounts, return only numbers (no currency symbols or commas). VAT rates must be numbers without percent signs.
+"""
 
+prompt_rules_numeric = """For numeric fields like invoice_total_amounts, return only numbers (no currency symbols or commas). VAT rates must be numbers without percent signs.
+"""
+
+prompt_rules_service_category = """
 Also further classify the supply type into the following categories: SERV_9, SERV_13, SERV_24, SERV_0, SERV_EX.
 - SERV_13: Accommodation or Accommodation with breakfast. Only assign CAT_13 if the invoice explicitly shows hotel/room/booking/accommodation terminology, do NOT guess.
 - SERV_9: books and educational literature, medicinal products, contraceptive preparations, sanitary and toiletry products, press publications. Assign CAT_9 only if the invoice clearly indicates one of these exact product categories, do NOT guess.
 - SERV_0: Domestic 0%-rate supplies, apply only if the invoice explicitly states a valid legal zero-rate basis (e.g. certain services directly connected to international transport). If there is no explicit text explaining the 0% rate, DO NOT assign this category.
 - SERV_EX: health-care services, social welfare services, general education services, universal postal service, insurance services, financial and securities / currency transactions and their mediation, lotteries and gambling, investment gold and some cost-sharing services. Assign only if the invoice explicitly refers to one of these categories, or uses terms such as “VAT exempt”, etc.
 - SERV_24: Default category, for all other services.
+"""
 
+prompt_example_format = """
 Example format:
 { 
   /// Invoice data
@@ -140,3 +154,69 @@ Example format:
   "buyer_email": {"value": "<value>", "confidence": "medium confidence"},
 }
 """
+
+# The extraction prompt is assembled from the sections above, so field-level prompts can reuse them.
+system_prompt_parse_w_reasoning = (
+    prompt_rules_output
+    + prompt_rules_buyer
+    + prompt_rules_supplier
+    + prompt_rules_country_group
+    + prompt_rules_supply_type
+    + prompt_rules_numeric
+    + prompt_rules_service_category
+    + prompt_example_format
+)
+
+# The same prompt without the "*_reasoning" explanations: they are output tokens, which dominate
+# generation latency, and the result drops them. Reasoning stays available as a debug mode.
+system_prompt_parse_lean = (
+    "\n".join(line for line in system_prompt_parse_w_reasoning.splitlines() if '_reasoning"' not in line) + "\n"
+)
+
+
+# Value fields requested by system_prompt_parse_w_reasoning, in prompt order.
+extraction_fields = [
+    "invoice_date",
+    "invoice_number",
+    "invoice_total_amounts",
+    "invoice_currency",
+    "description_keyword",
+    "vat_rates",
+    "supply_type",
+    "service_category",
+    "supplier_name",
+    "supplier_address",
+    "supplier_country",
+    "supplier_country_group",
+    "supplier_vat_id",
+    "supplier_email",
+    "buyer_name",
+    "buyer_address",
+    "buyer_country",
+    "buyer_country_group",
+    "buyer_vat_id",
+    "buyer_email",
+]
+
+# The confidence labels prompt_rules_output allows, weakest first.
+confidence_levels = ["definitely wrong", "low confidence", "medium confidence", "strong confidence"]
+
+# Rule sections each field depends on, for prompts that ask for only some fields.
+field_prompt_rules = {
+    "invoice_total_amounts": [prompt_rules_numeric],
+    "vat_rates": [prompt_rules_numeric],
+    "supply_type": [prompt_rules_supply_type],
+    "service_category": [prompt_rules_supply_type, prompt_rules_service_category],
+    "supplier_name": [prompt_rules_supplier],
+    "supplier_address": [prompt_rules_supplier],
+    "supplier_country": [prompt_rules_supplier],
+    "supplier_country_group": [prompt_rules_supplier, prompt_rules_country_group],
+    "supplier_vat_id": [prompt_rules_supplier],
+    "supplier_email": [prompt_rules_supplier],
+    "buyer_name": [prompt_rules_buyer],
+    "buyer_address": [prompt_rules_buyer],
+    "buyer_country": [prompt_rules_buyer],
+    "buyer_country_group": [prompt_rules_buyer, prompt_rules_country_group],
+    "buyer_vat_id": [prompt_rules_buyer],
+    "buyer_email": [prompt_rules_buyer],
+}
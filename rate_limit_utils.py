@@ -0,0 +1,118 @@
+import os
+import random
+import sqlite3
+import time
+from typing import Callable, Optional
+
+
+class RateLimitTimeout(RuntimeError):
+    pass
+
+
+# Sleep in short slices while waiting for a token, so should_abort is checked promptly.
+WAIT_SLICE_SECONDS = 0.5
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every process on the host, kept in a small SQLite file.
+
+    `rate` tokens are added per second up to `capacity`; each call takes one.
+    penalize() empties the bucket for a while after the upstream API throttled us.
+    """
+
+    def __init__(self, path: str, name: str, rate: float, capacity: float):
+        self.path = path
+        self.name = name
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "name TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                "updated_at REAL NOT NULL, blocked_until REAL NOT NULL DEFAULT 0)"
+            )
+            self._initialized = True
+        return conn
+
+    def _update(self, take: bool, block_for: float = 0.0) -> float:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at, blocked_until FROM token_buckets WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+            tokens, updated_at, blocked_until = row if row else (self.capacity, now, 0.0)
+            tokens = min(self.capacity, tokens + max(now - updated_at, 0.0) * self.rate)
+
+            if block_for > 0:
+                tokens = 0.0
+                blocked_until = max(blocked_until, now + block_for)
+
+            wait = 0.0
+            if take:
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif tokens >= 1.0:
+                    tokens -= 1.0
+                else:
+                    wait = (1.0 - tokens) / self.rate
+
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at, blocked_until) "
+                "VALUES (?, ?, ?, ?)",
+                (self.name, tokens, now, blocked_until),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available; otherwise return the seconds to wait."""
+        return self._update(take=True)
+
+    def penalize(self, seconds: float) -> None:
+        self._update(take=False, block_for=seconds)
+
+    def acquire(self, deadline: float, should_abort: Optional[Callable[[], None]] = None) -> float:
+        """
+        Wait for a token until deadline (time.monotonic()).
+
+        should_abort is called while waiting and may raise to give up early.
+        Returns the seconds spent waiting.
+
+        Raises:
+            RateLimitTimeout: If no token is available before the deadline
+        """
+        started = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return time.monotonic() - started
+            # Jitter so waiting processes do not all retry at the same instant.
+            wait += random.uniform(0, 1.0 / self.rate)
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"No {self.name} token available before the deadline.")
+            end = time.monotonic() + wait
+            while time.monotonic() < end:
+                if should_abort is not None:
+                    should_abort()
+                time.sleep(min(WAIT_SLICE_SECONDS, max(end - time.monotonic(), 0)))
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for retry number `attempt` (1-based)."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
@@ -0,0 +1,120 @@
+from typing import Dict, Iterable, List, Optional
+
+import metrics_utils
+from prompts import extraction_fields
+
+
+# Fields the small model reports with these confidences are re-asked from the large model.
+ESCALATE_CONFIDENCES = {"low confidence", "definitely wrong"}
+
+# Words that locate a field in the invoice text; fields without hints need the whole document.
+FIELD_HINTS = {
+    "invoice_date": ("date", "dated", "issued", "kuupäev"),
+    "invoice_number": ("invoice", "arve", "no", "nr", "number"),
+    "invoice_total_amounts": ("total", "kokku", "summa", "amount", "due", "tasuda"),
+    "invoice_currency": ("total", "kokku", "currency", "eur", "usd", "gbp", "€", "$", "£"),
+    "vat_rates": ("vat", "km", "käibemaks", "tax"),
+    "supplier_name": ("seller", "supplier", "müüja", "tarnija", "from"),
+    "supplier_address": ("seller", "supplier", "müüja", "tarnija", "address", "aadress"),
+    "supplier_country": ("seller", "supplier", "müüja", "address", "aadress"),
+    "supplier_vat_id": ("vat", "kmkr", "reg", "registry"),
+    "supplier_email": ("email", "e-mail", "e-post"),
+    "buyer_name": ("bill to", "invoice to", "sold to", "buyer", "customer", "client", "ostja", "maksja"),
+    "buyer_address": ("bill to", "invoice to", "sold to", "buyer", "customer", "ostja", "maksja"),
+    "buyer_country": ("bill to", "invoice to", "sold to", "buyer", "customer", "ostja", "maksja"),
+    "buyer_vat_id": ("vat", "kmkr", "reg", "buyer", "customer"),
+    "buyer_email": ("email", "e-mail", "e-post"),
+}
+
+ROUTE_SMALL = "small"
+ROUTE_ESCALATED = "escalated"
+ROUTE_LARGE = "large"
+ROUTES = (ROUTE_SMALL, ROUTE_ESCALATED, ROUTE_LARGE)
+
+
+def fields_to_escalate(result: dict, fields: Iterable[str] = extraction_fields) -> List[str]:
+    """Fields missing from the small model's result or reported with an escalating confidence."""
+    escalate = []
+    for field in fields:
+        raw = result.get(field)
+        if not isinstance(raw, dict):
+            escalate.append(field)
+        elif str(raw.get("confidence") or "").strip().lower() in ESCALATE_CONFIDENCES:
+            escalate.append(field)
+    return escalate
+
+
+def escalation_terms(fields: Iterable[str], result: dict) -> Optional[List[str]]:
+    """
+    Terms locating the escalated fields in the invoice text.
+
+    Includes the small model's (doubtful) values, since they usually point at
+    the right region. Returns None when a field needs the whole document.
+    """
+    terms = []
+    for field in fields:
+        hints = FIELD_HINTS.get(field)
+        if not hints:
+            return None
+        terms.extend(hints)
+        raw = result.get(field)
+        value = raw.get("value") if isinstance(raw, dict) else None
+        if isinstance(value, str):
+            terms.extend(word for word in value.split() if len(word) >= 3)
+    return terms
+
+
+def record_model_call(model: str, seconds: float) -> None:
+    metrics_utils.observe("llm_model_seconds", seconds, model=model)
+
+
+def record_route(route: str, seconds: float, fields_total: int = 0, fields_escalated: int = 0) -> None:
+    """Count one routed extraction with its end-to-end LLM latency."""
+    metrics_utils.observe("llm_route_seconds", seconds, route=route)
+    if fields_total:
+        metrics_utils.inc("llm_cascade_fields_total", fields_total)
+        metrics_utils.inc("llm_cascade_fields_escalated_total", fields_escalated)
+
+
+def _latency_stats(metric: str, by: str, keys: Iterable[str]) -> Dict[str, Dict]:
+    counts = metrics_utils.totals(f"{metric}_count", by)
+    sums = metrics_utils.totals(f"{metric}_sum", by)
+    stats = {}
+    for key in keys:
+        count = int(counts.get(key, 0))
+        stats[key] = {"count": count, "avg_ms": round(sums.get(key, 0) * 1000 / count) if count else None}
+    return stats
+
+
+def get_routing_stats(models: Iterable[str]) -> Dict:
+    """
+    Per-route and per-model call counts and mean latency, plus escalation rates.
+
+    Read from the metrics every process records (see metrics_utils).
+    escalation_rate is the share of cascaded extractions that needed the
+    large model; field_escalation_rate the share of fields it was asked for.
+    """
+    routes = _latency_stats("llm_route_seconds", "route", ROUTES)
+    model_stats = {
+        model: {"calls": values["count"], "avg_ms": values["avg_ms"]}
+        for model, values in _latency_stats("llm_model_seconds", "model", models).items()
+    }
+
+    cascaded = routes[ROUTE_SMALL]["count"] + routes[ROUTE_ESCALATED]["count"]
+    fields_total = metrics_utils.totals("llm_cascade_fields_total", "").get("", 0)
+    fields_escalated = metrics_utils.totals("llm_cascade_fields_escalated_total", "").get("", 0)
+    return {
+        "routes": routes,
+        "models": model_stats,
+        "escalation_rate": routes[ROUTE_ESCALATED]["count"] / cascaded if cascaded else None,
+        "field_escalation_rate": fields_escalated / fields_total if fields_total else None,
+    }
+
+
+def reset_routing_stats() -> None:
+    metrics_utils.reset(
+        "llm_route_seconds",
+        "llm_model_seconds",
+        "llm_cascade_fields_total",
+        "llm_cascade_fields_escalated_total",
+    )
@@ -1673,6 +1673,94 @@
         await renderPDFBuffer(buffer);
     }
 
+    async function waitForExtractionJob(statusUrl, signal) {
+        let delay = 500;
+        while (true) {
+            await new Promise((resolve, reject) => {
+                const timer = setTimeout(resolve, delay);
+                signal.addEventListener('abort', () => {
+                    clearTimeout(timer);
+                    reject(new DOMException('Aborted', 'AbortError'));
+                }, { once: true });
+            });
+            const response = await fetch(statusUrl, { signal });
+            const job = await response.json();
+            if (!response.ok) {
+                return job;
+            }
+            if (job.status !== 'queued' && job.status !== 'running') {
+                return job;
+            }
+            delay = Math.min(delay * 1.5, 2000);
+        }
+    }
+
+    const EXTRACTION_STAGE_LABELS = {
+        uploaded: 'Uploaded, waiting for a worker',
+        ocr_done: 'Document read',
+        llm_queued: 'Waiting for the AI model',
+        llm_running: 'Extracting fields',
+    };
+
+    function formatExtractionStage(data) {
+        if (data.stage === 'ocr_done' && data.pages) {
+            return `Read ${data.pages} page${data.pages === 1 ? '' : 's'}`;
+        }
+        return EXTRACTION_STAGE_LABELS[data.stage] || 'Extracting invoice data';
+    }
+
+    function appendPartialField(list, key, field) {
+        if (!list || !field) return;
+        const value = field.value;
+        const row = document.createElement('div');
+        row.className = 'flex justify-between gap-3 text-xs';
+        const label = document.createElement('span');
+        label.className = 'text-slate-400';
+        label.textContent = key.replace(/_/g, ' ');
+        const text = document.createElement('span');
+        text.className = 'text-slate-700 truncate';
+        text.textContent = typeof value === 'string' ? value : JSON.stringify(value);
+        row.appendChild(label);
+        row.appendChild(text);
+        list.appendChild(row);
+    }
+
+    function followExtractionEvents(eventsUrl, signal) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(eventsUrl);
+            const stageLabel = jsonContent.querySelector('[data-extraction-stage]');
+            const fieldList = jsonContent.querySelector('[data-extraction-fields]');
+            const finish = (callback, value) => {
+                source.close();
+                callback(value);
+            };
+            signal.addEventListener('abort', () => {
+                finish(reject, new DOMException('Aborted', 'AbortError'));
+            }, { once: true });
+            source.addEventListener('stage', (event) => {
+                if (stageLabel) stageLabel.textContent = formatExtractionStage(JSON.parse(event.data));
+            });
+            source.addEventListener('field', (event) => {
+                const data = JSON.parse(event.data);
+                appendPartialField(fieldList, data.key, data.field);
+            });
+            source.addEventListener('done', (event) => finish(resolve, JSON.parse(event.data)));
+            source.addEventListener('timeout', () => finish(reject, new Error('Event stream timed out')));
+            source.onerror = () => finish(reject, new Error('Event stream failed'));
+        });
+    }
+
+    async function waitForExtractionResult(job, signal) {
+        if (window.EventSource && job.events_url) {
+            try {
+                return await followExtractionEvents(job.events_url, signal);
+            } catch (error) {
+                if (error && error.name === 'AbortError') throw error;
+            }
+        }
+        return waitForExtractionJob(job.status_url, signal);
+    }
+
     async function uploadFile(file) {
         if (extractionController) {
             extractionController.abort();
@@ -1686,22 +1774,29 @@
         formData.append('request_id', extractionRequestId);
         jsonContent.innerHTML = `
             <div class="p-8 text-center text-slate-500">
-                <div class="text-sm font-medium mb-4">Extracting invoice data</div>
+                <div class="text-sm font-medium mb-4" data-extraction-stage>Extracting invoice data</div>
                 <div class="progress-track h-2 rounded-full overflow-hidden">
                     <div class="progress-bar h-full rounded-full"></div>
                 </div>
+                <div class="mt-4 space-y-1 text-left" data-extraction-fields></div>
             </div>
         `;
 
         try {
+            const signal = extractionController.signal;
             const response = await fetch('/process', {
                 method: 'POST',
                 body: formData,
-                signal: extractionController.signal,
+                signal,
             });
-            const result = await response.json();
-            if (!response.ok) {
-                if (result && result.code === 'OCR_EMPTY') {
+            let result = await response.json();
+            if (response.ok && result && result.status_url && (result.status === 'queued' || result.status === 'running')) {
+                result = await waitForExtractionResult(result, signal);
+            }
+            if (!response.ok || (result && result.status && result.status !== 'succeeded')) {
+                if (result && result.code === 'CANCELLED') {
+                    jsonContent.innerHTML = '<div class="p-6 text-center text-slate-500">Extraction cancelled.</div>';
+                } else if (result && result.code === 'OCR_EMPTY') {
                     openOcrEmptyModal();
                     jsonContent.innerHTML = '<div class="p-6 text-center text-amber-600">No text detected in this PDF.</div>';
                 } else if (result && result.code === 'RATE_LIMITED') {
@@ -1716,7 +1811,7 @@
                 jsonContent.innerHTML = `<div class="text-red-500 p-4">${result.error}</div>`;
                 return;
             }
-            displayJSON(result);
+            displayJSON(result && result.status ? result.result : result);
         } catch (error) {
             if (error && error.name === 'AbortError') {
                 jsonContent.innerHTML = '<div class="p-6 text-center text-slate-500">Extraction cancelled.</div>';
@@ -0,0 +1,522 @@
+import random
+import re
+from datetime import date, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, List, Optional, Tuple
+
+import fitz
+
+from accounting_utils import (
+    CountryCode,
+    DomesticScenario,
+    EUScenario,
+    NonEUScenario,
+    Scenario,
+    ServiceType,
+    SupplyType,
+    determine_vat_scenarios,
+)
+from prompts import extraction_fields
+
+
+LANGUAGES = ("en", "et")
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size("a4")
+MARGIN = 50
+ROW_HEIGHT = 15
+FONT_SIZE = 9
+# Room kept at the bottom of the last table page for the totals and the VAT note.
+TOTALS_HEIGHT = 120
+SCANNED_DPI = 150
+
+# (supplier group, buyer group, supply type, service category, VAT note)
+# The VAT rate printed follows from the scenario (see _vat_rate()). EU_GOODS_ICS_9_FULL and
+# NON_EU_IMPORT_KMD_9 are left out: determine_vat_scenarios() ignores the category of goods.
+SCENARIOS = {
+    DomesticScenario.EE_DOM_24_STD: (CountryCode.EE, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_24, None),
+    DomesticScenario.EE_DOM_13_ACC: (CountryCode.EE, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_13, None),
+    DomesticScenario.EE_DOM_9_REDUCED: (CountryCode.EE, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_9, None),
+    DomesticScenario.EE_DOM_0_TAXABLE: (CountryCode.EE, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_0, "zero"),
+    DomesticScenario.EE_DOM_EXEMPT: (CountryCode.EE, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_EX, "exempt"),
+    EUScenario.EU_GOODS_ICS_24_FULL: (CountryCode.EU_OTHER, CountryCode.EE, SupplyType.GOODS, ServiceType.SERV_24, "ics"),
+    EUScenario.EU_SERV_RC_24: (CountryCode.EU_OTHER, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_24, "reverse"),
+    EUScenario.EU_SERV_RC_9_FULL: (CountryCode.EU_OTHER, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_9, "reverse"),
+    EUScenario.EU_FOREIGN_VAT_COST_ONLY: (CountryCode.EU_OTHER, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_24, None),
+    NonEUScenario.NON_EU_SERV_RC_24_FULL: (CountryCode.NON_EU, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_24, "outside"),
+    NonEUScenario.NON_EU_SERV_RC_9_FULL: (CountryCode.NON_EU, CountryCode.EE, SupplyType.SERVICES, ServiceType.SERV_9, "outside"),
+    NonEUScenario.NON_EU_IMPORT_KMD_24: (CountryCode.NON_EU, CountryCode.EE, SupplyType.GOODS, ServiceType.SERV_24, "outside"),
+    Scenario.OUT_OF_SCOPE: (CountryCode.EE, CountryCode.EU_OTHER, SupplyType.SERVICES, ServiceType.SERV_24, "reverse"),
+}
+
+# Country name (en, et), ISO code, VAT ID digits (None: no VAT ID), standard VAT rate, currency,
+# legal suffixes, cities.
+COUNTRIES = {
+    CountryCode.EE: [
+        ("Estonia", "Eesti", "EE", 9, 24, "EUR", ("OÜ", "AS"), ("Tallinn", "Tartu", "Pärnu", "Narva")),
+    ],
+    CountryCode.EU_OTHER: [
+        ("Germany", "Saksamaa", "DE", 9, 19, "EUR", ("GmbH", "AG"), ("Berlin", "Hamburg", "Munich")),
+        ("Finland", "Soome", "FI", 8, 25.5, "EUR", ("Oy", "Oyj"), ("Helsinki", "Espoo", "Turku")),
+        ("Latvia", "Läti", "LV", 11, 21, "EUR", ("SIA",), ("Riga", "Jelgava")),
+        ("Poland", "Poola", "PL", 10, 23, "EUR", ("Sp. z o.o.",), ("Warsaw", "Gdansk", "Krakow")),
+        ("Netherlands", "Holland", "NL", 9, 21, "EUR", ("B.V.",), ("Amsterdam", "Rotterdam")),
+    ],
+    CountryCode.NON_EU: [
+        ("United States", "Ameerika Ühendriigid", "US", None, 0, "USD", ("Inc.", "LLC"), ("San Francisco", "New York", "Austin")),
+        ("United Kingdom", "Suurbritannia", "GB", 9, 0, "GBP", ("Ltd",), ("London", "Manchester")),
+        ("Norway", "Norra", "NO", None, 0, "NOK", ("AS",), ("Oslo", "Bergen")),
+    ],
+}
+
+STREETS = ("Harbour", "Pine", "Market", "Station", "Mill", "Lake", "Kesk", "Pikk", "Narva mnt", "Tartu mnt")
+NAME_WORDS = ("Nordic", "Baltic", "Amber", "Harbor", "Northwind", "Pinewood", "Granite", "Bluefin", "Silverline", "Oak")
+NAME_NOUNS = ("Systems", "Logistics", "Trading", "Solutions", "Media", "Works", "Labs", "Partners", "Supply", "Group")
+
+# Per service category: (description keyword, [(item en, item et, unit price range)])
+ITEMS = {
+    (SupplyType.SERVICES, ServiceType.SERV_24): [
+        ("hosting", [("Cloud hosting, monthly", "Pilveteenus, kuutasu", (20, 400)), ("Managed backup", "Varundusteenus", (10, 90))]),
+        ("software", [("Software license, annual", "Tarkvara litsents, aastane", (50, 900)), ("User seats", "Kasutajakohad", (5, 40))]),
+        ("consulting", [("Consulting hours", "Konsultatsioonitunnid", (60, 150)), ("Project management", "Projektijuhtimine", (70, 130))]),
+        ("marketing", [("Online advertising campaign", "Veebireklaami kampaania", (100, 2000)), ("Copywriting", "Tekstide kirjutamine", (40, 90))]),
+        ("legal", [("Legal services", "Õigusabiteenus", (90, 250)), ("Contract review", "Lepingu läbivaatus", (100, 400))]),
+    ],
+    (SupplyType.GOODS, ServiceType.SERV_24): [
+        ("office supplies", [("Printer paper A4, box", "Paber A4, kast", (15, 40)), ("Office chair", "Kontoritool", (90, 350))]),
+        ("electronics", [("Laptop 14 inch", "Sülearvuti 14 tolli", (700, 1800)), ("Monitor 27 inch", "Monitor 27 tolli", (180, 450))]),
+    ],
+    (SupplyType.SERVICES, ServiceType.SERV_13): [
+        ("accommodation", [("Hotel room, double, per night", "Hotellituba, kahene, öö", (60, 180)), ("Accommodation with breakfast", "Majutus hommikusöögiga", (70, 200))]),
+    ],
+    (SupplyType.SERVICES, ServiceType.SERV_9): [
+        ("press", [("Newspaper subscription, digital", "Ajalehe digitellimus", (8, 30)), ("Magazine subscription", "Ajakirja tellimus", (5, 25))]),
+        ("books", [("E-book access, educational literature", "E-õpikute ligipääs", (10, 40))]),
+    ],
+    (SupplyType.SERVICES, ServiceType.SERV_0): [
+        ("transport", [("International freight forwarding", "Rahvusvaheline ekspedeerimine", (150, 1500)), ("Transit cargo handling", "Transiitkauba käitlemine", (80, 600))]),
+    ],
+    (SupplyType.SERVICES, ServiceType.SERV_EX): [
+        ("insurance", [("Insurance premium", "Kindlustusmakse", (40, 900))]),
+        ("medical", [("Occupational health examination", "Töötervishoiu kontroll", (40, 120))]),
+    ],
+}
+
+LABELS = {
+    "en": {
+        "title": "INVOICE",
+        "number": "Invoice No",
+        "date": "Invoice date",
+        "due": "Due date",
+        "seller": "Seller",
+        "buyer": "Bill to",
+        "vat_id": "VAT ID",
+        "reg": "Reg. code",
+        "email": "E-mail",
+        "description": "Description",
+        "qty": "Qty",
+        "price": "Unit price",
+        "vat": "VAT %",
+        "amount": "Amount",
+        "subtotal": "Subtotal",
+        "vat_total": "VAT {rate}%",
+        "total": "Total",
+        "page": "Page {page} of {pages}",
+        "bank": "Bank account",
+        "terms": "Terms and conditions",
+        "zero": "VAT 0%: services directly connected to international transport of goods (VAT Act § 15 (4)).",
+        "exempt": "VAT exempt supply (VAT Act § 16).",
+        "ics": "Intra-Community supply of goods, VAT 0% (Article 138, Directive 2006/112/EC).",
+        "reverse": "Reverse charge: VAT to be accounted for by the recipient (Article 196, Directive 2006/112/EC).",
+        "outside": "No VAT charged.",
+    },
+    "et": {
+        "title": "ARVE",
+        "number": "Arve nr",
+        "date": "Arve kuupäev",
+        "due": "Maksetähtaeg",
+        "seller": "Müüja",
+        "buyer": "Arve saaja",
+        "vat_id": "KMKR nr",
+        "reg": "Registrikood",
+        "email": "E-post",
+        "description": "Kirjeldus",
+        "qty": "Kogus",
+        "price": "Ühiku hind",
+        "vat": "KM %",
+        "amount": "Summa",
+        "subtotal": "Vahesumma",
+        "vat_total": "Käibemaks {rate}%",
+        "total": "Kokku tasuda",
+        "page": "Lk {page}/{pages}",
+        "bank": "Arveldusarve",
+        "terms": "Müügitingimused",
+        "zero": "Käibemaks 0%: rahvusvahelise kaubaveoga otseselt seotud teenused (KMS § 15 lg 4).",
+        "exempt": "Käibemaksuvaba käive (KMS § 16).",
+        "ics": "Ühendusesisene kaubatarne, käibemaks 0% (direktiivi 2006/112/EÜ art 138).",
+        "reverse": "Pöördmaksustamine: käibemaksu tasub ostja (direktiivi 2006/112/EÜ art 196).",
+        "outside": "Käibemaksu ei lisandu.",
+    },
+}
+
+TERMS = {
+    "en": (
+        "Payment is due within the term stated on the invoice. Late payments accrue interest of 0.05% per day. "
+        "Goods remain the property of the seller until paid in full. Claims regarding the invoice must be "
+        "submitted in writing within 7 days of receipt. The parties will settle disputes by negotiation, "
+        "failing which in the court of the seller's registered seat. These terms apply to all supplies "
+        "unless agreed otherwise in writing."
+    ),
+    "et": (
+        "Arve tuleb tasuda arvel märgitud tähtajaks. Viivis on 0,05% päevas. Kaup jääb müüja omandisse kuni "
+        "täieliku tasumiseni. Pretensioonid arve kohta esitatakse kirjalikult 7 päeva jooksul arve saamisest. "
+        "Vaidlused lahendatakse läbirääkimiste teel, kokkuleppe puudumisel müüja asukoha kohtus. Tingimused "
+        "kehtivad kõikidele tarnetele, kui kirjalikult ei ole kokku lepitud teisiti."
+    ),
+}
+
+_CENT = Decimal("0.01")
+
+
+def _money(value: Decimal, language: str) -> str:
+    """1234.5 as "1,234.50" (en) or "1 234,50" (et)."""
+    text = f"{value.quantize(_CENT, rounding=ROUND_HALF_UP):,.2f}"
+    if language == "et":
+        text = text.replace(",", " ").replace(".", ",")
+    return text
+
+
+def _rate_text(rate) -> str:
+    return str(int(rate)) if float(rate).is_integer() else str(rate)
+
+
+def _vat_rate(scenario: str, standard_rate, note: Optional[str]):
+    """The VAT rate the invoice prints, or None when it charges no VAT at all."""
+    if note in ("exempt", "outside"):
+        return None
+    if note in ("zero", "ics", "reverse"):
+        return 0
+    if scenario == EUScenario.EU_FOREIGN_VAT_COST_ONLY:
+        return standard_rate
+    return {
+        DomesticScenario.EE_DOM_13_ACC: 13,
+        DomesticScenario.EE_DOM_9_REDUCED: 9,
+    }.get(scenario, standard_rate)
+
+
+def _vat_id(rng: random.Random, country: tuple) -> str:
+    prefix, digits = country[2], country[3]
+    if digits is None:
+        return ""
+    if prefix == "NL":
+        return f"NL{rng.randrange(10**8, 10**9)}B01"
+    return f"{prefix}{rng.randrange(10 ** (digits - 1), 10 ** digits)}"
+
+
+def _party(rng: random.Random, group: str, language: str, buyer: bool) -> Dict:
+    country = rng.choice(COUNTRIES[group])
+    name_en, name_et, _, _, _, currency, suffixes, cities = country
+    name = f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_NOUNS)} {rng.choice(suffixes)}"
+    slug = re.sub(r"[^a-z]", "", name.split()[0].lower() + name.split()[1].lower())
+    city = rng.choice(cities)
+    postcode = f"{rng.randrange(10000, 99999)}"
+    address = f"{rng.choice(STREETS)} {rng.randrange(1, 120)}, {postcode} {city}, {name_et if language == 'et' else name_en}"
+    tld = {"Estonia": "ee", "Germany": "de", "Finland": "fi", "Latvia": "lv", "Poland": "pl", "Netherlands": "nl"}.get(
+        name_en, "com"
+    )
+    return {
+        "name": name,
+        "address": address,
+        "country": name_en,
+        "group": group,
+        "vat_id": _vat_id(rng, country),
+        "reg_code": f"{rng.randrange(10**7, 10**8)}",
+        "email": f"{'accounts' if buyer else 'billing'}@{slug}.{tld}",
+        "currency": currency,
+        "iso_code": country[2],
+        "standard_rate": country[4],
+    }
+
+
+def _invoice_number(rng: random.Random, issued: date) -> str:
+    return rng.choice(
+        (
+            f"INV-{issued.year}-{rng.randrange(1, 9999):04d}",
+            f"{rng.choice('ABCDEFGH')}{rng.randrange(1000, 99999)}",
+            f"{issued.year}/{rng.randrange(1, 999)}",
+            f"{rng.randrange(10000, 999999)}",
+        )
+    )
+
+
+def _date_text(value: date, language: str, rng: random.Random) -> str:
+    if language == "et":
+        return value.strftime("%d.%m.%Y")
+    return rng.choice((value.strftime("%d.%m.%Y"), value.isoformat(), value.strftime("%B %d, %Y")))
+
+
+class _Canvas:
+    """Collects text runs per page, so that page counts are known before running headers are drawn."""
+
+    def __init__(self):
+        self.pages: List[List[Tuple[float, float, str, str, float]]] = [[]]
+        self.y = MARGIN
+
+    def text(self, x: float, text: str, font: str = "helv", size: float = FONT_SIZE) -> None:
+        self.pages[-1].append((x, self.y, text, font, size))
+
+    def right(self, x_right: float, text: str, font: str = "helv", size: float = FONT_SIZE) -> None:
+        self.text(x_right - fitz.get_text_length(text, fontname=font, fontsize=size), text, font, size)
+
+    def new_page(self) -> None:
+        self.pages.append([])
+        self.y = MARGIN
+
+    def render(self) -> fitz.Document:
+        document = fitz.open()
+        for runs in self.pages:
+            page = document.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            for x, y, text, font, size in runs:
+                page.insert_text((x, y), text, fontname=font, fontsize=size)
+        return document
+
+
+def _wrap(text: str, width: float, size: float = FONT_SIZE) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        candidate = f"{line} {word}".strip()
+        if line and fitz.get_text_length(candidate, fontsize=size) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    return lines + ([line] if line else [])
+
+
+def _scanned(document: fitz.Document, dpi: int) -> fitz.Document:
+    """The document as image-only pages, as a scanner would produce it."""
+    scanned = fitz.open()
+    for page in document:
+        pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        scanned_page = scanned.new_page(width=page.rect.width, height=page.rect.height)
+        scanned_page.insert_image(scanned_page.rect, pixmap=pixmap)
+    return scanned
+
+
+def generate_invoice(
+    seed: int,
+    pages: int = 1,
+    rows: Optional[int] = None,
+    language: str = "en",
+    supplier_group: Optional[str] = None,
+    scenario: Optional[str] = None,
+    scanned: bool = False,
+    repeated_headers: bool = False,
+) -> Tuple[bytes, Dict]:
+    """
+    Render a synthetic invoice and its ground truth.
+
+    The same arguments always produce the same invoice. The ground truth
+    holds every extraction field in the format the extraction prompt asks
+    for, plus the "scenario" determine_vat_scenarios() gives for them.
+
+    Args:
+        seed: Random seed of the invoice
+        pages: Minimum page count; terms and conditions pad a shorter invoice
+        rows: Line items in the table (default: a few, or enough to fill `pages`)
+        language: "en" or "et"
+        supplier_group: CountryCode group of the supplier; picks a matching scenario
+        scenario: VAT scenario (see accounting_utils); random when not given
+        scanned: Render pages as grayscale images without a text layer
+        repeated_headers: Repeat the supplier, invoice number and table header on every page
+
+    Returns:
+        (PDF bytes, {"fields": {field: value, ..., "scenario": ...}, "generator": {...}})
+    """
+    if language not in LANGUAGES:
+        raise ValueError(f"Unknown language: {language}")
+    rng = random.Random(seed)
+    if scenario is None:
+        candidates = [name for name, profile in SCENARIOS.items() if supplier_group in (None, profile[0])]
+        if not candidates:
+            raise ValueError(f"Unknown supplier group: {supplier_group}")
+        scenario = rng.choice(sorted(candidates))
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario: {scenario}")
+    group, buyer_group, supply_type, category, note = SCENARIOS[scenario]
+    if supplier_group not in (None, group):
+        raise ValueError(f"Scenario {scenario} has a {group} supplier, not {supplier_group}.")
+
+    labels = LABELS[language]
+    supplier = _party(rng, group, language, buyer=False)
+    buyer = _party(rng, buyer_group, language, buyer=True)
+    currency = supplier["currency"] if group == CountryCode.NON_EU else "EUR"
+    rate = _vat_rate(scenario, supplier["standard_rate"], note)
+    keyword, catalogue = rng.choice(ITEMS[(supply_type, category)])
+    issued = date(2024, 1, 1) + timedelta(days=rng.randrange(0, 700))
+    number = _invoice_number(rng, issued)
+
+    rows_per_page = int((PAGE_HEIGHT - 2 * MARGIN - 200) // ROW_HEIGHT)
+    if rows is None:
+        rows = rng.randrange(1, 6) if pages <= 1 else rows_per_page * (pages - 1) + rng.randrange(1, rows_per_page // 2)
+    items = []
+    for _ in range(max(rows, 1)):
+        item_en, item_et, (low, high) = rng.choice(catalogue)
+        quantity = rng.choice((1, 1, 1, 2, 3, 5, 10))
+        price = Decimal(rng.uniform(low, high)).quantize(_CENT)
+        items.append((item_et if language == "et" else item_en, quantity, price, price * quantity))
+    subtotal = sum((amount for *_, amount in items), Decimal("0"))
+    vat_amount = (subtotal * Decimal(str(rate or 0)) / 100).quantize(_CENT, rounding=ROUND_HALF_UP)
+    total = subtotal + vat_amount
+
+    canvas = _Canvas()
+    # Description (left edge), then the right edges of quantity, unit price, VAT rate and amount
+    columns = (MARGIN, 345, 420, 460, PAGE_WIDTH - MARGIN)
+
+    def table_header():
+        canvas.text(columns[0], labels["description"], "hebo")
+        canvas.right(columns[1], labels["qty"], "hebo")
+        canvas.right(columns[2], labels["price"], "hebo")
+        canvas.right(columns[3], labels["vat"], "hebo")
+        canvas.right(columns[4], labels["amount"], "hebo")
+        canvas.y += ROW_HEIGHT
+
+    def running_header():
+        canvas.text(MARGIN, f"{supplier['name']}  |  {labels['number']} {number}", size=8)
+        canvas.y += 2 * ROW_HEIGHT
+
+    # Supplier block and invoice details
+    canvas.text(MARGIN, supplier["name"], "hebo", 14)
+    canvas.right(PAGE_WIDTH - MARGIN, labels["title"], "hebo", 16)
+    canvas.y += 20
+    details = [
+        f"{labels['number']}: {number}",
+        f"{labels['date']}: {_date_text(issued, language, rng)}",
+        f"{labels['due']}: {_date_text(issued + timedelta(days=rng.choice((7, 14, 30))), language, rng)}",
+    ]
+    party_lines = [supplier["address"]]
+    if supplier["vat_id"]:
+        party_lines.append(f"{labels['vat_id']}: {supplier['vat_id']}")
+    party_lines += [f"{labels['reg']}: {supplier['reg_code']}", f"{labels['email']}: {supplier['email']}"]
+    for index in range(max(len(party_lines), len(details))):
+        if index < len(party_lines):
+            canvas.text(MARGIN, party_lines[index])
+        if index < len(details):
+            canvas.right(PAGE_WIDTH - MARGIN, details[index])
+        canvas.y += ROW_HEIGHT
+    canvas.y += ROW_HEIGHT
+
+    # Buyer block
+    canvas.text(MARGIN, f"{labels['buyer']}:", "hebo")
+    canvas.y += ROW_HEIGHT
+    buyer_lines = [buyer["name"], buyer["address"]]
+    if buyer["vat_id"]:
+        buyer_lines.append(f"{labels['vat_id']}: {buyer['vat_id']}")
+    buyer_lines.append(f"{labels['email']}: {buyer['email']}")
+    for line in buyer_lines:
+        canvas.text(MARGIN, line)
+        canvas.y += ROW_HEIGHT
+    canvas.y += ROW_HEIGHT
+
+    # Line items, breaking pages as needed
+    table_header()
+    rate_cell = _rate_text(rate) if rate is not None else "-"
+    for index, (description, quantity, price, amount) in enumerate(items):
+        remaining = len(items) - index
+        if canvas.y > PAGE_HEIGHT - MARGIN - (TOTALS_HEIGHT if remaining == 1 else ROW_HEIGHT):
+            canvas.new_page()
+            if repeated_headers:
+                running_header()
+                table_header()
+        canvas.text(columns[0], description)
+        canvas.right(columns[1], str(quantity))
+        canvas.right(columns[2], _money(price, language))
+        canvas.right(columns[3], rate_cell)
+        canvas.right(columns[4], _money(amount, language))
+        canvas.y += ROW_HEIGHT
+
+    # Totals and VAT note
+    canvas.y += ROW_HEIGHT / 2
+    totals = [(labels["subtotal"], _money(subtotal, language))]
+    if rate is not None:
+        totals.append((labels["vat_total"].format(rate=_rate_text(rate)), _money(vat_amount, language)))
+    for label, value in totals:
+        canvas.right(columns[3], label)
+        canvas.right(columns[4], value)
+        canvas.y += ROW_HEIGHT
+    canvas.right(columns[3], f"{labels['total']} {currency}", "hebo")
+    canvas.right(columns[4], _money(total, language), "hebo")
+    canvas.y += 2 * ROW_HEIGHT
+    if note:
+        canvas.text(MARGIN, labels[note])
+        canvas.y += ROW_HEIGHT
+    canvas.text(
+        MARGIN,
+        f"{labels['bank']}: {supplier['iso_code']}{rng.randrange(10, 99)} 2200 {rng.randrange(1000, 9999)} "
+        f"{rng.randrange(1000, 9999)} {rng.randrange(1000, 9999)}",
+    )
+    canvas.y += 2 * ROW_HEIGHT
+
+    # Terms and conditions fill the pages up to the requested count
+    terms = _wrap(TERMS[language], PAGE_WIDTH - 2 * MARGIN)
+    while len(canvas.pages) < pages:
+        canvas.new_page()
+        if repeated_headers:
+            running_header()
+        canvas.text(MARGIN, labels["terms"], "hebo")
+        canvas.y += ROW_HEIGHT
+        clause = 0
+        while canvas.y < PAGE_HEIGHT - MARGIN - len(terms) * ROW_HEIGHT:
+            clause += 1
+            for index, line in enumerate(terms):
+                canvas.text(MARGIN, f"{clause}. {line}" if index == 0 else f"    {line}")
+                canvas.y += ROW_HEIGHT
+            canvas.y += ROW_HEIGHT / 2
+
+    if repeated_headers:
+        for page_number, runs in enumerate(canvas.pages, start=1):
+            text = labels["page"].format(page=page_number, pages=len(canvas.pages))
+            runs.append((PAGE_WIDTH - MARGIN - fitz.get_text_length(text, fontsize=8), PAGE_HEIGHT - 30, text, "helv", 8))
+
+    document = canvas.render()
+    if scanned:
+        document = _scanned(document, SCANNED_DPI)
+    pdf_data = document.tobytes(garbage=3, deflate=True)
+
+    fields = {
+        "invoice_date": issued.strftime("%d.%m.%Y"),
+        "invoice_number": number,
+        "invoice_total_amounts": f"{total.quantize(_CENT)}",
+        "invoice_currency": currency,
+        "description_keyword": keyword,
+        "vat_rates": _rate_text(rate) if rate is not None else "",
+        "supply_type": supply_type,
+        "service_category": category,
+        "supplier_name": supplier["name"],
+        "supplier_address": supplier["address"],
+        "supplier_country": supplier["country"],
+        "supplier_country_group": group,
+        "supplier_vat_id": supplier["vat_id"],
+        "supplier_email": supplier["email"],
+        "buyer_name": buyer["name"],
+        "buyer_address": buyer["address"],
+        "buyer_country": buyer["country"],
+        "buyer_country_group": buyer_group,
+        "buyer_vat_id": buyer["vat_id"],
+        "buyer_email": buyer["email"],
+    }
+    assert set(fields) == set(extraction_fields)
+    fields["scenario"] = determine_vat_scenarios({field: {"value": value} for field, value in fields.items()})
+    if fields["scenario"] != scenario:
+        raise AssertionError(f"Generated {scenario} invoice is classified as {fields['scenario']}.")
+
+    return pdf_data, {
+        "fields": fields,
+        "generator": {
+            "seed": seed,
+            "pages": document.page_count,
+            "rows": len(items),
+            "language": language,
+            "scenario": scenario,
+            "scanned": scanned,
+            "repeated_headers": repeated_headers,
+        },
+    }
@@ -0,0 +1,341 @@
+import re
+from typing import Dict, Iterable, List, Optional
+
+from preextract_utils import VAT_ID_CANDIDATE_PATTERN, is_valid_vat_id, parse_amount, parse_dates, pre_extract
+from prompts import extraction_fields
+
+
+# Fields that change with every invoice; a template has to be able to read all of them from the page.
+VARIABLE_FIELDS = ["invoice_number", "invoice_date", "invoice_total_amounts"]
+# Also read from the page when the approved value was found there; otherwise copied from the approved submission.
+LOCATABLE_FIELDS = VARIABLE_FIELDS + [
+    "supplier_name",
+    "supplier_vat_id",
+    "supplier_email",
+    "buyer_name",
+    "buyer_vat_id",
+    "buyer_email",
+]
+
+# Supplier key prefix for suppliers identified by name (see supplier_key()).
+NAME_KEY_PREFIX = "name:"
+
+READ_CONFIDENCE = "strong confidence"
+COPIED_CONFIDENCE = "medium confidence"
+
+# Pages kept in a layout: the first ones and the last (see ocr_utils.pdf_words()).
+LAYOUT_MAX_PAGES = 3
+MAX_VALUE_WORDS = 8
+MAX_ANCHOR_WORDS = 4
+PAGE_SIZE_TOLERANCE = 2.0
+# How far an anchor may move from where it was learned, as a fraction of the page; rows above the totals vary.
+ANCHOR_MAX_SHIFT_X = 0.15
+ANCHOR_MAX_SHIFT_Y = 0.6
+# Words this many line heights beside the learned value box still count as part of the value.
+VALUE_BOX_SLACK = 3.0
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+INVOICE_NUMBER_VALUE = re.compile(r"[A-Z0-9][A-Z0-9\-/._]*", re.IGNORECASE)
+LETTER_PATTERN = re.compile(r"[^\W\d_]")
+CURRENCY_AFFIX = re.compile(r"^(?:[A-Z]{3}|[€£$])\s?|\s?(?:[A-Z]{3}|[€£$])$|[.,:;]$")
+RATE_PATTERN = re.compile(r"\d{1,2}(?:[.,]\d{1,2})?")
+
+
+class TemplateMismatch(ValueError):
+    """The invoice does not look like the one the template was learned from."""
+
+
+def normalize_value(field: str, value) -> Optional[str]:
+    """
+    Canonical form of a field value read from the page, or None when it does not look like one.
+
+    Amounts, dates and VAT IDs use the pre-extraction formats; names keep their case.
+    """
+    text = " ".join(str(value if value is not None else "").split())
+    if not text:
+        return None
+    if field == "invoice_total_amounts":
+        return parse_amount(CURRENCY_AFFIX.sub("", text))
+    if field == "invoice_date":
+        dates = set(parse_dates(text))
+        return dates.pop() if len(dates) == 1 else None
+    if field.endswith("_vat_id"):
+        compact = re.sub(r"[\s.\-]", "", text).upper()
+        return compact if is_valid_vat_id(compact) else None
+    if field.endswith("_email"):
+        return text if EMAIL_PATTERN.fullmatch(text) else None
+    if field == "invoice_number":
+        text = text.strip("#:")
+        return text if INVOICE_NUMBER_VALUE.fullmatch(text) and re.search(r"\d", text) else None
+    if field == "vat_rates":
+        rates = {float(rate.replace(",", ".")) for rate in RATE_PATTERN.findall(text)}
+        return ", ".join(str(int(rate) if rate.is_integer() else rate) for rate in sorted(rates)) or None
+    return text if LETTER_PATTERN.search(text) else None
+
+
+def same_value(field: str, first, second) -> bool:
+    def key(value):
+        return (normalize_value(field, value) or " ".join(str(value or "").split())).casefold()
+
+    return key(first) == key(second)
+
+
+def field_value(invoice_data: dict, field: str):
+    raw = (invoice_data or {}).get(field)
+    return raw.get("value") if isinstance(raw, dict) else raw
+
+
+def supplier_key(invoice_data: dict) -> Optional[str]:
+    """Templates are keyed by the supplier's VAT ID, or by its name when the invoice has none."""
+    vat_id = normalize_value("supplier_vat_id", field_value(invoice_data, "supplier_vat_id"))
+    if vat_id:
+        return vat_id
+    name = " ".join(str(field_value(invoice_data, "supplier_name") or "").split()).casefold()
+    return f"{NAME_KEY_PREFIX}{name}" if name else None
+
+
+def layout_text(layout: dict) -> str:
+    """Plain text of a word layout, one line per text line."""
+    return "\n\n".join(
+        "\n".join(" ".join(word[4] for word in line) for line in _lines(page["words"]))
+        for page in layout["pages"]
+    )
+
+
+def layout_vat_ids(text: str) -> List[str]:
+    return list(dict.fromkeys(
+        country + body for country, body in VAT_ID_CANDIDATE_PATTERN.findall(text) if is_valid_vat_id(country + body)
+    ))
+
+
+def _lines(words: Iterable[list]) -> List[List[list]]:
+    """Visual rows of words, top to bottom: a label and its value are often separate text lines in the PDF."""
+    rows: List[List[list]] = []
+    for word in sorted(words, key=lambda word: (word[1] + word[3]) / 2):
+        middle = (word[1] + word[3]) / 2
+        if rows:
+            last = rows[-1][-1]
+            if abs(middle - (last[1] + last[3]) / 2) <= (last[3] - last[1]) / 2:
+                rows[-1].append(word)
+                continue
+        rows.append([word])
+    return [sorted(row, key=lambda word: word[0]) for row in rows]
+
+
+def _box(words: List[list]) -> List[float]:
+    return [
+        min(word[0] for word in words),
+        min(word[1] for word in words),
+        max(word[2] for word in words),
+        max(word[3] for word in words),
+    ]
+
+
+def _find_phrase(lines: List[List[list]], phrase: List[str]) -> List[List[list]]:
+    found = []
+    size = len(phrase)
+    for line in lines:
+        texts = [word[4].casefold() for word in line]
+        for start in range(len(line) - size + 1):
+            if texts[start:start + size] == phrase:
+                found.append(line[start:start + size])
+    return found
+
+
+def _is_label(words: List[list]) -> bool:
+    # Labels carry letters but no digits, so an invoice's own number or date is never used as an anchor.
+    texts = [word[4] for word in words]
+    return any(LETTER_PATTERN.search(text) for text in texts) and not any(re.search(r"\d", text) for text in texts)
+
+
+def _anchor(lines: List[List[list]], line: List[list], start: int, end: int) -> Optional[List[list]]:
+    """The nearest label unique on the page: words left of the value on its line, else the line above it."""
+    for size in range(1, min(MAX_ANCHOR_WORDS, start) + 1):
+        words = line[start - size:start]
+        if re.search(r"\d", words[0][4]):
+            break
+        if _is_label(words) and len(_find_phrase(lines, [word[4].casefold() for word in words])) == 1:
+            return words
+
+    x0, top, x1, _ = _box(line[start:end])
+    above = [
+        other for other in lines
+        if other is not line and max(word[3] for word in other) <= top + 1
+        and any(word[0] < x1 and word[2] > x0 for word in other)
+    ]
+    if not above:
+        return None
+    nearest = max(above, key=lambda other: max(word[3] for word in other))
+    words = [word for word in nearest if word[0] < x1 and word[2] > x0][:MAX_ANCHOR_WORDS]
+    if _is_label(words) and len(_find_phrase(lines, [word[4].casefold() for word in words])) == 1:
+        return words
+    return None
+
+
+def _page_ref(number: int, page_count: int) -> int:
+    # Totals sit on the last page, whatever the page count.
+    return -1 if number == page_count - 1 and page_count > 1 else number
+
+
+def _locate(field: str, target: str, layout: dict) -> Optional[dict]:
+    target = target.casefold()
+    # The last occurrence first: a grand total comes after the line items and subtotals.
+    for page in reversed(layout["pages"]):
+        lines = _lines(page["words"])
+        for line in reversed(lines):
+            for start in range(len(line)):
+                for end in range(min(start + MAX_VALUE_WORDS, len(line)), start, -1):
+                    value = normalize_value(field, " ".join(word[4] for word in line[start:end]))
+                    if value is None or value.casefold() != target:
+                        continue
+                    anchor = _anchor(lines, line, start, end)
+                    if anchor is None:
+                        continue
+                    anchor_box = _box(anchor)
+                    value_box = _box(line[start:end])
+                    return {
+                        "page": _page_ref(page["number"], layout["page_count"]),
+                        "anchor": [word[4].casefold() for word in anchor],
+                        "anchor_box": anchor_box,
+                        "box": [
+                            value_box[0] - anchor_box[0],
+                            value_box[1] - anchor_box[1],
+                            value_box[2] - anchor_box[0],
+                            value_box[3] - anchor_box[1],
+                        ],
+                    }
+    return None
+
+
+def learn_template(layout: dict, invoice_data: dict) -> Optional[dict]:
+    """
+    Build a supplier layout template from a PDF's word layout and its approved invoice_data.
+
+    Each locatable field found on the page is stored as its anchor (the
+    nearest unique label) and the value box relative to it; the remaining
+    approved fields are kept as constants. Returns None when one of
+    VARIABLE_FIELDS cannot be anchored, since such a template could not read
+    the next invoice.
+    """
+    if not layout["pages"]:
+        return None
+    first_page = layout["pages"][0]
+    fields, constants = {}, {}
+    for field in extraction_fields:
+        value = field_value(invoice_data, field)
+        if value in (None, "", [], {}):
+            if field in VARIABLE_FIELDS:
+                return None
+            continue
+        entry = None
+        if field in LOCATABLE_FIELDS:
+            target = normalize_value(field, value)
+            entry = _locate(field, target, layout) if target else None
+        if entry is not None:
+            fields[field] = entry
+        elif field in VARIABLE_FIELDS:
+            return None
+        else:
+            constants[field] = value
+    return {
+        "page_count": layout["page_count"],
+        "page_size": [first_page["width"], first_page["height"]],
+        "fields": fields,
+        "constants": constants,
+    }
+
+
+def _candidate_pages(entry: dict, layout: dict, template: dict) -> List[dict]:
+    pages = {page["number"]: page for page in layout["pages"]}
+    numbers = [entry["page"] % layout["page_count"]]
+    if template["page_count"] == 1:
+        # Learned from a one-page invoice: a longer one has its totals on the last page.
+        numbers.append(layout["page_count"] - 1)
+    return [pages[number] for number in dict.fromkeys(numbers) if number in pages]
+
+
+def _read_box(field: str, lines: List[List[list]], box: List[float], anchor: List[list]) -> Optional[tuple]:
+    x0, y0, x1, y1 = box
+    height = max(y1 - y0, 1.0)
+    slack = VALUE_BOX_SLACK * height
+    best = None
+    for line in lines:
+        middle = (min(word[1] for word in line) + max(word[3] for word in line)) / 2
+        if abs(middle - (y0 + y1) / 2) >= height / 2:
+            continue
+        for start in range(len(line)):
+            for end in range(start + 1, min(start + MAX_VALUE_WORDS, len(line)) + 1):
+                words = line[start:end]
+                if any(word in anchor or word[2] < x0 - slack or word[0] > x1 + slack for word in words):
+                    break
+                span = _box(words)
+                if min(span[2], x1) <= max(span[0], x0):
+                    continue
+                value = normalize_value(field, " ".join(word[4] for word in words))
+                # The longest readable span wins: "1 234,56" over its "234,56".
+                if value is not None and (best is None or len(words) > best[2]):
+                    best = (value, span, len(words))
+    return best
+
+
+def apply_template(template: dict, layout: dict) -> Dict[str, dict]:
+    """
+    Read an invoice with a supplier template, without the LLM.
+
+    Returns raw {field: {"value", "confidence"}} payloads (read fields on
+    the first page also carry a relative "bbox").
+
+    Raises:
+        TemplateMismatch: If the page size differs, an anchor is missing,
+            ambiguous or moved too far, a value is unreadable, or a value
+            disagrees with the deterministic pre-extraction
+    """
+    if not layout["pages"]:
+        raise TemplateMismatch("no pages")
+    first_page = layout["pages"][0]
+    width, height = template["page_size"]
+    if abs(first_page["width"] - width) > PAGE_SIZE_TOLERANCE or abs(first_page["height"] - height) > PAGE_SIZE_TOLERANCE:
+        raise TemplateMismatch("page size differs")
+
+    result = {}
+    for field, entry in template["fields"].items():
+        read = None
+        for page in _candidate_pages(entry, layout, template):
+            lines = _lines(page["words"])
+            matches = _find_phrase(lines, entry["anchor"])
+            if len(matches) != 1:
+                continue
+            anchor = matches[0]
+            anchor_x, anchor_y = anchor[0][0], min(word[1] for word in anchor)
+            if (
+                abs(anchor_x - entry["anchor_box"][0]) > ANCHOR_MAX_SHIFT_X * page["width"]
+                or abs(anchor_y - entry["anchor_box"][1]) > ANCHOR_MAX_SHIFT_Y * page["height"]
+            ):
+                continue
+            offsets = entry["box"]
+            box = [anchor_x + offsets[0], anchor_y + offsets[1], anchor_x + offsets[2], anchor_y + offsets[3]]
+            found = _read_box(field, lines, box, anchor)
+            if found is not None:
+                read = (found, page)
+                break
+        if read is None:
+            raise TemplateMismatch(f"{field}: no value next to {' '.join(entry['anchor'])!r}")
+        (value, span, _), page = read
+        payload = {"value": value, "confidence": READ_CONFIDENCE}
+        if page["number"] == 0:
+            payload["bbox"] = [
+                span[0] / page["width"],
+                span[1] / page["height"],
+                (span[2] - span[0]) / page["width"],
+                (span[3] - span[1]) / page["height"],
+            ]
+        result[field] = payload
+
+    for field, value in template["constants"].items():
+        result[field] = {"value": value, "confidence": COPIED_CONFIDENCE}
+
+    for field, payload in pre_extract(layout_text(layout)).items():
+        ours = result.get(field)
+        if ours is not None and not same_value(field, ours["value"], payload["value"]):
+            raise TemplateMismatch(f"{field}: {ours['value']!r} but the text says {payload['value']!r}")
+    return result
@@ -0,0 +1,211 @@
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+CHARS_PER_TOKEN = 4
+
+INVOICE_KEYWORDS = re.compile(
+    r"\b(invoice|arve|total|kokku|summa|subtotal|amount due|balance due|vat|kmkr|km|käibemaks|"
+    r"tax|iban|swift|bic|due date|maksetähtaeg|bill to|sold to|invoice to|buyer|ostja|maksja|"
+    r"seller|supplier|müüja|tarnija|reg\.?\s*(?:nr|no|code|kood))\b",
+    re.IGNORECASE,
+)
+BOILERPLATE_KEYWORDS = re.compile(
+    r"\b(terms and conditions|general terms|privacy|liability|governing law|üldtingimused|"
+    r"tingimused|warranty|disclaimer)\b",
+    re.IGNORECASE,
+)
+# Not part of a longer number: "12.03.2024" is a date, not the amount 12.03.
+AMOUNT_PATTERN = re.compile(r"(?<![\d.,])\b\d{1,3}(?:[ .,]?\d{3})*[.,]\d{2}\b(?![.,]\d)")
+# Country prefix and a body with at least one digit, so capitalised words do not count.
+VAT_ID_PATTERN = re.compile(r"\b[A-Z]{2}(?=[0-9A-Z]*\d)[0-9A-Z]{8,12}\b")
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+BUYER_LABELS = re.compile(
+    r"\b(bill(?:ed)? to|invoice to|sold to|buyer|customer|client|recipient|ostja|maksja|klient)\b",
+    re.IGNORECASE,
+)
+SUPPLIER_LABELS = re.compile(
+    r"\b(seller|supplier|vendor|issued by|müüja|tarnija|arve väljastaja)\b",
+    re.IGNORECASE,
+)
+# Lines after a party label that still belong to that party's block.
+PARTY_BLOCK_LINES = 6
+
+# ocr_utils ends every page of the OCR text with this (str.splitlines() treats it as a line break).
+PAGE_BREAK = "\f"
+
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?[\s:\-|]+\|?$")
+PAGE_NUMBER_PATTERN = re.compile(
+    r"^(?:page|lk|lehekülg|leht)\.?\s*\d+\s*(?:(?:of|/|-)\s*\d+)?$", re.IGNORECASE
+)
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+RULE_PATTERN = re.compile(r"^[-*_=]{3,}$")
+SPACES_PATTERN = re.compile(r"[ \t\u00a0]{2,}")
+
+# Repeated lines shorter than this are kept (e.g. "Hosting", "1 pcs").
+MIN_DEDUPE_LINE_LENGTH = 12
+# Lines this close to the top or bottom of a page can be a running header or footer.
+PAGE_EDGE_LINES = 3
+# Boilerplate paragraphs shorter than this are kept; they may carry a payment term.
+MIN_BOILERPLATE_BLOCK_LENGTH = 300
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or "") // CHARS_PER_TOKEN
+
+
+def _compact_table_row(line: str) -> str:
+    cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+    if not any(cells):
+        return ""
+    return "|" + "|".join(cells) + "|"
+
+
+def _is_informative(block: str) -> bool:
+    return bool(
+        AMOUNT_PATTERN.search(block)
+        or VAT_ID_PATTERN.search(block)
+        or EMAIL_PATTERN.search(block)
+    )
+
+
+def _is_boilerplate_block(block: str) -> bool:
+    if len(block) < MIN_BOILERPLATE_BLOCK_LENGTH or _is_informative(block):
+        return False
+    return len(BOILERPLATE_KEYWORDS.findall(block)) > 0
+
+
+def party_lines(lines: List[str], labels: re.Pattern, stop: re.Pattern) -> Set[int]:
+    """Indexes of the lines in the blocks that labels opens (up to PARTY_BLOCK_LINES, or the stop label)."""
+    indexes = set()
+    for index, line in enumerate(lines):
+        if not labels.search(line):
+            continue
+        for offset in range(index, min(index + PARTY_BLOCK_LINES, len(lines))):
+            if offset > index and stop.search(lines[offset]):
+                break
+            indexes.add(offset)
+    return indexes
+
+
+def _clean_line(raw_line: str) -> str:
+    line = IMAGE_PATTERN.sub("", raw_line).replace("**", "")
+    return SPACES_PATTERN.sub(" ", line).strip()
+
+
+def _is_layout_line(line: str) -> bool:
+    return bool(RULE_PATTERN.match(line) or PAGE_NUMBER_PATTERN.match(line) or TABLE_SEPARATOR_PATTERN.match(line))
+
+
+def _edge_dedupe_candidates(page: List[str]) -> Set[int]:
+    """Lines of a page that may be a running header or footer: near its top or bottom, outside party blocks."""
+    content = [index for index, line in enumerate(page) if line and not _is_layout_line(line)]
+    edges = set(content[:PAGE_EDGE_LINES] + content[-PAGE_EDGE_LINES:])
+    parties = party_lines(page, BUYER_LABELS, SUPPLIER_LABELS) | party_lines(page, SUPPLIER_LABELS, BUYER_LABELS)
+    return {
+        index
+        for index in edges - parties
+        if len(page[index]) >= MIN_DEDUPE_LINE_LENGTH
+        and not page[index].startswith("|")
+        and not AMOUNT_PATTERN.search(page[index])
+    }
+
+
+def _compact_lines(text: str) -> List[str]:
+    pages = [[_clean_line(raw_line) for raw_line in page.splitlines()] for page in text.split(PAGE_BREAK)]
+    candidates = [_edge_dedupe_candidates(page) for page in pages]
+    # Running headers/footers: candidate lines found on more than one page.
+    page_counts = Counter(
+        key for page, indexes in zip(pages, candidates) for key in {page[index].lower() for index in indexes}
+    )
+
+    seen = set()
+    lines = []
+    for page, indexes in zip(pages, candidates):
+        for index, line in enumerate(page):
+            if not line:
+                lines.append("")
+                continue
+            if RULE_PATTERN.match(line) or PAGE_NUMBER_PATTERN.match(line):
+                continue
+            if line.startswith("|"):
+                if TABLE_SEPARATOR_PATTERN.match(line):
+                    continue
+                # Table rows are line items; repeats are real and never deduplicated.
+                line = _compact_table_row(line)
+                if line:
+                    lines.append(line)
+                continue
+
+            # Repeated page headers/footers: keep only the first occurrence.
+            key = line.lower()
+            if index in indexes and page_counts[key] > 1:
+                if key in seen:
+                    continue
+                seen.add(key)
+            lines.append(line)
+        lines.append("")
+    return lines
+
+
+def compact_invoice_text(text: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Deterministically shrink OCR markdown before it is embedded in the LLM prompt.
+
+    Dedupes header/footer lines repeated at the top or bottom of several
+    pages (never inside a supplier or buyer block), collapses padded tables,
+    and drops page numbers, rules, images and long boilerplate paragraphs.
+
+    Returns (compacted_text, {"tokens_before": ..., "tokens_after": ...}).
+    """
+    blocks = []
+    current = []
+    for line in _compact_lines(text or "") + [""]:
+        if line:
+            current.append(line)
+            continue
+        if current:
+            block = "\n".join(current)
+            if not _is_boilerplate_block(block):
+                blocks.append(block)
+            current = []
+
+    compacted = "\n\n".join(blocks)
+    return compacted, {
+        "tokens_before": estimate_tokens(text),
+        "tokens_after": estimate_tokens(compacted),
+    }
+
+
+def relevant_snippet(text: str, terms: Iterable[str], max_chars: int, context_lines: int = 2) -> str:
+    """
+    Cut the lines mentioning any of terms (plus context_lines around them) out of text.
+
+    Returns the whole text when it already fits in max_chars or no term matches.
+    """
+    text = text or ""
+    if len(text) <= max_chars:
+        return text
+    words = sorted({term.strip().lower() for term in terms if term and term.strip()}, key=len, reverse=True)
+    if not words:
+        return text
+    pattern = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(word) for word in words) + r")(?!\w)", re.IGNORECASE)
+
+    lines = text.splitlines()
+    keep = set()
+    for index, line in enumerate(lines):
+        if pattern.search(line):
+            keep.update(range(max(index - context_lines, 0), min(index + context_lines + 1, len(lines))))
+    if not keep:
+        return text
+
+    parts = []
+    previous = None
+    for index in sorted(keep):
+        if previous is not None and index != previous + 1:
+            parts.append("...")
+        parts.append(lines[index])
+        previous = index
+    return "\n".join(parts)[:max_chars]
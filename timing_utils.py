@@ -0,0 +1,78 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+
+class Timings:
+    """Durations of the named spans of one request or job; repeated spans (e.g. LLM calls) are summed."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + max(seconds, 0.0) * 1000
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def elapsed_ms(self) -> float:
+        return round((time.monotonic() - self.started) * 1000, 1)
+
+    def as_dict(self) -> Dict[str, float]:
+        """Milliseconds per span, in the order the spans first ran."""
+        return {name: round(ms, 1) for name, ms in self.durations.items()}
+
+
+_current: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar("timings", default=None)
+
+
+@contextmanager
+def collect_timings() -> Iterator[Timings]:
+    """Collect the spans run inside the block (in this thread or task)."""
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the block as `name`; a no-op outside collect_timings()."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timings.add(name, time.monotonic() - started)
+
+
+def record(name: str, seconds: Optional[float]) -> None:
+    """Add a duration measured elsewhere (e.g. reported by Replicate)."""
+    timings = _current.get()
+    if timings is not None and seconds is not None:
+        timings.add(name, seconds)
+
+
+def record_prediction(prediction) -> None:
+    """Replicate's own queue time (created -> started) and model run time of a finished prediction."""
+    if _current.get() is None:
+        return
+    try:
+        created_at = datetime.fromisoformat(str(prediction.created_at).replace("Z", "+00:00"))
+        started_at = datetime.fromisoformat(str(prediction.started_at).replace("Z", "+00:00"))
+        record("llm_queue", (started_at - created_at).total_seconds())
+    except (TypeError, ValueError):
+        pass
+    record("llm_predict", (getattr(prediction, "metrics", None) or {}).get("predict_time"))
+
+
+def server_timing_header(durations: Dict[str, float]) -> str:
+    """Server-Timing header value for span durations in milliseconds."""
+    return ", ".join(f"{name};dur={ms}" for name, ms in durations.items())
@@ -3,21 +3,52 @@ import os
 
 load_dotenv()
 
+import httpx
 import replicate
+import hashlib
 import json
-from typing import Optional
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple, Union
 from pathlib import Path
 import time
 
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from replicate.exceptions import ReplicateError
+from replicate.stream import ServerSentEvent
 
 # from docling.document_converter import DocumentConverter
-from prompts import system_prompt_parse_w_reasoning
-
-import pymupdf4llm
-import fitz
+from prompts import (
+    confidence_levels,
+    extraction_fields,
+    field_prompt_rules,
+    prompt_example_format,
+    prompt_rules_output,
+    system_prompt_parse_lean,
+    system_prompt_parse_w_reasoning,
+)
 
 from accounting_utils import *
+from json_utils import IncrementalJSONParser, parse_json_object
+import metrics_utils
+from notify_utils import Subscription, cancel_key, completion_key, get_notification_bus
+from rate_limit_utils import RateLimitTimeout, TokenBucket, backoff_delay
+from routing_utils import (
+    ROUTE_ESCALATED,
+    ROUTE_LARGE,
+    ROUTE_SMALL,
+    escalation_terms,
+    fields_to_escalate,
+    record_model_call,
+    record_route,
+)
+from ocr_utils import pdf_to_markdown
+from preextract_utils import check_field_formats, pre_extract
+from text_utils import compact_invoice_text, estimate_tokens, relevant_snippet
+from timing_utils import record, record_prediction, span
+
+logger = logging.getLogger(__name__)
 
 # def run_ocr(filepath: Path) -> str:
 #     global pdf_converter
@@ -31,21 +62,89 @@ from accounting_utils import *
 #     return outputs_total
 
 
-def run_ocr(filepath: Path):
-    with fitz.open(filepath) as doc:
-        page_count = doc.page_count
-    if page_count <= 0:
-        return ""
-    max_pages = min(page_count, 10)
-    pages = list(range(max_pages))
-    md_text = pymupdf4llm.to_markdown(filepath, pages=pages)
-    return md_text
-
+def load_pdf_bytes(source: Union[Path, bytes]) -> bytes:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def run_ocr(source: Union[Path, bytes]) -> Tuple[str, List[int]]:
+    # The PDF is opened once, from memory, inside an OCR worker process.
+    return pdf_to_markdown(load_pdf_bytes(source), max_pages=10)
+
+
+LLM_MODEL = "qwen/qwen3-235b-a22b-instruct-2507"
+# Cascade: a small, fast model extracts first; LLM_MODEL only re-extracts its low-confidence fields.
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "meta/meta-llama-3-8b-instruct")
+LLM_CASCADE_ENABLED = os.getenv("LLM_CASCADE", "1") == "1" and bool(LLM_SMALL_MODEL)
+# Small Replicate models default to short completions; the extraction JSON needs more.
+LLM_SMALL_MAX_TOKENS = int(os.getenv("LLM_SMALL_MAX_TOKENS", "2048"))
+# Context window of LLM_SMALL_MODEL; longer prompts (plus the completion) go straight to LLM_MODEL.
+LLM_SMALL_CONTEXT_TOKENS = int(os.getenv("LLM_SMALL_CONTEXT_TOKENS", "8192"))
+# Escalation prompts carry only the text around the doubtful fields, up to this many characters.
+LLM_ESCALATION_SNIPPET_CHARS = int(os.getenv("LLM_ESCALATION_SNIPPET_CHARS", "4000"))
+# Identifies the model route in result cache keys, so switching the cascade on or off re-extracts.
+EXTRACTION_ROUTE = f"{LLM_SMALL_MODEL}>{LLM_MODEL}" if LLM_CASCADE_ENABLED else LLM_MODEL
+# Models that can be held to a JSON schema, as "owner/model=input_name" pairs; the schema is sent as a JSON string.
+LLM_JSON_SCHEMA_INPUTS = dict(
+    (model.strip(), name.strip())
+    for model, _, name in (entry.partition("=") for entry in os.getenv("LLM_JSON_SCHEMA_INPUTS", "").split(","))
+    if model.strip() and name.strip()
+)
+
+EXTRACTION_CACHE_ALIAS = "extraction"
+OCR_CACHE_PREFIX = "ocr"
+RESULT_CACHE_PREFIX = "extraction_result"
+
+PROMPT_COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION", "1") == "1"
+# Resolve strictly formatted fields with regexes and ask the LLM only for the rest.
+PRE_EXTRACTION_ENABLED = os.getenv("PRE_EXTRACTION", "1") == "1"
 
 PREDICTION_CACHE_PREFIX = "replicate_prediction"
 PREDICTION_CACHE_TTL = 60 * 60
 CANCEL_CACHE_PREFIX = "replicate_cancel"
 CANCEL_CACHE_TTL = 60 * 60
+# Blocking "Prefer: wait" creation (1-60 s); 0 disables it.
+REPLICATE_WAIT_SECONDS = min(int(os.getenv("REPLICATE_WAIT_SECONDS", "15")), 60)
+# Public URL of the webhook receiver (/process/replicate-webhook) and its signing secret.
+REPLICATE_WEBHOOK_URL = os.getenv("REPLICATE_WEBHOOK_URL", "")
+REPLICATE_WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET", "")
+# Fallback polling backs off from the min to the max interval.
+REPLICATE_POLL_MIN_INTERVAL = float(os.getenv("REPLICATE_POLL_MIN_INTERVAL", "0.5"))
+REPLICATE_POLL_MAX_INTERVAL = float(os.getenv("REPLICATE_POLL_MAX_INTERVAL", "5"))
+REPLICATE_POLL_BACKOFF = 1.5
+# With webhooks, the API is only polled this often in case a delivery is lost.
+REPLICATE_WEBHOOK_FALLBACK_INTERVAL = float(os.getenv("REPLICATE_WEBHOOK_FALLBACK_INTERVAL", "30"))
+PREDICTION_TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+# Replicate predictions in flight per process; OCR is bounded separately by the OCR pool.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+_llm_slots = threading.BoundedSemaphore(max(LLM_MAX_CONCURRENCY, 1))
+
+# Prediction creations across all processes on the host, sized to the Replicate account quota.
+REPLICATE_RATE_LIMIT_PER_MINUTE = float(os.getenv("REPLICATE_RATE_LIMIT_PER_MINUTE", "600"))
+REPLICATE_RATE_LIMIT_BURST = float(os.getenv("REPLICATE_RATE_LIMIT_BURST", "10"))
+REPLICATE_RATE_LIMIT_DB = os.getenv(
+    "REPLICATE_RATE_LIMIT_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "replicate_rate_limit.sqlite3"),
+)
+# Throttled creations are queued and retried until this deadline, then reported as throttled.
+REPLICATE_RETRY_DEADLINE = float(os.getenv("REPLICATE_RETRY_DEADLINE", "180"))
+# A prediction still unfinished this long after creation is cancelled and reported as failed.
+REPLICATE_PREDICTION_TIMEOUT = float(os.getenv("REPLICATE_PREDICTION_TIMEOUT", "300"))
+REPLICATE_RETRY_BASE_DELAY = 1.0
+REPLICATE_RETRY_MAX_DELAY = 30.0
+
+_replicate_bucket = TokenBucket(
+    REPLICATE_RATE_LIMIT_DB,
+    "replicate_create",
+    rate=REPLICATE_RATE_LIMIT_PER_MINUTE / 60.0,
+    capacity=REPLICATE_RATE_LIMIT_BURST,
+)
+
+# on_progress(event, **data) receives pipeline stage events and streamed fields.
+ProgressCallback = Callable[..., None]
 
 
 class ReplicateCancelled(RuntimeError):
@@ -56,6 +155,10 @@ class ReplicateFailed(RuntimeError):
     pass
 
 
+class ReplicateThrottled(RuntimeError):
+    pass
+
+
 def get_prediction_cache_key(request_id: str) -> str:
     return f"{PREDICTION_CACHE_PREFIX}:{request_id}"
 
@@ -63,36 +166,342 @@ def get_cancel_cache_key(request_id: str) -> str:
     return f"{CANCEL_CACHE_PREFIX}:{request_id}"
 
 
-def llm_request(prompt, request_id: Optional[str] = None):
-    input = {"prompt": system_prompt_parse_w_reasoning + "\n" + prompt}
+def get_file_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
 
-    prediction = replicate.predictions.create(
-        # model="anthropic/claude-3.7-sonnet",  ## stronger reasoning, higher costs
-        # model="meta/meta-llama-3-8b-instruct",
-        model="qwen/qwen3-235b-a22b-instruct-2507",
-        input=input,
-    )
 
-    if request_id:
-        cache.set(get_prediction_cache_key(request_id), prediction.id, timeout=PREDICTION_CACHE_TTL)
+def get_ocr_cache_key(file_hash: str) -> str:
+    return f"{OCR_CACHE_PREFIX}:{file_hash}"
+
+
+def get_result_cache_key(llm_input: str, model: str = EXTRACTION_ROUTE) -> str:
+    # The full prompt is part of the key, so prompt edits invalidate old entries.
+    digest = hashlib.sha256(f"{model}\n{llm_input}".encode("utf-8")).hexdigest()
+    return f"{RESULT_CACHE_PREFIX}:{digest}"
+
+
+def build_llm_input(prompt: str, system_prompt: str = system_prompt_parse_lean) -> str:
+    return system_prompt + "\n" + prompt
+
+
+def build_field_system_prompt(fields: List[str], with_reasoning: bool = False) -> str:
+    """
+    The extraction system prompt cut down to the rules and example lines of the given fields.
+
+    with_reasoning keeps the "*_reasoning" line of each group (invoice,
+    supplier, buyer) a requested field belongs to.
+    """
+    sections = []
+    for field in fields:
+        for section in field_prompt_rules.get(field, []):
+            if section not in sections:
+                sections.append(section)
+    examples = _example_lines(fields, with_reasoning)
+    return prompt_rules_output + "".join(sections) + "\nExample format:\n{\n" + "\n".join(examples) + "\n}\n"
+
+
+def _example_lines(fields: List[str], with_reasoning: bool) -> List[str]:
+    """The lines of prompt_example_format for the given fields, with their groups' "*_reasoning" lines."""
+    examples = []
+    reasoning = None
+    for line in prompt_example_format.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("///"):
+            reasoning = None
+        elif stripped.split(":", 1)[0].endswith('_reasoning"'):
+            reasoning = line
+        elif any(stripped.startswith(f'"{field}"') for field in fields):
+            if with_reasoning and reasoning:
+                examples.append(reasoning)
+                reasoning = None
+            examples.append(line)
+    return examples
+
+
+# Fields whose value may list several items, e.g. every VAT rate on the invoice.
+MULTI_VALUE_FIELDS = {"vat_rates"}
+
+
+def build_json_schema(fields: List[str], with_reasoning: bool = False) -> dict:
+    """JSON schema of the answer build_field_system_prompt() asks for, for models that can be held to one."""
+    def answer(value: dict) -> dict:
+        return {
+            "type": "object",
+            "properties": {
+                "value": value,
+                "confidence": {"type": "string", "enum": confidence_levels},
+            },
+            "required": ["value", "confidence"],
+            "additionalProperties": False,
+        }
+
+    scalar = {"type": ["string", "number"]}
+    # A list as a string ("0, 9, 24") or as an array ([0, 9, 24]); both are handled downstream.
+    listed = {"type": ["string", "number", "array"], "items": scalar}
+    properties = {}
+    for line in _example_lines(fields, with_reasoning):
+        key = line.strip().split(":", 1)[0].strip('"')
+        if key.endswith("_reasoning"):
+            properties[key] = {"type": "string"}
+        else:
+            properties[key] = answer(listed if key in MULTI_VALUE_FIELDS else scalar)
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def emit_progress(on_progress: Optional[ProgressCallback], event: str, **data) -> None:
+    if on_progress is not None:
+        on_progress(event, **data)
+
+
+def request_cancel(request_id: str) -> int:
+    """
+    Cancel the extraction running for request_id, wherever it runs.
+
+    Pushes the cancel to every listening process and leaves a flag in the
+    cache for a process that only starts waiting later.
 
+    Returns the number of other processes notified.
+    """
+    cache.set(get_cancel_cache_key(request_id), True, timeout=CANCEL_CACHE_TTL)
+    metrics_utils.inc("invoice_extraction_cancel_requests_total")
+    return get_notification_bus().publish(cancel_key(request_id))
+
+
+def is_cancel_requested(request_id: Optional[str]) -> bool:
+    if not request_id:
+        return False
+    if get_notification_bus().is_published(cancel_key(request_id)):
+        return True
+    return bool(cache.get(get_cancel_cache_key(request_id)))
+
+
+def mark_prediction_completed(prediction_id: str) -> None:
+    """Wake the process waiting on a prediction after its completion webhook arrived."""
+    get_notification_bus().publish(completion_key(prediction_id))
+
+
+@contextmanager
+def llm_slot(request_id: Optional[str] = None):
+    """Hold one of LLM_MAX_CONCURRENCY prediction slots; gives up if the request is cancelled while queued."""
+    with span("llm_slot"):
+        while not _llm_slots.acquire(timeout=0.5):
+            if request_id and get_notification_bus().is_published(cancel_key(request_id)):
+                raise ReplicateCancelled("Replicate prediction was canceled.")
     try:
-        if request_id and cache.get(get_cancel_cache_key(request_id)):
-            replicate.predictions.cancel(prediction.id)
-            cache.delete(get_cancel_cache_key(request_id))
+        yield
+    finally:
+        _llm_slots.release()
+
+
+def create_prediction(request_id: Optional[str] = None, **params):
+    """
+    Create a Replicate prediction under the shared rate limit.
+
+    Waits for a token instead of hitting the quota, and retries 429 responses
+    with jittered exponential backoff until REPLICATE_RETRY_DEADLINE.
+
+    Raises:
+        ReplicateThrottled: If no prediction could be created before the deadline
+        ReplicateCancelled: If the request is cancelled while waiting
+    """
+    deadline = time.monotonic() + REPLICATE_RETRY_DEADLINE
+
+    def abort_if_cancelled() -> None:
+        if request_id and get_notification_bus().is_published(cancel_key(request_id)):
             raise ReplicateCancelled("Replicate prediction was canceled.")
-        while prediction.status not in {"succeeded", "failed", "canceled"}:
-            time.sleep(0.75)
-            if request_id and cache.get(get_cancel_cache_key(request_id)):
-                replicate.predictions.cancel(prediction.id)
-                cache.delete(get_cancel_cache_key(request_id))
-                raise ReplicateCancelled("Replicate prediction was canceled.")
+
+    attempt = 0
+    while True:
+        try:
+            waited = _replicate_bucket.acquire(deadline, should_abort=abort_if_cancelled)
+        except RateLimitTimeout:
+            metrics_utils.inc("replicate_throttled_total", source="local_limit")
+            raise ReplicateThrottled("Replicate rate limit: no capacity before the retry deadline.")
+        if waited > 1:
+            logger.info("Waited %.1fs for Replicate capacity: request_id=%s", waited, request_id)
+
+        try:
+            # replicate.predictions.create() drops `wait` when given a model name, so use the models namespace.
+            return replicate.models.predictions.create(**params)
+        except ReplicateError as exc:
+            if exc.status != 429:
+                raise
+            metrics_utils.inc("replicate_throttled_total", source="replicate")
+            attempt += 1
+            delay = backoff_delay(attempt, REPLICATE_RETRY_BASE_DELAY, REPLICATE_RETRY_MAX_DELAY)
+            logger.warning(
+                "Replicate throttled prediction create (attempt %s), retrying in %.1fs: request_id=%s",
+                attempt,
+                delay,
+                request_id,
+            )
+            if time.monotonic() + delay > deadline:
+                raise ReplicateThrottled(str(exc) or "Replicate throttled the request.")
+            # Slow down every process on the host, not just this request.
+            _replicate_bucket.penalize(delay)
+
+
+def _cancel_prediction(prediction_id: str) -> None:
+    try:
+        replicate.predictions.cancel(prediction_id)
+    except Exception as exc:
+        logger.warning("Failed to cancel Replicate prediction %s: %s", prediction_id, exc)
+
+
+def _raise_if_cancelled(subscription: Subscription, request_id: Optional[str]) -> None:
+    if request_id and cancel_key(request_id) in subscription.fired:
+        raise ReplicateCancelled("Replicate prediction was canceled.")
+
+
+def _stream_prediction(
+    prediction,
+    subscription: Subscription,
+    request_id: Optional[str],
+    on_progress: ProgressCallback,
+    deadline: float,
+):
+    """Read the token stream, reporting each top-level JSON member as soon as it is complete."""
+    parser = IncrementalJSONParser()
+    events = prediction.stream()
+    try:
+        for event in events:
+            if time.monotonic() >= deadline:
+                break
+            if event.event == ServerSentEvent.EventType.OUTPUT:
+                for key, value in parser.feed(event.data):
+                    emit_progress(on_progress, "field", key=key, value=value)
+            elif event.event in (ServerSentEvent.EventType.ERROR, ServerSentEvent.EventType.DONE):
+                break
+            _raise_if_cancelled(subscription, request_id)
+    except (ReplicateError, httpx.HTTPError) as exc:
+        # Streaming is best effort; the caller keeps polling for the final output.
+        logger.warning("Replicate stream interrupted for %s: %s", prediction.id, exc)
+    finally:
+        events.close()
+    _raise_if_cancelled(subscription, request_id)
+    return replicate.predictions.get(prediction.id)
+
+
+def _prediction_params(on_progress: Optional[ProgressCallback]) -> dict:
+    params = {}
+    if on_progress is not None:
+        # Streaming already pushes output; blocking creation would only delay the first field.
+        params["stream"] = True
+    elif REPLICATE_WAIT_SECONDS > 0:
+        params["wait"] = REPLICATE_WAIT_SECONDS
+    if REPLICATE_WEBHOOK_URL:
+        params["webhook"] = REPLICATE_WEBHOOK_URL
+        params["webhook_events_filter"] = ["completed"]
+    return params
+
+
+def _wait_for_prediction(
+    prediction,
+    subscription: Subscription,
+    request_id: Optional[str],
+    on_progress: Optional[ProgressCallback],
+):
+    """
+    Wait for a prediction to finish.
+
+    Streams output once it is running (when on_progress is given), otherwise
+    sleeps until a cancel or webhook notification arrives, polling with
+    exponential backoff as a fallback.
+
+    Raises:
+        ReplicateFailed: If the prediction is not done within REPLICATE_PREDICTION_TIMEOUT
+    """
+    poll_interval = REPLICATE_POLL_MIN_INTERVAL
+    next_poll = time.monotonic() + poll_interval
+    deadline = time.monotonic() + REPLICATE_PREDICTION_TIMEOUT
+    running = False
+    while prediction.status not in PREDICTION_TERMINAL_STATUSES:
+        if time.monotonic() >= deadline:
+            _cancel_prediction(prediction.id)
+            raise ReplicateFailed(f"Replicate prediction did not finish within {REPLICATE_PREDICTION_TIMEOUT:.0f}s.")
+        if on_progress is not None and prediction.status == "processing" and not running:
+            running = True
+            emit_progress(on_progress, "llm_running")
+            if (prediction.urls or {}).get("stream"):
+                prediction = _stream_prediction(prediction, subscription, request_id, on_progress, deadline)
+                continue
+
+        notified = subscription.wait(max(min(next_poll, deadline) - time.monotonic(), 0))
+        _raise_if_cancelled(subscription, request_id)
+
+        if notified or time.monotonic() >= next_poll:
+            subscription.reset(completion_key(prediction.id))
             prediction = replicate.predictions.get(prediction.id)
+            if REPLICATE_WEBHOOK_URL:
+                poll_interval = REPLICATE_WEBHOOK_FALLBACK_INTERVAL
+            else:
+                poll_interval = min(poll_interval * REPLICATE_POLL_BACKOFF, REPLICATE_POLL_MAX_INTERVAL)
+            next_poll = time.monotonic() + poll_interval
+    return prediction
+
+
+def llm_request(
+    prompt,
+    request_id: Optional[str] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    model: str = LLM_MODEL,
+    max_tokens: Optional[int] = None,
+    system_prompt: str = system_prompt_parse_lean,
+    json_schema: Optional[dict] = None,
+):
+    # Cancelled while still in OCR: never start a prediction.
+    if is_cancel_requested(request_id):
+        raise ReplicateCancelled("Replicate prediction was canceled.")
+
+    input = {"prompt": build_llm_input(prompt, system_prompt)}
+    if max_tokens:
+        input["max_tokens"] = max_tokens
+    if json_schema and model in LLM_JSON_SCHEMA_INPUTS:
+        input[LLM_JSON_SCHEMA_INPUTS[model]] = json.dumps(json_schema)
+
+    with span("llm_create"):
+        prediction = create_prediction(
+            request_id,
+            # model="anthropic/claude-3.7-sonnet",  ## stronger reasoning, higher costs
+            model=model,
+            input=input,
+            **_prediction_params(on_progress),
+        )
+    if prediction.status not in PREDICTION_TERMINAL_STATUSES:
+        emit_progress(on_progress, "llm_queued")
+
+    if request_id:
+        cache.set(get_prediction_cache_key(request_id), prediction.id, timeout=PREDICTION_CACHE_TTL)
+
+    def on_notify(key: str) -> None:
+        # Runs on the notification thread, so Replicate is told to stop without waiting for this loop.
+        if key.startswith("cancel:"):
+            _cancel_prediction(prediction.id)
+
+    keys = [completion_key(prediction.id)]
+    if request_id:
+        keys.append(cancel_key(request_id))
+    bus = get_notification_bus()
+    subscription = bus.subscribe(*keys, callback=on_notify)
+    try:
+        if is_cancel_requested(request_id) and cancel_key(request_id) not in subscription.fired:
+            subscription.fire(cancel_key(request_id))
+        _raise_if_cancelled(subscription, request_id)
+        with span("llm_wait"):
+            prediction = _wait_for_prediction(prediction, subscription, request_id, on_progress)
     finally:
+        bus.unsubscribe(subscription)
         if request_id:
             cache.delete(get_prediction_cache_key(request_id))
             cache.delete(get_cancel_cache_key(request_id))
 
+    record_prediction(prediction)
+    metrics_utils.inc("replicate_predictions_total", model=model, status=prediction.status)
     if prediction.status == "canceled":
         raise ReplicateCancelled("Replicate prediction was canceled.")
     if prediction.status != "succeeded":
@@ -106,19 +515,281 @@ def llm_request(prompt, request_id: Optional[str] = None):
     return str(output)
 
 
-def pipeline(filepath: Path, request_id: Optional[str] = None) -> dict:
-    invoice_text = run_ocr(filepath)
+def build_extraction_prompt(invoice_text: str, with_reasoning: bool = False) -> str:
+    reasoning = "\n    In each field '*_reasoning', provide explanations for your choices." if with_reasoning else ""
+    return f"""
+    You need to read through an invoice text and fill in several fields in a json, following provided instructions.{reasoning}
+    Full invoice here: {invoice_text}.
+    """
+
+
+def build_field_prompt(invoice_text: str, fields: List[str], with_reasoning: bool = False) -> str:
+    reasoning = "\n    In each field '*_reasoning', provide explanations for your choices." if with_reasoning else ""
+    return f"""
+    You need to read through an invoice text and fill in only these fields of the json: {", ".join(fields)}.
+    Return a json object with exactly these keys, following the provided instructions for each of them.{reasoning}
+    Invoice text here: {invoice_text}.
+    """
+
+
+def field_prompt_text(invoice_text: str, fields: List[str], known: dict) -> str:
+    """The part of the invoice text a field-level prompt needs; known values help locate the fields."""
+    terms = escalation_terms(fields, known)
+    if terms is None:
+        return invoice_text
+    return relevant_snippet(invoice_text, terms, LLM_ESCALATION_SNIPPET_CHARS)
+
+
+def parse_llm_json(output: str) -> dict:
+    """Parse the JSON object in an LLM answer, repairing what can be (see json_utils.parse_json_object)."""
+    with span("parse"):
+        return parse_json_object(output)
+
+
+def _timed_llm_request(prompt: str, request_id: Optional[str], on_progress: Optional[ProgressCallback], model: str, **kwargs) -> str:
+    started = time.monotonic()
+    try:
+        return llm_request(prompt, request_id=request_id, on_progress=on_progress, model=model, **kwargs)
+    finally:
+        elapsed = time.monotonic() - started
+        record_model_call(model, elapsed)
+        record("llm", elapsed)
+
+
+def _fits_small_model(prompt: str, system_prompt: str, json_schema: Optional[dict]) -> bool:
+    """Whether the prompt and a full-length completion fit in LLM_SMALL_CONTEXT_TOKENS."""
+    schema_text = json.dumps(json_schema) if json_schema and LLM_SMALL_MODEL in LLM_JSON_SCHEMA_INPUTS else ""
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt) + estimate_tokens(schema_text)
+    return prompt_tokens + LLM_SMALL_MAX_TOKENS <= LLM_SMALL_CONTEXT_TOKENS
+
+
+def routed_llm_extraction(
+    invoice_text: str,
+    prompt: str,
+    request_id: Optional[str] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    fields: List[str] = extraction_fields,
+    system_prompt: str = system_prompt_parse_lean,
+    json_schema: Optional[dict] = None,
+) -> dict:
+    """
+    Extract the invoice fields with the cheapest model that is confident about them.
+
+    LLM_SMALL_MODEL answers the full prompt first. Fields it is unsure about
+    (or left out, or gave in an impossible format) are re-extracted by
+    LLM_MODEL from the text around them, and the answers are merged. If the
+    small model fails or returns no usable JSON, LLM_MODEL extracts everything.
+    """
+    started = time.monotonic()
+    small_result = None
+    if LLM_CASCADE_ENABLED and not _fits_small_model(prompt, system_prompt, json_schema):
+        logger.info("Prompt exceeds the %s context, using %s: request_id=%s", LLM_SMALL_MODEL, LLM_MODEL, request_id)
+    elif LLM_CASCADE_ENABLED:
+        try:
+            output = _timed_llm_request(
+                prompt,
+                request_id,
+                on_progress,
+                model=LLM_SMALL_MODEL,
+                max_tokens=LLM_SMALL_MAX_TOKENS,
+                system_prompt=system_prompt,
+                json_schema=json_schema,
+            )
+            small_result = parse_llm_json(output)
+            check_field_formats(small_result)
+        except (ReplicateError, ReplicateFailed, ValueError) as exc:
+            logger.warning("Small model extraction failed, using %s: %s", LLM_MODEL, exc)
+
+    if small_result is None:
+        result = parse_llm_json(
+            _timed_llm_request(
+                prompt,
+                request_id,
+                on_progress,
+                model=LLM_MODEL,
+                system_prompt=system_prompt,
+                json_schema=json_schema,
+            )
+        )
+        record_route(ROUTE_LARGE, time.monotonic() - started)
+        return result
+
+    escalate = fields_to_escalate(small_result, fields)
+    if not escalate:
+        record_route(ROUTE_SMALL, time.monotonic() - started, len(fields))
+        return small_result
+
+    escalation_prompt = build_field_prompt(field_prompt_text(invoice_text, escalate, small_result), escalate)
+    try:
+        large_result = parse_llm_json(
+            _timed_llm_request(
+                escalation_prompt,
+                request_id,
+                on_progress,
+                model=LLM_MODEL,
+                system_prompt=build_field_system_prompt(escalate),
+                json_schema=build_json_schema(escalate),
+            )
+        )
+    except (ReplicateError, ReplicateFailed, ValueError) as exc:
+        # The small model's answers are still better than failing the extraction.
+        logger.warning("Escalation to %s failed, keeping small model fields: %s", LLM_MODEL, exc)
+        large_result = {}
+
+    result = dict(small_result)
+    for field in escalate:
+        if field in large_result:
+            result[field] = large_result[field]
+    record_route(ROUTE_ESCALATED, time.monotonic() - started, len(fields), len(escalate))
+    logger.info(
+        "Escalated %s of %s fields to %s: request_id=%s fields=%s",
+        len(escalate),
+        len(fields),
+        LLM_MODEL,
+        request_id,
+        ",".join(escalate),
+    )
+    return result
+
+
+def compact_for_prompt(invoice_text: str) -> str:
+    if not PROMPT_COMPACTION_ENABLED:
+        return invoice_text
+    compacted, stats = compact_invoice_text(invoice_text)
+    logger.info(
+        "Prompt compaction: tokens_before=%s tokens_after=%s",
+        stats["tokens_before"],
+        stats["tokens_after"],
+    )
+    return compacted
+
+
+class ExtractionRequest:
+    """
+    What the LLM is asked for one invoice, after the deterministic pre-extraction.
+
+    with_reasoning also asks for the "*_reasoning" explanations, a debug aid
+    that costs output tokens (see settings.LLM_REASONING_ENABLED).
+    """
+
+    def __init__(self, invoice_text: str, with_reasoning: bool = False):
+        self.text = compact_for_prompt(invoice_text)
+        self.prefilled = pre_extract(invoice_text) if PRE_EXTRACTION_ENABLED else {}
+        self.fields = [field for field in extraction_fields if field not in self.prefilled]
+        if self.prefilled:
+            self.prompt = build_field_prompt(self.text, self.fields, with_reasoning=with_reasoning)
+            self.system_prompt = build_field_system_prompt(self.fields, with_reasoning=with_reasoning)
+        else:
+            self.prompt = build_extraction_prompt(self.text, with_reasoning=with_reasoning)
+            self.system_prompt = system_prompt_parse_w_reasoning if with_reasoning else system_prompt_parse_lean
+        self.json_schema = build_json_schema(self.fields, with_reasoning=with_reasoning)
+
+    @property
+    def result_cache_key(self) -> str:
+        llm_input = build_llm_input(self.prompt, self.system_prompt)
+        if self.prefilled:
+            # Pre-extracted values are part of the result, so a changed extractor re-extracts.
+            llm_input += "\n" + json.dumps(self.prefilled, sort_keys=True)
+        return get_result_cache_key(llm_input)
+
+
+def get_cached_pipeline_result(file_hash: str, with_reasoning: bool = False) -> Optional[dict]:
+    """Return the pipeline result for an already-extracted PDF, without OCR or LLM calls."""
+    extraction_cache = caches[EXTRACTION_CACHE_ALIAS]
+    invoice_text = extraction_cache.get(get_ocr_cache_key(file_hash))
+    if not invoice_text or not invoice_text.strip():
+        return None
+    result_dict = extraction_cache.get(ExtractionRequest(invoice_text, with_reasoning).result_cache_key)
+    if result_dict is None:
+        return None
+    return finalize_result(result_dict)
+
+
+def get_invoice_text(pdf_data: bytes, on_progress: Optional[ProgressCallback] = None) -> str:
+    """OCR markdown of a PDF, from the extraction cache when it was read before."""
+    extraction_cache = caches[EXTRACTION_CACHE_ALIAS]
+    ocr_key = get_ocr_cache_key(get_file_sha256(pdf_data))
+    invoice_text = extraction_cache.get(ocr_key)
+    if invoice_text is None:
+        with span("ocr"):
+            invoice_text, pages = run_ocr(pdf_data)
+        extraction_cache.set(ocr_key, invoice_text)
+        emit_progress(on_progress, "ocr_done", pages=len(pages), cached=False)
+    else:
+        emit_progress(on_progress, "ocr_done", pages=None, cached=True)
     if not invoice_text or not invoice_text.strip():
         raise RuntimeError("OCR_EMPTY")
-
-    prompt = f"""
-    You need to read through an invoice text and fill in several fields in a json, following provided instructions.
-    In each field '*_reasoning', provide explanations for your choices.
-    Full invoice here: {invoice_text}.
+    return invoice_text
+
+
+def pipeline(
+    source: Union[Path, bytes],
+    request_id: Optional[str] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    with_reasoning: bool = False,
+) -> dict:
+    extraction_cache = caches[EXTRACTION_CACHE_ALIAS]
+
+    invoice_text = get_invoice_text(load_pdf_bytes(source), on_progress)
+    with span("prompt"):
+        extraction = ExtractionRequest(invoice_text, with_reasoning)
+    result_key = extraction.result_cache_key
+    result_dict = extraction_cache.get(result_key)
+    if result_dict is None:
+        for key, value in extraction.prefilled.items():
+            emit_progress(on_progress, "field", key=key, value=value)
+        with llm_slot(request_id):
+            result_dict = routed_llm_extraction(
+                extraction.text,
+                extraction.prompt,
+                request_id=request_id,
+                on_progress=on_progress,
+                fields=extraction.fields,
+                system_prompt=extraction.system_prompt,
+                json_schema=extraction.json_schema,
+            )
+        check_field_formats(result_dict)
+        result_dict.update(extraction.prefilled)
+        extraction_cache.set(result_key, result_dict)
+
+    return finalize_result(result_dict)
+
+
+def reextract_fields(
+    source: Union[Path, bytes],
+    fields: List[str],
+    known: Optional[dict] = None,
+    request_id: Optional[str] = None,
+) -> dict:
     """
-    output = llm_request(prompt, request_id=request_id)
-    result_dict = json.loads(output)
+    Ask LLM_MODEL again for just the given fields of an invoice.
 
+    Uses the cached OCR text and a prompt holding only these fields' rules and
+    the invoice lines around them (located with the known values, if given).
+    Returns the finalized {"value", "confidence"} payloads of the fields answered.
+    """
+    invoice_text = compact_for_prompt(get_invoice_text(load_pdf_bytes(source)))
+    prompt = build_field_prompt(field_prompt_text(invoice_text, fields, known or {}), fields)
+    with llm_slot(request_id):
+        output = _timed_llm_request(
+            prompt,
+            request_id,
+            None,
+            model=LLM_MODEL,
+            system_prompt=build_field_system_prompt(fields),
+            json_schema=build_json_schema(fields),
+        )
+    answers = parse_llm_json(output)
+
+    result = {}
+    for field in fields:
+        payload = finalize_field(field, answers.get(field))
+        if payload is not None:
+            result[field] = payload
+    return result
+
+
+def finalize_result(result_dict: dict) -> dict:
     reasoning_fields = {
         k: v for k, v in result_dict.items() if isinstance(k, str) and "reasoning" in k
     }
@@ -128,26 +799,34 @@ def pipeline(filepath: Path, request_id: Optional[str] = None) -> dict:
 
     final_response = {}
     for k, v in result_dict.items():
-        if isinstance(k, str) and "reasoning" in k:
-            continue
-        confidence = None
-        if isinstance(v, dict):
-            value = v.get("value")
-            confidence = v.get("confidence")
-        else:
-            value = v
+        payload = finalize_field(k, v)
+        if payload is not None:
+            final_response[k] = payload
 
-        if isinstance(value, str) and not value.strip() and not confidence:
-            continue
-        if isinstance(value, list) and not value and not confidence:
-            continue
-        if isinstance(value, dict) and not value and not confidence:
-            continue
+    with span("scenario"):
+        final_response["scenario"] = determine_vat_scenarios(final_response)
+    return final_response
 
-        payload = {"value": value}
-        if confidence:
-            payload["confidence"] = confidence
-        final_response[k] = payload
 
-    final_response["scenario"] = determine_vat_scenarios(final_response)
-    return final_response
+def finalize_field(key: str, raw_value) -> Optional[dict]:
+    """Shape one raw LLM field as {"value", "confidence"}; None for reasoning and empty fields."""
+    if isinstance(key, str) and "reasoning" in key:
+        return None
+    confidence = None
+    if isinstance(raw_value, dict):
+        value = raw_value.get("value")
+        confidence = raw_value.get("confidence")
+    else:
+        value = raw_value
+
+    if isinstance(value, str) and not value.strip() and not confidence:
+        return None
+    if isinstance(value, list) and not value and not confidence:
+        return None
+    if isinstance(value, dict) and not value and not confidence:
+        return None
+
+    payload = {"value": value}
+    if confidence:
+        payload["confidence"] = confidence
+    return payload